@@ -0,0 +1,59 @@
+# Script to benchmark the off-policy training throughput (optimizer steps per second) with and without the batch prefetcher
+# Usage: python bin/benchmark_prefetch.py
+from slm_lab.experiment.control import make_agent_env
+from slm_lab.lib import logger, util
+from slm_lab.spec import spec_util
+import os
+import pandas as pd
+import time
+
+logger = logger.get_logger(__name__)
+
+# declare the benchmark settings
+spec_list = [
+    ('benchmark/dqn/dqn_cartpole.json', 'dqn_boltzmann_cartpole'),
+    ('benchmark/dqn/dqn_cartpole.json', 'ddqn_per_boltzmann_cartpole'),
+    ('experimental/sac/sac_cartpole.json', 'sac_cartpole'),
+]
+prefetch_size_list = [None, 2, 4]
+num_warmup_frames = 10000
+num_train_steps = 100
+
+
+def benchmark_prefetch(spec_file, spec_name, prefetch_size):
+    '''Fill the memory with random experiences, run the training steps, and return the optimizer steps per second'''
+    spec = spec_util.get(spec_file, spec_name)
+    spec['agent'][0]['memory']['prefetch_size'] = prefetch_size
+    spec_util.tick(spec, 'trial')
+    spec_util.tick(spec, 'session')
+    util.set_random_seed(spec)
+    agent, env = make_agent_env(spec)
+    body = agent.body
+    state = env.reset()
+    for _ in range(num_warmup_frames // env.num_envs):
+        action = body.action_space.sample() if not env.is_venv else [body.action_space.sample() for _ in range(env.num_envs)]
+        next_state, reward, done, info = env.step(action)
+        body.memory.update(state, action, reward, next_state, done)
+        state = next_state
+        if not env.is_venv and done:
+            state = env.reset()
+    algorithm = agent.algorithm
+    start = time.time()
+    for _ in range(num_train_steps):
+        algorithm.to_train = 1
+        algorithm.train()
+    opt_steps = num_train_steps * algorithm.training_iter * getattr(algorithm, 'training_batch_iter', 1)
+    opt_sps = opt_steps / (time.time() - start)
+    env.close()
+    return opt_sps
+
+
+rows = []
+for spec_file, spec_name in spec_list:
+    for prefetch_size in prefetch_size_list:
+        opt_sps = benchmark_prefetch(spec_file, spec_name, prefetch_size)
+        logger.info(f'{spec_name} prefetch_size: {prefetch_size}, opt steps/s: {opt_sps:.0f}')
+        rows.append({'spec_name': spec_name, 'prefetch_size': str(prefetch_size), 'num_cpus': os.cpu_count(), 'opt_sps': opt_sps})
+df = pd.DataFrame(rows)
+print(df.pivot(index='prefetch_size', columns='spec_name', values='opt_sps').round())
+util.write(df, 'data/benchmark_prefetch.csv')
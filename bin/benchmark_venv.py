@@ -0,0 +1,43 @@
+# Script to benchmark the vector env throughput (frames per second) over the number of worker processes
+# Usage: python bin/benchmark_venv.py
+from slm_lab.env.vec_env import make_gym_venv
+from slm_lab.lib import logger, util
+import os
+import pandas as pd
+import time
+
+logger = logger.get_logger(__name__)
+
+# declare the benchmark settings
+env_name = 'CartPole-v0'
+frame_op = None
+frame_op_len = None
+num_envs_list = [16, 64]
+num_workers_list = [1, 2, 4, 8, 16, 32, 64]
+num_steps = 1000
+
+
+def benchmark_venv(name, num_envs, num_workers):
+    '''Step the venv with random actions and return its frames per second'''
+    venv = make_gym_venv(name, num_envs, frame_op=frame_op, frame_op_len=frame_op_len, num_workers=num_workers)
+    venv.reset()
+    actions = [[venv.action_space.sample() for _ in range(num_envs)] for _ in range(num_steps)]
+    start = time.time()
+    for action in actions:
+        venv.step(action)
+    fps = num_steps * num_envs / (time.time() - start)
+    venv.close()
+    return fps
+
+
+rows = []
+for num_envs in num_envs_list:
+    for num_workers in num_workers_list:
+        if num_workers > num_envs:
+            continue
+        fps = benchmark_venv(env_name, num_envs, num_workers)
+        logger.info(f'{env_name} num_envs: {num_envs}, num_workers: {num_workers}, fps: {fps:.0f}')
+        rows.append({'env': env_name, 'num_envs': num_envs, 'num_workers': num_workers, 'num_cpus': os.cpu_count(), 'fps': fps})
+df = pd.DataFrame(rows)
+print(df.pivot(index='num_workers', columns='num_envs', values='fps').round())
+util.write(df, f'data/benchmark_venv_{env_name}.csv')
@@ -29,10 +29,22 @@ class Agent:
         # set components
         self.body = body
         body.agent = self
-        MemoryClass = getattr(memory, ps.get(self.agent_spec, 'memory.name'))
-        self.body.memory = MemoryClass(self.agent_spec['memory'], self.body)
+        global_memory = ps.get(global_nets, 'global_memory')
+        if global_memory is not None:  # Ape-X actor, which adds into the shared memory of the trial's ApexLearner
+            global_memory.body = self.body
+            self.body.memory = global_memory
+            global_nets = ps.omit(global_nets, 'global_memory')
+        else:
+            MemoryClass = getattr(memory, ps.get(self.agent_spec, 'memory.name'))
+            self.body.memory = MemoryClass(self.agent_spec['memory'], self.body)
         AlgorithmClass = getattr(algorithm, ps.get(self.agent_spec, 'algorithm.name'))
         self.algorithm = AlgorithmClass(self, global_nets)
+        # in train@ mode, restore the memory saved with the latest ckpt
+        if util.in_train_lab_mode() and self.spec['meta']['resume']:
+            self.body.memory.load()
+        # restore the env state normalizer along with the nets
+        if (util.in_train_lab_mode() and self.spec['meta']['resume']) or util.get_lab_mode() == 'enjoy':
+            self.body.env.load()
 
         logger.info(util.self_desc(self))
 
@@ -50,7 +62,10 @@ class Agent:
         if util.in_eval_lab_mode():  # eval does not update agent for training
             return
         self.body.memory.update(state, action, reward, next_state, done)
-        loss = self.algorithm.train()
+        if self.spec['meta']['distributed'] == 'apex':  # Ape-X actors only act, the trial's ApexLearner trains
+            loss = np.nan
+        else:
+            loss = self.algorithm.train()
         if not np.isnan(loss):  # set for log_summary()
             self.body.loss = loss
         explore_var = self.algorithm.update()
@@ -62,11 +77,105 @@ class Agent:
         if util.in_eval_lab_mode():  # eval does not save new models
             return
         self.algorithm.save(ckpt=ckpt)
+        self.body.env.save(ckpt=ckpt)
+        if ckpt is None:  # only the latest ckpt is resumed from
+            self.body.memory.save()
 
     @lab_api
     def close(self):
         '''Close and cleanup agent at the end of a session, e.g. save model'''
         self.save()
+        self.algorithm.close()
+        self.body.memory.close()
+
+
+class MetricsLog:
+    '''
+    Columnar log of the metrics rows in body.train_df and eval_df, with amortized O(1) append into preallocated arrays
+    total_reward_ma is updated incrementally over the last viz.PLOT_MA_WINDOW rows, and the DataFrame is only built when requested via to_df()
+    '''
+
+    def __init__(self, columns, capacity=1024):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        self.data = {col: np.full(self.capacity, np.nan, dtype=np.float32) for col in self.columns}
+        self.size = 0
+        # running sum and count of the non-nan total_reward in the last PLOT_MA_WINDOW rows
+        self.ma_sum = 0.0
+        self.ma_count = 0
+        self.df = None  # cached DataFrame, invalidated on append
+
+    def __len__(self):
+        return self.size
+
+    def grow(self):
+        '''Double the capacity of the preallocated arrays'''
+        self.capacity *= 2
+        for col, arr in self.data.items():
+            self.data[col] = np.full(self.capacity, np.nan, dtype=np.float32)
+            self.data[col][:self.size] = arr[:self.size]
+
+    def append(self, row):
+        '''
+        Append a row dict and return its total_reward_ma, the mean total_reward over the last PLOT_MA_WINDOW rows including itself
+        A row with the same frame as the last one is not stored, same as DataFrame.drop_duplicates('frame')
+        '''
+        total_reward = row['total_reward']
+        ma_sum, ma_count = self.ma_sum, self.ma_count
+        if not np.isnan(total_reward):
+            ma_sum += total_reward
+            ma_count += 1
+        out_idx = self.size - viz.PLOT_MA_WINDOW  # the row that leaves the window
+        if out_idx >= 0:
+            out_total_reward = self.data['total_reward'][out_idx]
+            if not np.isnan(out_total_reward):
+                ma_sum -= out_total_reward
+                ma_count -= 1
+        total_reward_ma = np.float32(ma_sum / ma_count) if ma_count > 0 else np.nan
+        if self.size > 0 and row['frame'] == self.data['frame'][self.size - 1]:
+            return total_reward_ma
+        if self.size == self.capacity:
+            self.grow()
+        for col in self.columns:
+            self.data[col][self.size] = row[col]
+        self.data['total_reward_ma'][self.size] = total_reward_ma
+        self.size += 1
+        self.ma_sum, self.ma_count = ma_sum, ma_count
+        self.df = None
+        return total_reward_ma
+
+    def get_last_row(self):
+        '''Get the last row as a dict'''
+        return {col: self.data[col][self.size - 1] for col in self.columns}
+
+    def load_df(self, df):
+        '''Load the rows of a saved session_df, e.g. from util.read(train_df_filepath) to resume'''
+        self.capacity = max(self.capacity, len(df))
+        self.reset()
+        for col in self.columns:
+            if col in df.columns:
+                self.data[col][:len(df)] = df[col].values
+        self.size = len(df)
+        total_rewards = self.data['total_reward'][max(self.size - viz.PLOT_MA_WINDOW, 0):self.size]
+        total_rewards = total_rewards[~np.isnan(total_rewards)]
+        self.ma_sum = float(total_rewards.astype(np.float64).sum())
+        self.ma_count = len(total_rewards)
+
+    def copy(self):
+        metrics_log = MetricsLog(self.columns, self.capacity)
+        metrics_log.data = {col: arr.copy() for col, arr in self.data.items()}
+        metrics_log.size = self.size
+        metrics_log.ma_sum, metrics_log.ma_count = self.ma_sum, self.ma_count
+        return metrics_log
+
+    def to_df(self):
+        '''Build (and cache until the next append) the DataFrame of the logged rows for analysis and plots'''
+        if self.df is None:
+            self.df = pd.DataFrame({col: self.data[col][:self.size] for col in self.columns}, columns=self.columns)
+        return self.df
 
 
 class Body:
@@ -98,9 +207,9 @@ class Body:
         self.best_total_reward_ma = -np.inf
         self.total_reward_ma = np.nan
 
-        # dataframes to track data for analysis.analyze_session
+        # metrics logs to track data for analysis.analyze_session, exposed as body.train_df and eval_df
         # track training data per episode
-        self.train_df = pd.DataFrame(columns=[
+        self.train_log = MetricsLog([
             'epi', 't', 'wall_t', 'opt_step', 'frame', 'fps', 'total_reward', 'total_reward_ma', 'loss', 'lr',
             'explore_var', 'entropy_coef', 'entropy', 'grad_norm'])
 
@@ -108,14 +217,15 @@ class Body:
         if util.in_train_lab_mode() and self.spec['meta']['resume']:
             train_df_filepath = util.get_session_df_path(self.spec, 'train')
             if os.path.exists(train_df_filepath):
-                self.train_df = util.read(train_df_filepath)
-                self.env.clock.load(self.train_df)
+                train_df = util.read(train_df_filepath)
+                self.train_log.load_df(train_df)
+                self.env.clock.load(train_df)
 
         # track eval data within run_eval. the same as train_df except for reward
         if self.spec['meta']['rigorous_eval']:
-            self.eval_df = self.train_df.copy()
+            self.eval_log = self.train_log.copy()
         else:
-            self.eval_df = self.train_df
+            self.eval_log = self.train_log
 
         # the specific agent-env interface variables for a body
         self.observation_space = self.env.observation_space
@@ -131,6 +241,14 @@ class Body:
             self.action_pdtype = policy_util.ACTION_PDS[self.action_type][0]
         self.ActionPD = policy_util.get_action_pd_cls(self.action_pdtype, self.action_type)
 
+    @property
+    def train_df(self):
+        return self.train_log.to_df()
+
+    @property
+    def eval_df(self):
+        return self.eval_log.to_df()
+
     def update(self, state, action, reward, next_state, done):
         '''Interface update method for body at agent.update()'''
         if util.get_lab_mode() == 'dev':  # log tensorboard only on dev mode
@@ -155,7 +273,7 @@ class Body:
             grad_norms = net_util.get_grad_norms(self.agent.algorithm)
             self.mean_grad_norm = np.nan if ps.is_empty(grad_norms) else np.mean(grad_norms)
 
-        row = pd.Series({
+        row = {
             # epi and frame are always measured from training env
             'epi': self.env.clock.epi,
             # t and reward are measured from a given env or eval_env
@@ -172,8 +290,8 @@ class Body:
             'entropy_coef': self.entropy_coef if hasattr(self, 'entropy_coef') else np.nan,
             'entropy': self.mean_entropy,
             'grad_norm': self.mean_grad_norm,
-        }, dtype=np.float32)
-        assert all(col in self.train_df.columns for col in row.index), f'Mismatched row keys: {row.index} vs df columns {self.train_df.columns}'
+        }
+        assert all(col in row for col in self.train_log.columns), f'Mismatched row keys: {list(row)} vs df columns {self.train_log.columns}'
         return row
 
     def ckpt(self, env, df_mode):
@@ -183,11 +301,8 @@ class Body:
         @param str:df_mode 'train' or 'eval'
         '''
         row = self.calc_df_row(env)
-        df = getattr(self, f'{df_mode}_df')
-        df.loc[len(df)] = row  # append efficiently to df
-        df.iloc[-1]['total_reward_ma'] = total_reward_ma = df[-viz.PLOT_MA_WINDOW:]['total_reward'].mean()
-        df.drop_duplicates('frame', inplace=True)  # remove any duplicates by the same frame
-        self.total_reward_ma = total_reward_ma
+        metrics_log = getattr(self, f'{df_mode}_log')
+        self.total_reward_ma = metrics_log.append(row)  # skips any duplicate by the same frame
 
     def get_mean_lr(self):
         '''Gets the average current learning rate of the algorithm's nets.'''
@@ -220,8 +335,7 @@ class Body:
         @param str:df_mode 'train' or 'eval'
         '''
         prefix = self.get_log_prefix()
-        df = getattr(self, f'{df_mode}_df')
-        last_row = df.iloc[-1]
+        last_row = getattr(self, f'{df_mode}_log').get_last_row()
         row_str = '  '.join([f'{k}: {v:g}' for k, v in last_row.items()])
         msg = f'{prefix} [{df_mode}_df] {row_str}'
         logger.info(msg)
@@ -252,7 +366,7 @@ class Body:
             net = self.agent.algorithm.net
             self.tb_writer.add_graph(net, torch.rand(ps.flatten([8, net.in_dim])))
         # add summary variables
-        last_row = self.train_df.iloc[-1]
+        last_row = self.train_log.get_last_row()
         for k, v in last_row.items():
             self.tb_writer.add_scalar(f'{k}/{idx_suffix}', v, frame)
         # add network parameters
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from slm_lab.agent.memory.prefetcher import BatchPrefetcher
 from slm_lab.agent.net import net_util
 from slm_lab.lib import logger, util
 from slm_lab.lib.decorator import lab_api
@@ -52,6 +53,23 @@ class Algorithm(ABC):
         else:
             logger.info(f'Initialized algorithm models for lab_mode: {lab_mode}')
 
+    def init_prefetcher(self, memory):
+        '''Set self.prefetcher to sample the training batches of memory in the background if memory_spec.prefetch_size is set, see BatchPrefetcher'''
+        prefetch_size = self.memory_spec.get('prefetch_size')
+        self.prefetcher = BatchPrefetcher(memory, self.net.device, prefetch_size) if prefetch_size else None
+
+    def close(self):
+        '''Close the algorithm at the end of a session, e.g. stop the prefetcher thread'''
+        if getattr(self, 'prefetcher', None) is not None:
+            self.prefetcher.close()
+
+    def update_priorities(self, memory, errors):
+        '''Update the PER priorities of the last sampled batch, through the prefetcher if any since it samples ahead'''
+        if getattr(self, 'prefetcher', None) is not None:
+            self.prefetcher.update_priorities(errors)
+        else:
+            memory.update_priorities(errors)
+
     @lab_api
     def calc_pdparam(self, x, net=None):
         '''
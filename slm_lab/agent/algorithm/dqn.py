@@ -86,6 +86,7 @@ class VanillaDQN(SARSA):
         self.lr_scheduler = net_util.get_lr_scheduler(self.optim, self.net.lr_scheduler_spec)
         net_util.set_global_nets(self, global_nets)
         self.end_init_nets()
+        self.init_prefetcher(self.body.memory)
 
     def calc_q_loss(self, batch):
         '''Compute the Q value loss using predicted and target Q values from the appropriate networks'''
@@ -97,14 +98,15 @@ class VanillaDQN(SARSA):
         act_q_preds = q_preds.gather(-1, batch['actions'].long().unsqueeze(-1)).squeeze(-1)
         # Bellman equation: compute max_q_targets using reward and max estimated Q values (0 if no next_state)
         max_next_q_preds, _ = next_q_preds.max(dim=-1, keepdim=False)
-        max_q_targets = batch['rewards'] + self.gamma * (1 - batch['dones']) * max_next_q_preds
+        discounts = batch.get('discounts', self.gamma)  # per-sample gamma^n from NStepReplay
+        max_q_targets = batch['rewards'] + discounts * (1 - batch['dones']) * max_next_q_preds
         logger.debug(f'act_q_preds: {act_q_preds}\nmax_q_targets: {max_q_targets}')
         q_loss = self.net.loss_fn(act_q_preds, max_q_targets)
 
         # TODO use the same loss_fn but do not reduce yet
         if 'Prioritized' in util.get_class_name(self.body.memory):  # PER
             errors = (max_q_targets - act_q_preds.detach()).abs().cpu().numpy()
-            self.body.memory.update_priorities(errors)
+            self.update_priorities(self.body.memory, errors)
         return q_loss
 
     @lab_api
@@ -115,6 +117,8 @@ class VanillaDQN(SARSA):
     @lab_api
     def sample(self):
         '''Samples a batch from memory of size self.memory_spec['batch_size']'''
+        if self.prefetcher is not None:
+            return self.prefetcher.sample()
         batch = self.body.memory.sample()
         batch = util.to_torch_batch(batch, self.net.device, self.body.memory.is_episodic)
         return batch
@@ -130,6 +134,8 @@ class VanillaDQN(SARSA):
         '''
         clock = self.body.env.clock
         if self.to_train == 1:
+            if self.prefetcher is not None:
+                self.prefetcher.prefetch(self.training_iter)
             total_loss = torch.tensor(0.0, device=self.net.device)
             for _ in range(self.training_iter):
                 batch = self.sample()
@@ -184,6 +190,7 @@ class DQNBase(VanillaDQN):
         self.lr_scheduler = net_util.get_lr_scheduler(self.optim, self.net.lr_scheduler_spec)
         net_util.set_global_nets(self, global_nets)
         self.end_init_nets()
+        self.init_prefetcher(self.body.memory)
         self.online_net = self.target_net
         self.eval_net = self.target_net
 
@@ -200,14 +207,15 @@ class DQNBase(VanillaDQN):
         act_q_preds = q_preds.gather(-1, batch['actions'].long().unsqueeze(-1)).squeeze(-1)
         online_actions = online_next_q_preds.argmax(dim=-1, keepdim=True)
         max_next_q_preds = next_q_preds.gather(-1, online_actions).squeeze(-1)
-        max_q_targets = batch['rewards'] + self.gamma * (1 - batch['dones']) * max_next_q_preds
+        discounts = batch.get('discounts', self.gamma)  # per-sample gamma^n from NStepReplay
+        max_q_targets = batch['rewards'] + discounts * (1 - batch['dones']) * max_next_q_preds
         logger.debug(f'act_q_preds: {act_q_preds}\nmax_q_targets: {max_q_targets}')
         q_loss = self.net.loss_fn(act_q_preds, max_q_targets)
 
         # TODO use the same loss_fn but do not reduce yet
         if 'Prioritized' in util.get_class_name(self.body.memory):  # PER
             errors = (max_q_targets - act_q_preds.detach()).abs().cpu().numpy()
-            self.body.memory.update_priorities(errors)
+            self.update_priorities(self.body.memory, errors)
         return q_loss
 
     def update_nets(self):
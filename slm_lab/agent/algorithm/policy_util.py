@@ -56,10 +56,12 @@ def get_action_pd_cls(action_pdtype, action_type):
 
 
 def guard_tensor(state, body):
-    '''Guard-cast tensor before being input to network'''
+    '''Guard-cast tensor before being input to network; uint8 image states are kept for the net to convert on its device'''
     if isinstance(state, LazyFrames):
         state = state.__array__()  # realize data
-    state = torch.from_numpy(state.astype(np.float32))
+    if state.dtype != np.uint8:
+        state = state.astype(np.float32)
+    state = torch.from_numpy(state)
     if not body.env.is_venv:
         # singleton state, unsqueeze as minibatch for net input
         state = state.unsqueeze(dim=0)
@@ -82,7 +84,11 @@ def calc_pdparam(state, algorithm, body):
     if not torch.is_tensor(state):  # dont need to cast from numpy
         state = guard_tensor(state, body)
         state = state.to(algorithm.net.device)
-    pdparam = algorithm.calc_pdparam(state)
+    inference_client = getattr(algorithm, 'inference_client', None)
+    if inference_client is not None:  # batched with other sessions by the trial's InferenceServer
+        pdparam = inference_client.calc_pdparam(state)
+    else:
+        pdparam = algorithm.calc_pdparam(state)
     return pdparam
 
 
@@ -141,8 +147,8 @@ def default(state, algorithm, body):
 
 def random(state, algorithm, body):
     '''Random action using gym.action_space.sample(), with the same format as default()'''
-    if body.env.is_venv:
-        _action = [body.action_space.sample() for _ in range(body.env.num_envs)]
+    if body.env.is_venv:  # state may be of a subset of the envs when stepping async
+        _action = [body.action_space.sample() for _ in range(len(state))]
     else:
         _action = [body.action_space.sample()]
     action = torch.tensor(_action)
@@ -91,6 +91,7 @@ class SoftActorCritic(ActorCritic):
         self.alpha_lr_scheduler = net_util.get_lr_scheduler(self.alpha_optim, self.net.lr_scheduler_spec)
         net_util.set_global_nets(self, global_nets)
         self.end_init_nets()
+        self.init_prefetcher(self.body.memory)
 
     @lab_api
     def act(self, state):
@@ -176,7 +177,7 @@ class SoftActorCritic(ActorCritic):
         if 'Prioritized' in util.get_class_name(self.body.memory):  # PER
             with torch.no_grad():
                 errors = (q_preds - q_targets).abs().cpu().numpy()
-            self.body.memory.update_priorities(errors)
+            self.update_priorities(self.body.memory, errors)
 
     def train_alpha(self, alpha_loss):
         '''Custom method to train the alpha variable'''
@@ -186,10 +187,19 @@ class SoftActorCritic(ActorCritic):
         self.alpha_optim.step()
         self.alpha = self.log_alpha.detach().exp()
 
+    @lab_api
+    def sample(self):
+        '''Samples a batch from memory, prefetched in the background if memory_spec.prefetch_size is set'''
+        if self.prefetcher is not None:
+            return self.prefetcher.sample()
+        return super().sample()
+
     def train(self):
         '''Train actor critic by computing the loss in batch efficiently'''
         clock = self.body.env.clock
         if self.to_train == 1:
+            if self.prefetcher is not None:
+                self.prefetcher.prefetch(self.training_iter)
             for _ in range(self.training_iter):
                 batch = self.sample()
                 clock.set_batch_size(len(batch))
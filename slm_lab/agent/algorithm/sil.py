@@ -56,6 +56,11 @@ class SIL(ActorCritic):
         # create the extra replay memory for SIL
         MemoryClass = getattr(memory, self.memory_spec['sil_replay_name'])
         self.body.replay_memory = MemoryClass(self.memory_spec, self.body)
+        self.init_prefetcher(self.body.replay_memory)
+
+    def close(self):
+        super().close()
+        self.body.replay_memory.close()
 
     @lab_api
     def init_algorithm_params(self):
@@ -93,14 +98,16 @@ class SIL(ActorCritic):
         batch = self.body.memory.sample()
         if self.body.memory.is_episodic:
             batch = {k: np.concatenate(v) for k, v in batch.items()}  # concat episodic memory
-        for idx in range(len(batch['dones'])):
-            tuples = [batch[k][idx] for k in self.body.replay_memory.data_keys]
-            self.body.replay_memory.add_experience(*tuples)
+        else:
+            batch = {k: v.copy() for k, v in batch.items()}  # the on-policy buffers are reused by the next rollout, but replay keeps the data
+        self.body.replay_memory.add_batch(batch['states'], batch['actions'], batch['rewards'], batch['next_states'], batch['dones'])
         batch = util.to_torch_batch(batch, self.net.device, self.body.replay_memory.is_episodic)
         return batch
 
     def replay_sample(self):
         '''Samples a batch from memory'''
+        if self.prefetcher is not None:
+            return self.prefetcher.sample()
         batch = self.body.replay_memory.sample()
         batch = util.to_torch_batch(batch, self.net.device, self.body.replay_memory.is_episodic)
         return batch
@@ -135,6 +142,8 @@ class SIL(ActorCritic):
             super_loss = super().train()
             # offpolicy sil update with random minibatch
             total_sil_loss = torch.tensor(0.0, device=self.net.device)
+            if self.prefetcher is not None:
+                self.prefetcher.prefetch(self.training_iter)
             for _ in range(self.training_iter):
                 batch = self.replay_sample()
                 for _ in range(self.training_batch_iter):
@@ -3,3 +3,4 @@
 from .replay import *
 from .onpolicy import *
 from .prioritized import *
+from .shared import *
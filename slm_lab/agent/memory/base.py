@@ -33,3 +33,15 @@ class Memory(ABC):
     def sample(self):
         '''Implement memory sampling mechanism'''
         raise NotImplementedError
+
+    def save(self):
+        '''Save a snapshot of the memory with the agent's latest ckpt to restore on train@ resume; nothing to save by default, e.g. for on-policy memories which are cleared after every training step'''
+        pass
+
+    def load(self):
+        '''Restore the memory from the snapshot saved by save()'''
+        pass
+
+    def close(self):
+        '''Release the resources of the memory at the end of a session, e.g. threads; nothing by default'''
+        pass
@@ -29,6 +29,9 @@ class OnPolicyReplay(Memory):
         - The entire memory constitues a batch. In Replay batches are sampled from memory.
         - The memory is cleared automatically when a batch is given to the agent.
 
+    The experiences are written in place into float32 (uint8 for image states) rollout buffers of shape (capacity, *data_shape), preallocated at the first experience and grown by doubling if needed. The episodes are views into the buffers, so sampling and converting them to torch tensors does not copy per experience.
+    NOTE the buffers are reused for the next rollout after sample(), so copy a batch if it needs to outlive the training step.
+
     e.g. memory_spec
     "memory": {
         "name": "OnPolicyReplay"
@@ -44,6 +47,7 @@ class OnPolicyReplay(Memory):
         self.seen_size = 0  # total experiences seen cumulatively
         # declare what data keys to store
         self.data_keys = ['states', 'actions', 'rewards', 'next_states', 'dones']
+        self.buffers = None  # preallocated at the first experience
         self.reset()
 
     @lab_api
@@ -51,9 +55,42 @@ class OnPolicyReplay(Memory):
         '''Resets the memory. Also used to initialize memory vars'''
         for k in self.data_keys:
             setattr(self, k, [])
-        self.cur_epi_data = {k: [] for k in self.data_keys}
         self.most_recent = (None,) * len(self.data_keys)
         self.size = 0
+        self.epi_start = 0  # buffer index where the current episode starts
+        self.cur_epi_data = self.get_views(0, 0)
+
+    def get_init_capacity(self):
+        '''Initial number of experiences of the buffers; episodes have unknown lengths and rely on doubling'''
+        return 1024
+
+    def init_buffers(self, experience):
+        '''Preallocate the rollout buffers with the shapes of the first experience'''
+        capacity = self.get_init_capacity()
+        # image states are kept as uint8 and only converted to float in the net
+        state_dtype = np.uint8 if self.body.observation_space.dtype == np.uint8 else np.float32
+        self.buffers = {k: np.zeros((capacity,) + np.shape(v), dtype=state_dtype if k in ('states', 'next_states') else np.float32) for k, v in zip(self.data_keys, experience)}
+
+    def grow_buffers(self):
+        '''Double the buffer capacity; existing views keep pointing to the old buffers, which hold the same data'''
+        for k, buf in self.buffers.items():
+            self.buffers[k] = np.zeros((2 * len(buf),) + buf.shape[1:], dtype=buf.dtype)
+            self.buffers[k][:self.size] = buf[:self.size]
+
+    def get_views(self, start, end):
+        '''Get the views of the buffers over the experiences [start, end)'''
+        if self.buffers is None:
+            return {k: [] for k in self.data_keys}
+        return {k: buf[start:end] for k, buf in self.buffers.items()}
+
+    def write_experience(self, experience):
+        '''Write an experience in place into the buffers at self.size'''
+        if self.buffers is None:
+            self.init_buffers(experience)
+        elif self.size == len(self.buffers['states']):
+            self.grow_buffers()
+        for k, v in zip(self.data_keys, experience):
+            self.buffers[k][self.size] = v
 
     @lab_api
     def update(self, state, action, reward, next_state, done):
@@ -63,25 +100,26 @@ class OnPolicyReplay(Memory):
     def add_experience(self, state, action, reward, next_state, done):
         '''Interface helper method for update() to add experience to memory'''
         self.most_recent = (state, action, reward, next_state, done)
-        for idx, k in enumerate(self.data_keys):
-            self.cur_epi_data[k].append(self.most_recent[idx])
+        self.write_experience(self.most_recent)
+        # Track memory size and num experiences
+        self.size += 1
+        self.seen_size += 1
+        self.cur_epi_data = self.get_views(self.epi_start, self.size)
         # If episode ended, add to memory and clear cur_epi_data
         if util.epi_done(done):
             for k in self.data_keys:
                 getattr(self, k).append(self.cur_epi_data[k])
-            self.cur_epi_data = {k: [] for k in self.data_keys}
+            self.epi_start = self.size
+            self.cur_epi_data = self.get_views(self.size, self.size)
             # If agent has collected the desired number of episodes, it is ready to train
             # length is num of epis due to nested structure
             if len(self.states) == self.body.agent.algorithm.training_frequency:
                 self.body.agent.algorithm.to_train = 1
-        # Track memory size and num experiences
-        self.size += 1
-        self.seen_size += 1
 
     def sample(self):
         '''
         Returns all the examples from memory in a single batch. Batch is stored as a dict.
-        Keys are the names of the different elements of an experience. Values are nested lists of the corresponding sampled elements. Elements are nested into episodes
+        Keys are the names of the different elements of an experience. Values are nested lists of the corresponding sampled elements. Elements are nested into episodes, each a view into the buffers
         e.g.
         batch = {
             'states'     : [[s_epi1], [s_epi2], ...],
@@ -114,14 +152,24 @@ class OnPolicyBatchReplay(OnPolicyReplay):
         super().__init__(memory_spec, body)
         self.is_episodic = False
 
+    @lab_api
+    def reset(self):
+        '''Resets the memory. Also used to initialize memory vars'''
+        super().reset()
+        util.set_attr(self, self.get_views(0, 0))
+
+    def get_init_capacity(self):
+        '''The rollout is training_frequency experiences, e.g. (time_horizon, num_envs, *shape) for a vec env'''
+        return max(self.body.agent.algorithm.training_frequency, 1)
+
     def add_experience(self, state, action, reward, next_state, done):
         '''Interface helper method for update() to add experience to memory'''
         self.most_recent = [state, action, reward, next_state, done]
-        for idx, k in enumerate(self.data_keys):
-            getattr(self, k).append(self.most_recent[idx])
+        self.write_experience(self.most_recent)
         # Track memory size and num experiences
         self.size += 1
         self.seen_size += 1
+        util.set_attr(self, self.get_views(0, self.size))
         # Decide if agent is to train
         if len(self.states) == self.body.agent.algorithm.training_frequency:
             self.body.agent.algorithm.to_train = 1
@@ -129,7 +177,7 @@ class OnPolicyBatchReplay(OnPolicyReplay):
     def sample(self):
         '''
         Returns all the examples from memory in a single batch. Batch is stored as a dict.
-        Keys are the names of the different elements of an experience. Values are a list of the corresponding sampled elements
+        Keys are the names of the different elements of an experience. Values are the views of the buffers over the sampled elements
         e.g.
         batch = {
             'states'     : states,
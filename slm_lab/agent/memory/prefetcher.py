@@ -0,0 +1,90 @@
+from slm_lab.lib import logger, util
+import queue
+import threading
+import torch
+
+logger = logger.get_logger(__name__)
+
+# memory attributes set by sample() which identify the sampled batch, e.g. for PER update_priorities
+BATCH_IDX_KEYS = ['batch_idxs', 'tree_idxs']
+
+
+class BatchPrefetcher:
+    '''
+    Background sampler for the off-policy training loops (DQN, SAC, SIL).
+    At the start of a training step, the algorithm requests its training_iter batches with prefetch(), and a worker thread samples them from the memory and converts them into float32 torch batches (pinned and copied non-blocking to a GPU), keeping up to prefetch_size of them ready while the learner trains on the previous one.
+    The memory is not modified by the agent during a training step, so the prefetched batches are the same as the synchronous ones, except that PER samples the next batch before the priorities of the current one are updated.
+    For PER, sample() restores the batch idxs of the batch it returns, and update_priorities() applies to that batch, i.e. the one actually trained on.
+
+    e.g. memory_spec
+    "memory": {
+        "name": "PrioritizedReplay",
+        "alpha": 0.6,
+        "epsilon": 0.0001,
+        "batch_size": 32,
+        "max_size": 10000,
+        "use_cer": false,
+        "prefetch_size": 2
+    }
+    '''
+
+    def __init__(self, memory, device, prefetch_size=2):
+        self.memory = memory
+        self.device = device
+        self.pin_memory = str(device).startswith('cuda')
+        self.lock = threading.Lock()  # guards the memory shared by the worker sample() and the learner update_priorities()
+        self.request_queue = queue.Queue()
+        self.batch_queue = queue.Queue(maxsize=prefetch_size)
+        self.batch_idxs = {}
+        self.closed = False
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        '''Worker loop to sample the requested number of batches into batch_queue'''
+        while True:
+            num_batches = self.request_queue.get()
+            if num_batches is None:  # sentinel from close()
+                return
+            for _ in range(num_batches):
+                if self.closed:
+                    break
+                try:
+                    with self.lock:
+                        batch = self.memory.sample()
+                        batch_idxs = {k: getattr(self.memory, k) for k in BATCH_IDX_KEYS if hasattr(self.memory, k)}
+                    batch = util.to_torch_batch(batch, torch.device('cpu'), self.memory.is_episodic)
+                    if self.pin_memory:
+                        batch = {k: v.pin_memory().to(self.device, non_blocking=True) for k, v in batch.items()}
+                    self.batch_queue.put((batch, batch_idxs))
+                except Exception as e:  # raise in the learner thread
+                    self.batch_queue.put((e, None))
+
+    def prefetch(self, num_batches):
+        '''Request num_batches batches to be sampled in the background for the training step that follows'''
+        self.request_queue.put(num_batches)
+
+    def sample(self):
+        '''Get the next prefetched batch, and restore its batch idxs on the memory'''
+        batch, batch_idxs = self.batch_queue.get()
+        if isinstance(batch, Exception):
+            raise batch
+        self.batch_idxs = batch_idxs
+        return batch
+
+    def close(self):
+        '''Stop the worker thread and join it, discarding the batches not yet sampled'''
+        self.closed = True
+        self.request_queue.put(None)
+        while self.thread.is_alive():  # unblock the worker if it is waiting for room in batch_queue
+            try:
+                self.batch_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.thread.join(timeout=0.01)
+
+    def update_priorities(self, errors):
+        '''Update the PER priorities of the batch last returned by sample()'''
+        with self.lock:
+            util.set_attr(self.memory, self.batch_idxs)
+            self.memory.update_priorities(errors)
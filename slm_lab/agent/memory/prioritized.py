@@ -2,7 +2,6 @@ from slm_lab.agent.memory.replay import Replay
 from slm_lab.lib import util
 from slm_lab.lib.decorator import lab_api
 import numpy as np
-import random
 
 
 class SumTree:
@@ -29,6 +28,7 @@ class SumTree:
         self.capacity = capacity
         self.tree = np.zeros(2 * capacity - 1)  # Stores the priorities and sums of priorities
         self.indices = np.zeros(capacity)  # Stores the indices of the experiences
+        self.depth = int(np.log2(2 * capacity - 1))  # depth of the deepest leaf
 
     def _propagate(self, idx, change):
         parent = (idx - 1) // 2
@@ -63,6 +63,13 @@ class SumTree:
         if self.write >= self.capacity:
             self.write = 0
 
+    def add_batch(self, ps, indices):
+        '''Batched version of add for arrays of priorities ps and data indices, written in one update_batch pass'''
+        writes = (self.write + np.arange(len(ps))) % self.capacity
+        self.indices[writes] = indices
+        self.update_batch(writes + self.capacity - 1, ps)
+        self.write = int((self.write + len(ps)) % self.capacity)
+
     def update(self, idx, p):
         change = p - self.tree[idx]
 
@@ -76,6 +83,38 @@ class SumTree:
 
         return (idx, self.tree[idx], self.indices[indexIdx])
 
+    def get_batch(self, s):
+        '''
+        Batched version of get for an array of prefix sums s. Walks all of them down the tree level by level instead of recursing one by one.
+        @returns (tree_idxs, priorities, data indices), each an array of the same length as s
+        '''
+        s = np.array(s, dtype=self.tree.dtype)
+        assert np.all(s <= self.total())
+        idxs = np.zeros(len(s), dtype=int)
+        for _ in range(self.depth):
+            # leaves can be at two different depths; nodes [0, capacity - 1) have children, leaves stay in place
+            is_internal = idxs < self.capacity - 1
+            left = np.where(is_internal, 2 * idxs + 1, idxs)
+            left_sum = self.tree[left]
+            go_right = is_internal & (s > left_sum)
+            s = np.where(go_right, s - left_sum, s)
+            idxs = left + go_right
+        index_idxs = idxs - self.capacity + 1
+        return idxs, self.tree[idxs], self.indices[index_idxs]
+
+    def update_batch(self, idxs, ps):
+        '''
+        Batched version of update for arrays of tree idxs and priorities ps. Sets all the leaves, then recomputes their ancestors level by level up to the root.
+        As with repeated update calls, the last priority of a duplicate idx wins.
+        '''
+        idxs = np.asarray(idxs, dtype=int)
+        self.tree[idxs] = ps
+        parents = idxs
+        # since leaves can be at two depths, an ancestor may be recomputed several times; its last pass comes after its children are final
+        for _ in range(self.depth):
+            parents = np.maximum((parents - 1) // 2, 0)
+            self.tree[parents] = self.tree[2 * parents + 1] + self.tree[2 * parents + 2]
+
     def print_tree(self):
         for i in range(len(self.indices)):
             j = i + self.capacity - 1
@@ -124,6 +163,24 @@ class PrioritizedReplay(Replay):
         super().reset()
         self.tree = SumTree(self.max_size)
 
+    def get_snapshot(self):
+        '''Also save the SumTree and the priorities, which change after their experiences are saved in chunks'''
+        snapshot = super().get_snapshot()
+        snapshot.update({
+            'tree': self.tree.tree,
+            'tree_indices': self.tree.indices,
+            'tree_write': self.tree.write,
+            'priorities': np.array(self.priorities[:self.size], dtype=np.float64),  # the ring is filled from 0
+        })
+        return snapshot
+
+    def load_snapshot(self, snapshot):
+        super().load_snapshot(snapshot)
+        self.tree.tree[:] = snapshot['tree']
+        self.tree.indices[:] = snapshot['tree_indices']
+        self.tree.write = int(snapshot['tree_write'])
+        util.batch_set(self.priorities, range(self.size), snapshot['priorities'])
+
     def add_experience(self, state, action, reward, next_state, done, error=100000):
         '''
         Implementation for update() to add experience to memory, expanding the memory size if necessary.
@@ -134,22 +191,24 @@ class PrioritizedReplay(Replay):
         self.priorities[self.head] = priority
         self.tree.add(priority, self.head)
 
+    def add_batch(self, states, actions, rewards, next_states, dones, errors=100000):
+        '''Batched add_experience, which also inserts the priorities of the experiences into the SumTree in one pass'''
+        idxs = super().add_batch(states, actions, rewards, next_states, dones)
+        priorities = np.broadcast_to(self.get_priority(np.asarray(errors, dtype=np.float64)), (len(dones),))[-len(idxs):]
+        util.batch_set(self.priorities, idxs, priorities)
+        self.tree.write = (self.tree.write + len(dones) - len(idxs)) % self.tree.capacity  # skip the experiences overwritten within the batch
+        self.tree.add_batch(priorities, idxs)
+        return idxs
+
     def get_priority(self, error):
         '''Takes in the error of one or more examples and returns the proportional priority'''
         return np.power(error + self.epsilon, self.alpha).squeeze()
 
     def sample_idxs(self, batch_size):
         '''Samples batch_size indices from memory in proportional to their priority.'''
-        batch_idxs = np.zeros(batch_size)
-        tree_idxs = np.zeros(batch_size, dtype=np.int)
-
-        for i in range(batch_size):
-            s = random.uniform(0, self.tree.total())
-            (tree_idx, p, idx) = self.tree.get(s)
-            batch_idxs[i] = idx
-            tree_idxs[i] = tree_idx
-
-        batch_idxs = np.asarray(batch_idxs).astype(int)
+        s = np.random.uniform(0, self.tree.total(), size=batch_size)
+        tree_idxs, _ps, batch_idxs = self.tree.get_batch(s)
+        batch_idxs = batch_idxs.astype(int)
         self.tree_idxs = tree_idxs
         if self.use_cer:  # add the latest sample
             batch_idxs[-1] = self.head
@@ -162,7 +221,5 @@ class PrioritizedReplay(Replay):
         '''
         priorities = self.get_priority(errors)
         assert len(priorities) == self.batch_idxs.size
-        for idx, p in zip(self.batch_idxs, priorities):
-            self.priorities[idx] = p
-        for p, i in zip(priorities, self.tree_idxs):
-            self.tree.update(i, p)
+        util.batch_set(self.priorities, self.batch_idxs, priorities)
+        self.tree.update_batch(self.tree_idxs, priorities)
@@ -1,22 +1,31 @@
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
+from functools import partial
 from slm_lab.agent.memory.base import Memory
 from slm_lab.lib import logger, math_util, util
 from slm_lab.lib.decorator import lab_api
+import itertools
 import numpy as np
+import os
 import pydash as ps
+import sys
+import zlib
 
 logger = logger.get_logger(__name__)
 
+# idxs of the Replay memories created in this process, to tell their memmap files apart, e.g. of SIL's extra replay memory
+MEMORY_IDXS = itertools.count()
+
 
 def sample_next_states(head, max_size, ns_idx_offset, batch_idxs, states, ns_buffer):
     '''Method to sample next_states from states, with proper guard for next_state idx being out of bound'''
     # idxs for next state is state idxs with offset, modded
     ns_batch_idxs = (batch_idxs + ns_idx_offset) % max_size
-    # if head < ns_idx <= head + ns_idx_offset, ns is stored in ns_buffer
+    # if head < ns_idx <= head + ns_idx_offset in the ring, ns is stored in ns_buffer
     ns_batch_idxs = ns_batch_idxs % max_size
     buffer_ns_locs = np.argwhere(
-        (head < ns_batch_idxs) & (ns_batch_idxs <= head + ns_idx_offset)).flatten()
+        (ns_batch_idxs - head - 1) % max_size < ns_idx_offset).flatten()
     # find if there is any idxs to get from buffer
     to_replace = buffer_ns_locs.size != 0
     if to_replace:
@@ -25,7 +34,7 @@ def sample_next_states(head, max_size, ns_idx_offset, batch_idxs, states, ns_buf
         # get 0 < ns_idx - head <= offset, or equiv.
         # get -1 < ns_idx - head - 1 <= offset - 1, i.e.
         # get 0 <= ns_idx - head - 1 < offset, hence:
-        buffer_idxs = ns_batch_idxs[buffer_ns_locs] - head - 1
+        buffer_idxs = (ns_batch_idxs[buffer_ns_locs] - head - 1) % max_size
         # set them to 0 first to allow sampling, then replace later with buffer
         ns_batch_idxs[buffer_ns_locs] = 0
     # guard all against overrun idxs from offset
@@ -38,6 +47,78 @@ def sample_next_states(head, max_size, ns_idx_offset, batch_idxs, states, ns_buf
     return next_states
 
 
+def get_codec(codec):
+    '''
+    Get the (compress, decompress) functions of a codec for CompressedStates: "lz4" (lz4 package), "zstd" (zstandard package), or "zlib".
+    lz4 and zstd are optional dependencies; if the package is not installed, fall back to zlib.
+    '''
+    if codec == 'lz4':
+        try:
+            import lz4.frame
+            return lz4.frame.compress, lz4.frame.decompress
+        except ImportError:
+            logger.warning('Package lz4 is not installed, falling back to zlib compression. Install it with `pip install lz4`')
+    elif codec == 'zstd':
+        try:
+            import zstandard
+            return partial(zstandard.compress, level=1), zstandard.decompress
+        except ImportError:
+            logger.warning('Package zstandard is not installed, falling back to zlib compression. Install it with `pip install zstandard`')
+    elif codec != 'zlib':
+        raise ValueError(f'Unrecognized compress_codec {codec}. Choose from "lz4", "zstd", "zlib".')
+    return partial(zlib.compress, level=1), zlib.decompress
+
+
+class CompressedStates:
+    '''
+    Storage of states compressed per transition, indexable like an np.array of shape (max_size, *shape) and dtype.
+    States are compressed as their bytes in dtype, e.g. uint8 for image frames. A batch of idxs is decompressed in a thread pool, since the codecs release the GIL; close() shuts it down.
+    '''
+
+    def __init__(self, max_size, shape, dtype, codec, num_workers=None):
+        self.shape = (max_size,) + shape
+        self.dtype = dtype
+        self.compress, self.decompress = get_codec(codec)
+        self.num_workers = num_workers or min(4, os.cpu_count())
+        self.pool = None  # created on first batch get
+        self.data = [None] * max_size
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __setitem__(self, idxs, states):
+        if np.isscalar(idxs):
+            idxs, states = [idxs], [states]
+        for idx, state in zip(idxs, states):
+            self.data[idx] = self.compress(np.ascontiguousarray(state, dtype=self.dtype).tobytes())
+
+    def get_into(self, idxs, out):
+        for i, idx in enumerate(idxs):
+            d = self.data[idx]
+            out[i] = 0 if d is None else np.frombuffer(self.decompress(d), dtype=self.dtype).reshape(self.shape[1:])
+
+    def __getitem__(self, idxs):
+        if np.isscalar(idxs):
+            return self[np.array([idxs])][0]
+        idxs = np.asarray(idxs)
+        flat_idxs = idxs.reshape(-1)
+        out = np.empty((len(flat_idxs),) + self.shape[1:], dtype=self.dtype)
+        if len(flat_idxs) < 2 * self.num_workers:
+            self.get_into(flat_idxs, out)
+        else:  # decompress chunks in parallel into the slices of out
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(self.num_workers)
+            bounds = np.linspace(0, len(flat_idxs), self.num_workers + 1).astype(int)
+            list(self.pool.map(lambda b: self.get_into(flat_idxs[b[0]:b[1]], out[b[0]:b[1]]), zip(bounds[:-1], bounds[1:])))
+        return out.reshape(idxs.shape + self.shape[1:])
+
+    def close(self):
+        '''Shut down the decompression thread pool, if any'''
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
 class Replay(Memory):
     '''
     Stores agent experiences and samples from them for agent training
@@ -58,27 +139,72 @@ class Replay(Memory):
 
     If 'use_cer', sampling will add the latest experience.
 
+    The storage backend is selected with 'storage':
+        - 'list' (default): each element is stored as a separate object in a python list of size N
+        - 'array': each data key is preallocated as a contiguous np.array of shape (N, *element shape), with shape and dtype inferred from the body's observation and action spaces. This avoids the per-object overhead of large buffers, and samples by fancy indexing.
+        - 'memmap': as 'array', but the data keys in 'memmap_keys' are np.memmap (.npy) files next to the session's meta.prepath instead of RAM, for buffers larger than the memory of a node, e.g. 1M-transition Atari buffers of several parallel sessions. The other keys stay in RAM, so 'memmap_keys' sets the memory/disk split. Experiences are written sequentially at the head and sampled by random-index reads, which the OS page cache serves for recently used pages.
+    States are stored as uint8 for image observations, i.e. with a uint8 observation space, and only converted to float by the net on its device; other states are stored as float16.
+
     e.g. memory_spec
     "memory": {
         "name": "Replay",
         "batch_size": 32,
         "max_size": 10000,
-        "use_cer": true
+        "use_cer": true,
+        "storage": "array"
+    }
+
+    The memory is saved with the agent's latest ckpt and restored on train@ resume. Each save appends a chunk file with only the experiences added since the previous save, plus a small snapshot of the pointers and ns_buffer; chunks whose experiences have all been overwritten are deleted.
+
+    With 'compress', the states are stored compressed per transition with 'compress_codec' (see get_codec), as uint8 for image observations, and decompressed in a thread pool at sample time. This trades sampling throughput for much bigger image buffers; compare with get_nbytes_per_transition().
+
+    e.g. memory_spec for an on-disk states buffer
+    "memory": {
+        "name": "Replay",
+        "batch_size": 32,
+        "max_size": 1000000,
+        "use_cer": false,
+        "storage": "memmap",
+        "memmap_keys": ["states"]
+    }
+
+    e.g. memory_spec for a compressed states buffer
+    "memory": {
+        "name": "Replay",
+        "batch_size": 32,
+        "max_size": 1000000,
+        "use_cer": false,
+        "compress": true,
+        "compress_codec": "lz4"
     }
     '''
 
     def __init__(self, memory_spec, body):
         super().__init__(memory_spec, body)
+        # set default
+        util.set_attr(self, dict(
+            storage='list',
+            memmap_keys=['states'],
+            compress=False,
+            compress_codec='lz4',
+        ))
         util.set_attr(self, self.memory_spec, [
             'batch_size',
             'max_size',
             'use_cer',
+            'storage',
+            'memmap_keys',
+            'compress',
+            'compress_codec',
         ])
         self.is_episodic = False
         self.batch_idxs = None
         self.size = 0  # total experiences stored
         self.seen_size = 0  # total experiences seen cumulatively
         self.head = -1  # index of most recent experience
+        self.memory_idx = next(MEMORY_IDXS)
+        # image states are kept as uint8 and only converted to float in the net, others are stored as float16
+        self.state_dtype = np.uint8 if body.observation_space.dtype == np.uint8 else np.float16
         # generic next_state buffer to store last next_states (allow for multiple for venv)
         self.ns_idx_offset = self.body.env.num_envs if body.env.is_venv else 1
         self.ns_buffer = deque(maxlen=self.ns_idx_offset)
@@ -88,32 +214,190 @@ class Replay(Memory):
 
     def reset(self):
         '''Initializes the memory arrays, size and head pointer'''
+        self.close()  # the storage being replaced
         # set self.states, self.actions, ...
         for k in self.data_keys:
             if k != 'next_states':  # reuse self.states
-                # list add/sample is over 10x faster than np, also simpler to handle
-                setattr(self, k, [None] * self.max_size)
+                setattr(self, k, self.init_storage(k))
         self.size = 0
         self.head = -1
         self.ns_buffer.clear()
+        # saved chunks as (start, end) ranges of seen_size, see save()
+        self.chunk_ranges = []
+        self.saved_seen_size = self.seen_size
+
+    def close(self):
+        '''Release the storage resources: the decompression threads of compressed states, and the memmap files, which resume does not need since save() writes the data in chunks'''
+        if isinstance(getattr(self, 'states', None), CompressedStates):
+            self.states.close()
+        for k in self.data_keys:
+            data = getattr(self, k, None)
+            if isinstance(data, np.memmap) and os.path.exists(data.filename):
+                os.remove(data.filename)  # the open map stays valid until it is dropped
+
+    def init_storage(self, k):
+        '''Create the storage of size max_size for a data key according to self.storage'''
+        if self.compress and k == 'states':
+            shape, dtype = self.get_data_shape_dtype(k)
+            return CompressedStates(self.max_size, shape, dtype, self.compress_codec)
+        elif self.storage == 'list':
+            # list add/sample is over 10x faster than np for small data, also simpler to handle
+            return [None] * self.max_size
+        elif self.storage == 'array' or (self.storage == 'memmap' and k not in self.memmap_keys):
+            shape, dtype = self.get_data_shape_dtype(k)
+            return np.zeros((self.max_size,) + shape, dtype=dtype)
+        elif self.storage == 'memmap':
+            shape, dtype = self.get_data_shape_dtype(k)
+            # open_memmap writes a .npy header so the file can also be read with np.load; the data is zero-filled sparse on creation
+            return np.lib.format.open_memmap(self.get_memmap_path(k), mode='w+', dtype=dtype, shape=(self.max_size,) + shape)
+        else:
+            raise ValueError(f'Unrecognized memory storage {self.storage}. Choose from "list", "array", "memmap".')
+
+    def get_memmap_path(self, k):
+        '''Get the path of the memmap file of a data key, under the session's meta.prepath and unique per memory'''
+        prepath = self.body.spec['meta']['prepath']
+        memmap_path = util.smart_path(f'{prepath}_memory{self.memory_idx}_{k}.npy')
+        os.makedirs(os.path.dirname(memmap_path), exist_ok=True)
+        return memmap_path
+
+    def get_data_shape_dtype(self, k):
+        '''Infer the shape and dtype of a single element of a data key from the body's observation and action spaces'''
+        if k == 'states':
+            return tuple(self.body.observation_space.shape), self.state_dtype
+        elif k == 'actions':
+            action_space = self.body.action_space
+            shape = tuple(action_space.shape)
+            if shape == (1,):  # single continuous action is squeezed into a scalar by algorithm.act
+                shape = ()
+            return shape, action_space.dtype
+        else:  # scalar data, e.g. rewards, dones, priorities
+            return (), np.float32
+
+    def get_nbytes_per_transition(self):
+        '''Measure the average bytes used to store a transition, for comparing storage backends; only the stored transitions are counted, not the preallocated rest'''
+        nbytes = 0
+        for k in self.data_keys:
+            if k == 'next_states':
+                continue
+            data = getattr(self, k)
+            if isinstance(data, CompressedStates):
+                data = data.data
+            if isinstance(data, np.ndarray):
+                nbytes += data[:self.size].nbytes
+            else:  # count the list slots and the objects of the stored transitions
+                stored = data[:self.size]
+                nbytes += sys.getsizeof(stored) + sum(sys.getsizeof(d) for d in stored)
+        return nbytes / max(self.size, 1)
+
+    def get_save_prepath(self):
+        return f'{self.body.spec["meta"]["model_prepath"]}_memory'
+
+    def get_snapshot(self):
+        '''Get the memory pointers and buffers other than the data keys to save()'''
+        return {
+            'head': self.head,
+            'size': self.size,
+            'seen_size': self.seen_size,
+            'ns_buffer': np.array(list(self.ns_buffer)),
+            'chunk_ranges': np.array(self.chunk_ranges, dtype=np.int64).reshape(-1, 2),
+        }
+
+    def load_snapshot(self, snapshot):
+        '''Restore the memory pointers and buffers from get_snapshot()'''
+        self.head = int(snapshot['head'])
+        self.size = int(snapshot['size'])
+        self.seen_size = int(snapshot['seen_size'])
+        self.ns_buffer.clear()
+        self.ns_buffer.extend(snapshot['ns_buffer'])
+        self.chunk_ranges = [tuple(r) for r in snapshot['chunk_ranges'].tolist()]
+        self.saved_seen_size = self.seen_size
+
+    def save(self):
+        '''Append the experiences added since the last save as a chunk, then save the snapshot, which lists the chunks to load'''
+        prepath = self.get_save_prepath()
+        num_new = min(self.seen_size - self.saved_seen_size, self.size)
+        if num_new > 0:
+            # the latest experiences are the ones before head in the ring
+            idxs = (self.head - np.arange(num_new)[::-1]) % self.max_size
+            start, end = self.seen_size - num_new, self.seen_size
+            chunk = {}
+            for k in self.data_keys:
+                if k != 'next_states':  # reuse self.states
+                    data = getattr(self, k)
+                    chunk[k] = data[idxs] if isinstance(data, np.ndarray) else np.array([data[idx] for idx in idxs])
+            np.savez(util.smart_path(f'{prepath}_{start}-{end}.npz'), idxs=idxs, **chunk)
+            self.chunk_ranges.append((start, end))
+        # delete the chunks which have been fully overwritten in the ring
+        oldest_seen = self.seen_size - self.size
+        for start, end in self.chunk_ranges[:]:
+            if end <= oldest_seen:
+                os.remove(util.smart_path(f'{prepath}_{start}-{end}.npz'))
+                self.chunk_ranges.remove((start, end))
+        # write then rename, so a preempted save leaves the previous snapshot intact
+        snapshot_path = util.smart_path(f'{prepath}.npz')
+        with open(f'{snapshot_path}.tmp', 'wb') as f:
+            np.savez(f, **self.get_snapshot())
+        os.replace(f'{snapshot_path}.tmp', snapshot_path)
+        self.saved_seen_size = self.seen_size
+        logger.debug(f'Saved memory with {len(self.chunk_ranges)} chunks to {prepath}*.npz')
+
+    def load(self):
+        '''Restore the memory from the saved snapshot and chunks, with later chunks overwriting earlier ones in the ring'''
+        prepath = self.get_save_prepath()
+        snapshot_path = util.smart_path(f'{prepath}.npz')
+        if not os.path.exists(snapshot_path):
+            logger.info(f'No saved memory at {snapshot_path}; starting with an empty memory')
+            return
+        snapshot = dict(np.load(snapshot_path))
+        for start, end in snapshot['chunk_ranges'].tolist():
+            chunk = np.load(util.smart_path(f'{prepath}_{start}-{end}.npz'))
+            for k in self.data_keys:
+                if k != 'next_states':
+                    util.batch_set(getattr(self, k), chunk['idxs'], chunk[k])
+        self.load_snapshot(snapshot)
+        logger.info(f'Loaded memory of size {self.size} from {prepath}*.npz')
 
     @lab_api
     def update(self, state, action, reward, next_state, done):
         '''Interface method to update memory'''
         if self.body.env.is_venv:
-            for sarsd in zip(state, action, reward, next_state, done):
-                self.add_experience(*sarsd)
+            self.add_batch(state, action, reward, next_state, done)
         else:
             self.add_experience(state, action, reward, next_state, done)
 
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        '''
+        Batched add_experience for N experiences, e.g. of a vector env step, or the on-policy batch of SIL.
+        Writes them at the N idxs after head at once, then updates head, size, seen_size and to_train once with the same result as N add_experience calls.
+        @returns the memory idxs written, in order
+        '''
+        num_exps = len(dones)
+        # if more than max_size, only the latest max_size remain after the ring wraps
+        num_kept = min(num_exps, self.max_size)
+        idxs = (self.head + 1 + np.arange(num_exps - num_kept, num_exps)) % self.max_size
+        util.batch_set(self.states, idxs, np.asarray(states[-num_kept:]).astype(self.state_dtype))
+        util.batch_set(self.actions, idxs, actions[-num_kept:])
+        util.batch_set(self.rewards, idxs, rewards[-num_kept:])
+        self.ns_buffer.extend(np.asarray(next_states[-self.ns_idx_offset:]).astype(self.state_dtype))
+        util.batch_set(self.dones, idxs, dones[-num_kept:])
+        # the head and seen_size after adding each experience, to set to_train as add_experience would
+        heads = (self.head + 1 + np.arange(num_exps)) % self.max_size
+        seen_sizes = self.seen_size + 1 + np.arange(num_exps)
+        self.head = int(heads[-1])
+        self.size = min(self.size + num_exps, self.max_size)
+        self.seen_size += num_exps
+        algorithm = self.body.agent.algorithm
+        algorithm.to_train = algorithm.to_train or bool(np.any((seen_sizes > algorithm.training_start_step) & (heads % algorithm.training_frequency == 0)))
+        return idxs
+
     def add_experience(self, state, action, reward, next_state, done):
         '''Implementation for update() to add experience to memory, expanding the memory size if necessary'''
         # Move head pointer. Wrap around if necessary
         self.head = (self.head + 1) % self.max_size
-        self.states[self.head] = state.astype(np.float16)
+        self.states[self.head] = state.astype(self.state_dtype)
         self.actions[self.head] = action
         self.rewards[self.head] = reward
-        self.ns_buffer.append(next_state.astype(np.float16))
+        self.ns_buffer.append(next_state.astype(self.state_dtype))
         self.dones[self.head] = done
         # Actually occupied size of memory
         if self.size < self.max_size:
@@ -151,3 +435,210 @@ class Replay(Memory):
         if self.use_cer:  # add the latest sample
             batch_idxs[-1] = self.head
         return batch_idxs
+
+
+class FrameStacks:
+    '''Indexable view of the stacked states of a FrameReplay, so they can be sampled like states, e.g. by sample_next_states'''
+
+    def __init__(self, memory):
+        self.memory = memory
+
+    def __getitem__(self, idxs):
+        return self.memory.get_stacks(idxs)
+
+
+class FrameReplay(Replay):
+    '''
+    Replay memory for frame-stacked (e.g. Atari) states which stores every frame only once.
+    It is also the sequence replay for RecurrentNet, whose env stacks the last seq_len states with frame_op "stack" (see BaseEnv._infer_frame_attr), so each step is stored once instead of in seq_len stacked copies.
+
+    With env frame_op, consecutive states share frame_op_len - 1 frames, so storing full stacks stores every frame frame_op_len times. This memory stores only the newest frame of each state in a ring of size N (as uint8 for image observations), and rebuilds the stacked states and next states at sample time from the frames at idx - k * ns_idx_offset, k < frame_op_len.
+
+    A stack stops at episode boundaries given by dones, and the missing older frames are filled like the env would:
+        - single env (FrameStack): repeat the first frame of the episode
+        - vector env (VecFrameStack): zero-pad
+    When the memory is full, the oldest (frame_op_len - 1) * ns_idx_offset experiences have lost their older frames, so they are excluded from sampling. Everything else uses array storage, or memmap storage if specified.
+
+    e.g. memory_spec
+    "memory": {
+        "name": "FrameReplay",
+        "batch_size": 32,
+        "max_size": 10000,
+        "use_cer": false
+    }
+    '''
+
+    def __init__(self, memory_spec, body):
+        env = body.env
+        assert env.frame_op in ('concat', 'stack'), f'FrameReplay requires env frame_op "concat" or "stack", got {env.frame_op}'
+        self.frame_op = env.frame_op
+        self.frame_op_len = env.frame_op_len
+        # stacks are gathered by vectorized indexing into dones, so always use array (or memmap) storage
+        storage = 'memmap' if memory_spec.get('storage') == 'memmap' else 'array'
+        super().__init__({**memory_spec, 'storage': storage}, body)
+        self.stacks = FrameStacks(self)
+        assert self.max_size > (self.frame_op_len - 1) * self.ns_idx_offset, 'max_size too small to hold a full frame stack'
+
+    def get_data_shape_dtype(self, k):
+        '''Store only the newest frame of each state'''
+        if k == 'states':
+            shape = self.body.observation_space.shape
+            if self.frame_op == 'concat':  # frames are concatenated along the first dim
+                frame_shape = (shape[0] // self.frame_op_len,) + shape[1:]
+            else:  # stack creates a new first dim
+                frame_shape = shape[1:]
+            return tuple(frame_shape), self.state_dtype
+        return super().get_data_shape_dtype(k)
+
+    def add_experience(self, state, action, reward, next_state, done):
+        '''Add experience storing only the newest frame of state; next_state is kept whole in ns_buffer'''
+        state = np.asarray(state)  # realize LazyFrames
+        frame = state[-self.states.shape[1]:] if self.frame_op == 'concat' else state[-1]
+        super().add_experience(frame, action, reward, np.asarray(next_state), done)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        '''Batched add_experience storing only the newest frame of each state'''
+        states = np.asarray(states)
+        frames = states[:, -self.states.shape[1]:] if self.frame_op == 'concat' else states[:, -1]
+        return super().add_batch(frames, actions, rewards, np.asarray(next_states), dones)
+
+    def get_stacks(self, idxs):
+        '''Rebuild the stacked states at idxs from the stored frames'''
+        is_scalar = np.isscalar(idxs)
+        idxs = np.atleast_1d(idxs)
+        k_offsets = np.arange(self.frame_op_len) * self.ns_idx_offset  # newest first
+        frame_idxs = (idxs[:, None] - k_offsets) % self.max_size
+        # a frame belongs to the stack if it is still stored and no episode has ended in between
+        oldest = 0 if self.size < self.max_size else (self.head + 1) % self.max_size
+        is_stored = k_offsets <= ((idxs - oldest) % self.max_size)[:, None]
+        is_ended = np.zeros(frame_idxs.shape, dtype=bool)
+        is_ended[:, 1:] = self.dones[frame_idxs[:, 1:]] != 0
+        is_valid = np.cumprod(is_stored & ~is_ended, axis=1).astype(bool)
+        if self.body.env.is_venv:
+            stacks = self.states[frame_idxs]
+            stacks[~is_valid] = 0
+        else:  # repeat the first frame of the episode
+            last_valid = is_valid.sum(axis=1, keepdims=True) - 1
+            frame_idxs = np.take_along_axis(frame_idxs, np.minimum(np.arange(self.frame_op_len), last_valid), axis=1)
+            stacks = self.states[frame_idxs]
+        stacks = np.flip(stacks, axis=1)  # oldest first
+        if self.frame_op == 'concat':
+            stacks = stacks.reshape((len(idxs), -1) + stacks.shape[3:])
+        else:
+            stacks = np.ascontiguousarray(stacks)
+        return stacks[0] if is_scalar else stacks
+
+    @lab_api
+    def sample(self):
+        '''Returns a batch of batch_size samples with the stacked states and next_states rebuilt from the stored frames'''
+        self.batch_idxs = self.sample_idxs(self.batch_size)
+        batch = {}
+        for k in self.data_keys:
+            if k == 'states':
+                batch[k] = self.get_stacks(self.batch_idxs)
+            elif k == 'next_states':
+                batch[k] = sample_next_states(self.head, self.max_size, self.ns_idx_offset, self.batch_idxs, self.stacks, self.ns_buffer)
+            else:
+                batch[k] = util.batch_get(getattr(self, k), self.batch_idxs)
+        return batch
+
+    def sample_idxs(self, batch_size):
+        '''Batch indices sampled random uniformly, excluding the oldest experiences which have lost their older frames'''
+        if self.size < self.max_size:
+            batch_idxs = np.random.randint(self.size, size=batch_size)
+        else:
+            num_truncated = (self.frame_op_len - 1) * self.ns_idx_offset
+            batch_idxs = (self.head + 1 + num_truncated + np.random.randint(self.max_size - num_truncated, size=batch_size)) % self.max_size
+        if self.use_cer:  # add the latest sample
+            batch_idxs[-1] = self.head
+        return batch_idxs
+
+
+class NStepReplay(Replay):
+    '''
+    Replay memory for n-step TD targets, with the n-step returns accumulated at insert time.
+
+    Experiences are stored as in Replay, so the experience k steps later of the same env is at idx + k * ns_idx_offset. When an experience is added, its discounted reward is added to the returns of the previous n_step - 1 experiences of its env whose windows are still open, i.e. with no episode end in between. Each experience stores the columns:
+        - rewards: the discounted sum of up to n_step rewards
+        - dones: whether the episode ended within the window
+        - discounts: gamma^k for the k steps accumulated, to bootstrap with
+        - bootstrap_idxs: the idx of the last experience in the window, whose next_state is the bootstrap state
+    so sampling stays O(batch_size), and the target is rewards + discounts * (1 - dones) * Q(next_states). The latest experiences whose windows are still open are sampled with their shorter, still valid k-step targets. gamma is taken from the algorithm spec.
+
+    e.g. memory_spec
+    "memory": {
+        "name": "NStepReplay",
+        "n_step": 3,
+        "batch_size": 32,
+        "max_size": 10000,
+        "use_cer": false
+    }
+    '''
+
+    def __init__(self, memory_spec, body):
+        util.set_attr(self, memory_spec, [
+            'n_step',
+        ])
+        self.gamma = ps.get(body.agent.agent_spec, 'algorithm.gamma')
+        # returns are accumulated by vectorized indexing, so always use array (or memmap) storage
+        storage = 'memmap' if memory_spec.get('storage') == 'memmap' else 'array'
+        super().__init__({**memory_spec, 'storage': storage}, body)
+        self.data_keys = ['states', 'actions', 'rewards', 'next_states', 'dones', 'discounts', 'bootstrap_idxs']
+        self.reset()
+
+    def get_data_shape_dtype(self, k):
+        if k == 'bootstrap_idxs':
+            return (), np.int64
+        return super().get_data_shape_dtype(k)
+
+    def add_experience(self, state, action, reward, next_state, done):
+        '''Add experience, then accumulate its reward into the open n-step windows of its env'''
+        super().add_experience(state, action, reward, next_state, done)
+        self.accumulate(np.array([self.head]), np.array([reward]), np.array([done]))
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        idxs = super().add_batch(states, actions, rewards, next_states, dones)
+        self.accumulate(idxs, np.asarray(rewards)[-len(idxs):], np.asarray(dones)[-len(idxs):])
+        return idxs
+
+    def accumulate(self, idxs, rewards, dones):
+        '''
+        Start the n-step windows of the experiences just written at idxs (in insertion order), and add their rewards to the open windows of the previous experiences of the same envs.
+        Windows are extended in order of increasing k, so a window also picks up experiences from the same batch.
+        '''
+        self.discounts[idxs] = self.gamma
+        self.bootstrap_idxs[idxs] = idxs
+        # seen positions of the experiences, to exclude previous experiences which are not stored
+        positions = self.seen_size - len(idxs) + np.arange(len(idxs))
+        oldest_position = self.seen_size - self.size
+        for k in range(1, self.n_step):
+            prev_idxs = (idxs - k * self.ns_idx_offset) % self.max_size
+            # the window of prev_idx is open up to the experience right before idx
+            is_open = (positions - k * self.ns_idx_offset >= oldest_position) & (self.dones[prev_idxs] == 0) & (self.bootstrap_idxs[prev_idxs] == (idxs - self.ns_idx_offset) % self.max_size)
+            prev_idxs = prev_idxs[is_open]
+            self.rewards[prev_idxs] += self.discounts[prev_idxs] * rewards[is_open]
+            self.discounts[prev_idxs] *= self.gamma
+            self.dones[prev_idxs] = dones[is_open]
+            self.bootstrap_idxs[prev_idxs] = idxs[is_open]
+
+    @lab_api
+    def sample(self):
+        '''Returns a batch of batch_size samples with the n-step rewards, dones and discounts, and the bootstrap next_states'''
+        self.batch_idxs = self.sample_idxs(self.batch_size)
+        batch = {}
+        for k in self.data_keys:
+            if k == 'next_states':
+                bootstrap_idxs = self.bootstrap_idxs[self.batch_idxs]
+                batch[k] = sample_next_states(self.head, self.max_size, self.ns_idx_offset, bootstrap_idxs, self.states, self.ns_buffer)
+            elif k != 'bootstrap_idxs':
+                batch[k] = util.batch_get(getattr(self, k), self.batch_idxs)
+        return batch
+
+    def save(self):
+        '''Save, then mark the latest experiences with open windows as unsaved, since their returns will still change'''
+        super().save()
+        self.saved_seen_size = max(self.seen_size - (self.n_step - 1) * self.ns_idx_offset, 0)
+
+    def load_snapshot(self, snapshot):
+        super().load_snapshot(snapshot)
+        self.saved_seen_size = max(self.seen_size - (self.n_step - 1) * self.ns_idx_offset, 0)
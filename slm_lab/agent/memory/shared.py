@@ -0,0 +1,175 @@
+from slm_lab.agent.memory.prioritized import PrioritizedReplay, SumTree
+from slm_lab.agent.memory.replay import Replay
+from slm_lab.lib import logger, util
+from slm_lab.lib.decorator import lab_api
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+logger = logger.get_logger(__name__)
+
+# idxs of the shared counters
+HEAD, SIZE, SEEN_SIZE, TREE_WRITE = range(4)
+
+
+def share_array(array):
+    '''Move an np.array into a torch tensor in shared memory'''
+    return torch.from_numpy(array).share_memory_()
+
+
+class SharedArrays:
+    '''
+    Mixin to keep np.array attributes as views of torch tensors in shared memory, so that the writes of any session process are seen by all.
+    When pickled for a process, the tensors are sent in place of the views: torch.multiprocessing reduces them to handles of the same shared memory, also with the spawn start method used by run_lab, whereas a pickled np.array would be a private copy.
+    '''
+
+    def set_shared(self, k, tensor):
+        '''Set the attribute k as an np view of a shared tensor, e.g. from share_array'''
+        self.__dict__.setdefault('shared_tensors', {})[k] = tensor
+        setattr(self, k, tensor.numpy())
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in self.shared_tensors}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for k, tensor in self.shared_tensors.items():
+            setattr(self, k, tensor.numpy())
+
+
+class SharedSumTree(SharedArrays, SumTree):
+    '''SumTree whose tree, indices and write pointer are in shared memory, for SharedPrioritizedReplay'''
+
+    def __init__(self, capacity, counters):
+        super().__init__(capacity)
+        self.set_shared('counters', counters)
+        self.set_shared('tree', share_array(self.tree))
+        self.set_shared('indices', share_array(self.indices))
+        self.write = 0
+
+    @property
+    def write(self):
+        return int(self.counters[TREE_WRITE])
+
+    @write.setter
+    def write(self, write):
+        self.counters[TREE_WRITE] = write
+
+
+class SharedReplay(SharedArrays, Replay):
+    '''
+    Replay in shared memory for the Ape-X distributed mode (meta.distributed: "apex"), see ApexLearner.
+    The memory is created by the learner in the trial process and passed to the actor sessions with global_nets. The actors only act and add their experiences into it, and the learner samples from it to train.
+
+    The data keys are preallocated np.arrays in shared memory as with 'storage': 'array' (which this memory always uses), and head, size and seen_size are shared counters, so the writes of any process are seen by all, see SharedArrays. Adding and sampling are guarded by a process lock.
+    The memory is pickled for the session processes without its body; each actor sets its own, see Agent.
+    Since the experiences of the actors are interleaved in the ring, next_states are stored explicitly instead of being read from the next idx; this doubles the states memory.
+    NOTE the memory is not saved with the ckpt, since the actors write into it concurrently.
+
+    e.g. memory_spec
+    "memory": {
+        "name": "SharedReplay",
+        "batch_size": 32,
+        "max_size": 100000,
+        "use_cer": false
+    }
+    '''
+
+    def __init__(self, memory_spec, body):
+        # the pointers are properties backed by the counters, which Replay.__init__ sets
+        self.set_shared('counters', share_array(np.zeros(4, dtype=np.int64)))
+        self.lock = mp.get_context('spawn').RLock()  # unlike a fork context lock, it can also be sent to spawned processes
+        super().__init__(memory_spec, body)
+        self.storage = 'array'
+
+    @property
+    def head(self):
+        return int(self.counters[HEAD])
+
+    @head.setter
+    def head(self, head):
+        self.counters[HEAD] = head
+
+    @property
+    def size(self):
+        return int(self.counters[SIZE])
+
+    @size.setter
+    def size(self, size):
+        self.counters[SIZE] = size
+
+    @property
+    def seen_size(self):
+        return int(self.counters[SEEN_SIZE])
+
+    @seen_size.setter
+    def seen_size(self, seen_size):
+        self.counters[SEEN_SIZE] = seen_size
+
+    def __getstate__(self):
+        return {**super().__getstate__(), 'body': None}
+
+    def reset(self):
+        super().reset()
+        self.next_states = self.init_storage('next_states')
+
+    def init_storage(self, k):
+        '''Create the shared np.array of size max_size for a data key, and set it as the shared attribute k'''
+        shape, dtype = self.get_data_shape_dtype(k)
+        self.set_shared(k, share_array(np.zeros((self.max_size,) + shape, dtype=dtype)))
+        return getattr(self, k)
+
+    def get_data_shape_dtype(self, k):
+        return super().get_data_shape_dtype('states' if k == 'next_states' else k)
+
+    def save(self):
+        pass
+
+    def load(self):
+        pass
+
+    def add_experience(self, state, action, reward, next_state, done):
+        '''Add an experience as Replay does, and also write its next_state'''
+        with self.lock:
+            super().add_experience(state, action, reward, next_state, done)
+            self.next_states[self.head] = next_state.astype(self.state_dtype)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        '''Add a batch of experiences as Replay does, and also write their next_states'''
+        with self.lock:
+            idxs = super().add_batch(states, actions, rewards, next_states, dones)
+            util.batch_set(self.next_states, idxs, np.asarray(next_states[-len(idxs):]).astype(self.state_dtype))
+        return idxs
+
+    @lab_api
+    def sample(self):
+        '''Returns a batch of batch_size samples as Replay does, with the next_states read from their own storage'''
+        with self.lock:
+            self.batch_idxs = self.sample_idxs(self.batch_size)
+            batch = {k: util.batch_get(getattr(self, k), self.batch_idxs) for k in self.data_keys}
+        return batch
+
+
+class SharedPrioritizedReplay(SharedReplay, PrioritizedReplay):
+    '''
+    PrioritizedReplay in shared memory for the Ape-X distributed mode, see SharedReplay.
+    The actors add their experiences with the initial high priority, and the learner updates the priorities of its sampled batches in the shared SumTree.
+
+    e.g. memory_spec
+    "memory": {
+        "name": "SharedPrioritizedReplay",
+        "alpha": 0.6,
+        "epsilon": 0.0001,
+        "batch_size": 32,
+        "max_size": 100000,
+        "use_cer": false
+    }
+    '''
+
+    def reset(self):
+        super().reset()
+        self.tree = SharedSumTree(self.max_size, self.shared_tensors['counters'])
+
+    def update_priorities(self, errors):
+        with self.lock:
+            super().update_priorities(errors)
@@ -171,6 +171,7 @@ class ConvNet(Net, nn.Module):
         The feedforward step
         Note that PyTorch takes (c,h,w) but gym provides (h,w,c), so preprocessing must be done before passing to network
         '''
+        x = x.float()  # e.g. uint8 image states are converted on the net device
         if self.normalize:
             x = x / 255.0
         x = self.conv_model(x)
@@ -295,6 +296,7 @@ class DuelingConvNet(ConvNet):
 
     def forward(self, x):
         '''The feedforward step'''
+        x = x.float()  # e.g. uint8 image states are converted on the net device
         if self.normalize:
             x = x / 255.0
         x = self.conv_model(x)
@@ -0,0 +1,115 @@
+# The inference server module
+# Batches the action forward passes of parallel distributed sessions into one forward pass of the global nets
+from slm_lab.lib import logger
+import threading
+import torch
+import torch.multiprocessing as mp
+
+logger = logger.get_logger(__name__)
+
+
+class InferenceClient:
+    '''
+    Session-side handle to a slot of an InferenceServer.
+    It is passed to the session with global_nets, so it is set as algorithm.inference_client, which policy_util.calc_pdparam then uses in place of algorithm.calc_pdparam.
+    '''
+
+    def __init__(self, idx, states, pdparams, batch_sizes, request_sem, response_sem, is_list):
+        self.idx = idx
+        self.states = states
+        self.pdparams = pdparams
+        self.batch_sizes = batch_sizes
+        self.request_sem = request_sem
+        self.response_sem = response_sem
+        self.is_list = is_list
+
+    def calc_pdparam(self, state):
+        '''Write the state batch into the shared slot, signal the server, then wait for and read the pdparam it writes back'''
+        batch_size = len(state)
+        self.states[:batch_size] = state
+        self.batch_sizes[self.idx] = batch_size
+        self.request_sem.release()
+        self.response_sem.acquire()
+        pdparam = [out[:batch_size].to(state.device) for out in self.pdparams]
+        return pdparam if self.is_list else pdparam[0]
+
+
+class InferenceServer:
+    '''
+    Local inference service for the distributed sessions (A3C, DPPO, async SAC) of a trial.
+    It runs in a thread of the trial process with the algorithm whose nets are made global by net_util.init_global_nets, so the forward passes use the latest shared parameters.
+    Each session gets a client slot with shared memory buffers for its states and pdparams:
+    - the client writes its states and batch size, then signals the shared request_sem
+    - the server collects all the pending requests, runs one batched forward pass, writes back each slice of pdparam and signals the client's response_sem
+    NOTE the server returns pdparam instead of actions, so each session still samples with its own action policy and explore_var. In the 'synced' mode the sessions act with the global nets instead of their periodically synced local copies.
+
+    e.g. meta spec
+    "meta": {
+      "distributed": "shared",
+      "inference_server": true,
+      ...
+    }
+    '''
+
+    def __init__(self, algorithm, num_clients):
+        self.algorithm = algorithm
+        self.num_clients = num_clients
+        body = algorithm.body
+        state_shape = body.observation_space.shape
+        max_batch_size = body.env.num_envs  # a session acts on at most all its envs at once
+        # infer the pdparam structure and shapes with a dummy forward pass
+        with torch.no_grad():
+            pdparam = algorithm.calc_pdparam(torch.zeros((1,) + state_shape, device=algorithm.net.device))
+        self.is_list = isinstance(pdparam, list)
+        pdparam_shapes = [out.shape[1:] for out in (pdparam if self.is_list else [pdparam])]
+        self.states = [torch.zeros((max_batch_size,) + state_shape).share_memory_() for _ in range(num_clients)]
+        self.pdparams = [[torch.zeros((max_batch_size,) + shape).share_memory_() for shape in pdparam_shapes] for _ in range(num_clients)]
+        self.batch_sizes = torch.zeros(num_clients, dtype=torch.long).share_memory_()  # nonzero for a pending request
+        self.request_sem = mp.Semaphore(0)
+        self.response_sems = [mp.Semaphore(0) for _ in range(num_clients)]
+        self.is_running = False
+        self.thread = None
+        self.num_requests = 0
+        self.num_batches = 0
+
+    def get_client(self, idx):
+        '''Get the client for slot idx, to be passed to a session process'''
+        return InferenceClient(idx, self.states[idx], self.pdparams[idx], self.batch_sizes, self.request_sem, self.response_sems[idx], self.is_list)
+
+    def serve(self):
+        '''Serve the pending requests in batches until stopped'''
+        while True:
+            self.request_sem.acquire()
+            if not self.is_running:
+                break
+            idxs = self.batch_sizes.nonzero().view(-1).tolist()
+            # more clients may have requested in the meantime, collect their signals too
+            for _ in range(len(idxs) - 1):
+                self.request_sem.acquire()
+            batch_sizes = self.batch_sizes[idxs].tolist()
+            states = torch.cat([self.states[idx][:batch_size] for idx, batch_size in zip(idxs, batch_sizes)])
+            with torch.no_grad():
+                pdparam = self.algorithm.calc_pdparam(states.to(self.algorithm.net.device))
+            pdparam = pdparam if self.is_list else [pdparam]
+            start = 0
+            for idx, batch_size in zip(idxs, batch_sizes):
+                for out, batch_out in zip(self.pdparams[idx], pdparam):
+                    out[:batch_size] = batch_out[start:start + batch_size]
+                start += batch_size
+                self.batch_sizes[idx] = 0
+                self.response_sems[idx].release()
+            self.num_requests += len(idxs)
+            self.num_batches += 1
+
+    def start(self):
+        '''Start serving in a thread; call after the session processes are started'''
+        self.is_running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        self.request_sem.release()
+        self.thread.join()
+        mean_batch_size = self.num_requests / max(self.num_batches, 1)
+        logger.info(f'Inference server served {self.num_requests} requests in {self.num_batches} batches, mean requests per batch: {mean_batch_size:.2f}')
@@ -110,6 +110,7 @@ class MLPNet(Net, nn.Module):
 
     def forward(self, x):
         '''The feedforward step'''
+        x = x.float()  # e.g. uint8 image states are converted on the net device
         x = self.model(x)
         if hasattr(self, 'model_tails'):
             outs = []
@@ -264,7 +265,7 @@ class HydraMLPNet(Net, nn.Module):
         '''The feedforward step'''
         head_xs = []
         for model_head, x in zip(self.model_heads, xs):
-            head_xs.append(model_head(x))
+            head_xs.append(model_head(x.float()))
         head_xs = torch.cat(head_xs, dim=-1)
         body_x = self.model_body(head_xs)
         outs = []
@@ -349,6 +350,7 @@ class DuelingMLPNet(MLPNet):
 
     def forward(self, x):
         '''The feedforward step'''
+        x = x.float()  # e.g. uint8 image states are converted on the net device
         x = self.model_body(x)
         state_value = self.v(x)
         raw_advantages = self.adv(x)
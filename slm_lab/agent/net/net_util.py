@@ -1,3 +1,4 @@
+from copy import deepcopy
 from functools import partial, wraps
 from slm_lab.lib import logger, optimizer, util
 import os
@@ -312,10 +313,17 @@ def init_global_nets(algorithm):
     in spec.meta.distributed, specify either:
     - 'shared': global network parameter is shared all the time. In this mode, algorithm local network will be replaced directly by global_net via overriding by identify attribute name
     - 'synced': global network parameter is periodically synced to local network after each gradient push. In this mode, algorithm will keep a separate reference to `global_{net}` for each of its network
+    - 'apex': the sessions only act, with a global copy of the acting net which the trial's ApexLearner trains and periodically publishes into. The copy overrides the local net by the same name
     '''
     dist_mode = algorithm.agent.spec['meta']['distributed']
-    assert dist_mode in ('shared', 'synced'), f'Unrecognized distributed mode'
+    assert dist_mode in ('shared', 'synced', 'apex'), f'Unrecognized distributed mode'
     global_nets = {}
+    if dist_mode == 'apex':
+        g_net = deepcopy(algorithm.net)
+        g_net.share_memory()
+        global_nets['net'] = g_net
+        logger.info(f'Initialized global_nets attr {list(global_nets.keys())} for Ape-X')
+        return global_nets
     for net_name in algorithm.net_names:
         optim_name = net_name.replace('net', 'optim')
         if not hasattr(algorithm, optim_name):  # only for trainable network, i.e. has an optim
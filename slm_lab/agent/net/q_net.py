@@ -53,7 +53,7 @@ class QMLPNet(MLPNet):
         self.train()
 
     def forward(self, state, action):
-        s_a = torch.cat((state, action), dim=-1)
+        s_a = torch.cat((state.float(), action), dim=-1)
         s_a = self.model(s_a)
         return self.model_tail(s_a)
 
@@ -115,6 +115,7 @@ class QConvNet(ConvNet):
         self.train()
 
     def forward(self, state, action):
+        state = state.float()  # e.g. uint8 image states are converted on the net device
         if self.normalize:
             state = state / 255.0
         state = self.conv_model(state)
@@ -189,6 +190,7 @@ class FiLMQConvNet(ConvNet):
         self.train()
 
     def forward(self, state, action):
+        state = state.float()  # e.g. uint8 image states are converted on the net device
         if self.normalize:
             state = state / 255.0
         state = self.conv_model(state)
@@ -146,7 +146,7 @@ class RecurrentNet(Net, nn.Module):
         '''The feedforward step. Input is batch_size x seq_len x state_dim'''
         # Unstack input to (batch_size x seq_len) x state_dim in order to transform all state inputs
         batch_size = x.size(0)
-        x = x.view(-1, self.in_dim)
+        x = x.float().view(-1, self.in_dim)  # e.g. uint8 image states are converted on the net device
         if hasattr(self, 'fc_model'):
             x = self.fc_model(x)
         # Restack to batch_size x seq_len x rnn_input_dim
@@ -1,7 +1,7 @@
 # the environment module
 
 
-def make_env(spec):
+def make_env(spec, env_pool=None):
     from slm_lab.env.openai import OpenAIEnv
-    env = OpenAIEnv(spec)
+    env = OpenAIEnv(spec, env_pool)
     return env
@@ -89,6 +89,9 @@ class BaseEnv(ABC):
         "normalize_state": false,
         "reward_scale": "sign",
         "num_envs": 8,
+        "num_workers": 4,
+        "async_batch_size": null,
+        "numpy_vec": false,
         "max_t": null,
         "max_frame": 1e7
     }],
@@ -106,6 +109,9 @@ class BaseEnv(ABC):
             normalize_state=False,
             reward_scale=None,
             num_envs=1,
+            num_workers=None,
+            async_batch_size=None,
+            numpy_vec=False,
         ))
         util.set_attr(self, spec['meta'], [
             'eval_frequency',
@@ -119,17 +125,23 @@ class BaseEnv(ABC):
             'normalize_state',
             'reward_scale',
             'num_envs',
+            'num_workers',
+            'async_batch_size',
+            'numpy_vec',
             'max_t',
             'max_frame',
         ])
         if util.get_lab_mode() == 'eval':  # override if env is for eval
             self.num_envs = ps.get(spec, 'meta.rigorous_eval')
+            self.async_batch_size = None  # eval runs full episodes synchronously
         self.to_render = util.to_render()
         self._infer_frame_attr(spec)
         self._infer_venv_attr()
         self._set_clock()
         self.done = False
         self.total_reward = np.nan
+        self.state_normalizer = None  # the vector state normalizer, if any, see VecNormalizeState
+        self.reward_tracker = None  # the vector reward tracker, if any, see VecTrackReward
 
     def _get_spaces(self, u_env):
         '''Helper to set the extra attributes to, and get, observation and action spaces'''
@@ -173,6 +185,7 @@ class BaseEnv(ABC):
     def _infer_venv_attr(self):
         '''Infer vectorized env attributes'''
         self.is_venv = (self.num_envs is not None and self.num_envs > 1)
+        self.is_async = self.is_venv and self.async_batch_size is not None
 
     def _is_discrete(self, action_space):
         '''Check if an action space is discrete'''
@@ -196,6 +209,18 @@ class BaseEnv(ABC):
         else:  # vec env tuple of infos
             self.total_reward = np.array([i['total_reward'] for i in info])
 
+    def save(self, ckpt=None):
+        '''Save the env state which is trained along with the agent, e.g. the state normalizer statistics; saves nothing by default'''
+        pass
+
+    def load(self):
+        '''Load the env state saved with save(); loads nothing by default'''
+        pass
+
+    def share_state_stats(self, env):
+        '''Normalize the states with the statistics of another env; does nothing by default'''
+        pass
+
     @abstractmethod
     @lab_api
     def reset(self):
@@ -1,11 +1,13 @@
+from collections import deque
 from slm_lab.env.base import BaseEnv
 from slm_lab.env.wrapper import make_gym_env
-from slm_lab.env.vec_env import make_gym_venv
+from slm_lab.env.vec_env import VecNormalizeState, VecTrackReward, get_vec_wrapper, make_gym_venv
 from slm_lab.env.registration import try_register_env
 from slm_lab.lib import logger, util
 from slm_lab.lib.decorator import lab_api
 import gym
 import numpy as np
+import os
 import pydash as ps
 import roboschool
 import pybullet_envs
@@ -13,6 +15,9 @@ import pybullet_envs
 
 logger = logger.get_logger(__name__)
 
+# max number of transitions an async env can get ahead of the slowest env before it is held back, for off-policy algorithms
+ASYNC_MAX_LAG = 4
+
 
 class OpenAIEnv(BaseEnv):
     '''
@@ -26,18 +31,28 @@ class OpenAIEnv(BaseEnv):
         "normalize_state": false,
         "reward_scale": "sign",
         "num_envs": 8,
+        "num_workers": 4,
+        "async_batch_size": null,
+        "numpy_vec": false,
         "max_t": null,
         "max_frame": 1e7
     }],
     '''
 
-    def __init__(self, spec):
+    def __init__(self, spec, env_pool=None):
         super().__init__(spec)
         try_register_env(spec)  # register if it's a custom gym env
         seed = ps.get(spec, 'meta.random_seed')
         episode_life = util.in_train_lab_mode()
+        self.async_max_lag = ASYNC_MAX_LAG  # capped at 1 by Session for on-policy algorithms
         if self.is_venv:  # make vector environment
-            self.u_env = make_gym_venv(name=self.name, num_envs=self.num_envs, seed=seed, frame_op=self.frame_op, frame_op_len=self.frame_op_len, image_downsize=self.image_downsize, reward_scale=self.reward_scale, normalize_state=self.normalize_state, episode_life=episode_life)
+            self.u_env = make_gym_venv(name=self.name, num_envs=self.num_envs, seed=seed, frame_op=self.frame_op, frame_op_len=self.frame_op_len, image_downsize=self.image_downsize, reward_scale=self.reward_scale, normalize_state=self.normalize_state, episode_life=episode_life, num_workers=self.num_workers, async_batch_size=self.async_batch_size, env_pool=env_pool, numpy_vec=self.numpy_vec)
+            self.reward_tracker = get_vec_wrapper(self.u_env, VecTrackReward)
+            # the states of a venv are normalized at vector level with statistics saved with the agent, and frozen for eval
+            self.state_normalizer = get_vec_wrapper(self.u_env, VecNormalizeState)
+            if self.state_normalizer is not None:
+                self.state_normalizer.is_frozen = util.in_eval_lab_mode()
+                self.meta_spec = spec['meta']
         else:
             self.u_env = make_gym_env(name=self.name, seed=seed, frame_op=self.frame_op, frame_op_len=self.frame_op_len, image_downsize=self.image_downsize, reward_scale=self.reward_scale, normalize_state=self.normalize_state, episode_life=episode_life)
         if self.name.startswith('Unity'):
@@ -51,6 +66,40 @@ class OpenAIEnv(BaseEnv):
         assert self.max_t is not None
         logger.info(util.self_desc(self))
 
+    def _update_total_reward(self, info):
+        '''Read total_reward from the vector reward tracker of a venv, or from info otherwise'''
+        if self.reward_tracker is None:
+            return super()._update_total_reward(info)
+        self.total_reward = self.reward_tracker.total_reward.copy()
+
+    def get_state_normalizer_path(self, ckpt=None):
+        prepath = self.meta_spec['model_prepath']
+        if ckpt is not None:
+            prepath += f'_ckpt-{ckpt}'
+        return f'{prepath}_state_normalizer.npz'
+
+    def save(self, ckpt=None):
+        '''Save the running statistics of the vector state normalizer, if any'''
+        if self.state_normalizer is None:
+            return
+        np.savez(util.smart_path(self.get_state_normalizer_path(ckpt)), **self.state_normalizer.get_stats())
+
+    def load(self):
+        '''Load the running statistics of the vector state normalizer, if any, from the latest or, in enjoy mode, the best ckpt'''
+        if self.state_normalizer is None:
+            return
+        ckpt = 'best' if util.get_lab_mode() == 'enjoy' else None
+        path = util.smart_path(self.get_state_normalizer_path(ckpt))
+        if not os.path.exists(path):
+            logger.info(f'No saved state normalizer at {path}; starting with fresh statistics')
+            return
+        self.state_normalizer.load_stats(np.load(path))
+
+    def share_state_stats(self, env):
+        '''Normalize the states with the statistics of another env, e.g. for the eval env to use those of the train env'''
+        if self.state_normalizer is not None and getattr(env, 'state_normalizer', None) is not None:
+            self.state_normalizer.share_stats(env.state_normalizer)
+
     def seed(self, seed):
         self.u_env.seed(seed)
 
@@ -75,6 +124,58 @@ class OpenAIEnv(BaseEnv):
         self.done = done
         return state, reward, done, info
 
+    def reset_async(self):
+        '''
+        Reset for async stepping with step_send/step_recv
+        @returns (state, env_ids) the states of all envs to act on, and their env_ids
+        '''
+        state = self.reset()
+        self.async_states = state.copy()
+        self.async_actions = None
+        self.async_queues = [deque() for _ in range(self.num_envs)]
+        self.async_parked_ids = []  # ready envs held back for getting too far ahead
+        self.total_reward = np.full(self.num_envs, np.nan)
+        return state, np.arange(self.num_envs)
+
+    def step_send(self, action, env_ids):
+        '''Send the actions to the envs env_ids to start stepping them asynchronously'''
+        # guard for squeezed actions, and store in the per-env shape used by memory
+        action_shape = () if not self.is_discrete and self.action_dim == 1 else self.action_space.shape
+        action = np.reshape(action, (len(env_ids),) + action_shape)
+        if self.async_actions is None:
+            self.async_actions = np.zeros((self.num_envs,) + action_shape, dtype=action.dtype)
+        self.async_actions[env_ids] = action
+        if not self.is_discrete and self.action_dim == 1:  # guard for continuous with action_dim 1, make array
+            action = np.expand_dims(action, axis=-1)
+        self.u_env.step_send(action, env_ids)
+
+    def step_recv(self):
+        '''
+        Receive the envs which finished stepping first, and queue their transitions per env.
+        A round of transitions across all envs is emitted once every env has one, so memory and algorithm still see full (num_envs, ...) batches in the same layout as synchronous stepping.
+        Envs which get async_max_lag transitions ahead of the slowest env are held back until it catches up.
+        Since the algorithm updates once per emitted round, the actions of a round may then come from a policy up to async_max_lag - 1 updates older than the latest: fine for off-policy algorithms, but on-policy ones need async_max_lag 1, where only the envs ready first within a round act early and all act on the latest policy.
+        @returns (state, env_ids, rounds) the states and env_ids to act on next, and the list of emitted rounds (state, action, reward, next_state, done)
+        '''
+        rounds = []
+        env_ids = []
+        while not len(env_ids):  # wait until an env can act
+            next_state, reward, done, info, ready_ids = self.u_env.step_recv()
+            for i, e in enumerate(ready_ids):
+                self.async_queues[e].append((self.async_states[e].copy(), self.async_actions[e], reward[i], next_state[i], done[i]))
+                self.async_states[e] = next_state[i]
+            self.total_reward[ready_ids] = self.reward_tracker.total_reward[ready_ids]
+            while all(self.async_queues):
+                transitions = [queue.popleft() for queue in self.async_queues]
+                rounds.append(tuple(np.array(data) for data in zip(*transitions)))
+            self.async_parked_ids.extend(ready_ids)
+            env_ids = [e for e in self.async_parked_ids if len(self.async_queues[e]) < self.async_max_lag]
+            self.async_parked_ids = [e for e in self.async_parked_ids if e not in env_ids]
+        env_ids = np.sort(env_ids)
+        if rounds:
+            self.done = rounds[-1][-1]
+        return self.async_states[env_ids], env_ids, rounds
+
     @lab_api
     def close(self):
         self.u_env.close()
@@ -0,0 +1,270 @@
+# Pure numpy vector environments for the gym classic control family.
+# Each steps all its envs at once as array operations in one process, with the dynamics and termination of the gym envs:
+# https://github.com/openai/gym/tree/master/gym/envs/classic_control
+from abc import abstractmethod
+from gym import spaces
+from gym.utils import seeding
+from slm_lab.env.vec_env import VecEnv
+import gym
+import numpy as np
+
+
+class NumpyVecEnv(VecEnv):
+    '''
+    Base VecEnv for an env whose state is an array of shape (num_envs, state_dim) stepped with array operations.
+    Implement reset_state, step_state and get_obs. This handles the gym TimeLimit max_episode_steps of the registered env spec, and auto-resets the done envs like DummyVecEnv.
+    Each env has its own RandomState seeded with seed + i as gym would, so env i gives the same trajectory as make_gym_env(name, seed + i), up to float rounding.
+    Async stepping with step_send/step_recv is supported for compatibility, and steps the pending envs synchronously.
+    '''
+    state_dim = None
+
+    def __init__(self, name, num_envs, seed=0, observation_space=None, action_space=None):
+        VecEnv.__init__(self, num_envs, observation_space, action_space)
+        self.spec = gym.spec(name)
+        self.max_episode_steps = self.spec.max_episode_steps
+        self.np_randoms = [seeding.np_random(None if seed is None else seed + i)[0] for i in range(num_envs)]
+        self.state = np.zeros((num_envs, self.state_dim))
+        self.elapsed_steps = np.zeros(num_envs, dtype=np.int64)
+        self.actions = None
+        self.pending_ids = np.array([], dtype=np.int64)
+        self.all_ids = np.arange(num_envs)
+
+    @abstractmethod
+    def reset_state(self, np_random):
+        '''Sample the initial state of an env from its np_random, consuming the same random draws as the gym env reset'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def step_state(self, state, actions):
+        '''Step a batch of states with their actions. @returns (next_state, rewards, dones) arrays'''
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_obs(self, state):
+        '''Get the observations of a batch of states'''
+        raise NotImplementedError
+
+    def reset_envs(self, env_ids):
+        for e in env_ids:
+            self.state[e] = self.reset_state(self.np_randoms[e])
+        self.elapsed_steps[env_ids] = 0
+
+    def step_envs(self, actions, env_ids):
+        '''Step the envs env_ids, auto-resetting the done ones. @returns (obs, rews, dones, infos) of the envs'''
+        state, rews, dones = self.step_state(self.state[env_ids], np.asarray(actions))
+        self.state[env_ids] = state
+        self.elapsed_steps[env_ids] += 1
+        if self.max_episode_steps is not None:
+            dones |= self.elapsed_steps[env_ids] >= self.max_episode_steps
+        if dones.any():
+            self.reset_envs(env_ids[dones])
+        obs = self.get_obs(self.state[env_ids]).astype(np.float32)
+        return obs, rews.astype(np.float64), dones, tuple({} for _ in env_ids)
+
+    def reset(self):
+        self.reset_envs(self.all_ids)
+        return self.get_obs(self.state).astype(np.float32)
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        return self.step_envs(self.actions, self.all_ids)
+
+    def step_send(self, actions, env_ids):
+        self.actions = actions
+        self.pending_ids = np.asarray(env_ids)
+
+    def step_recv(self):
+        env_ids, self.pending_ids = self.pending_ids, np.array([], dtype=np.int64)
+        return self.step_envs(self.actions, env_ids) + (env_ids,)
+
+
+class CartPoleVecEnv(NumpyVecEnv):
+    '''Vector CartPole-v0/v1, see gym CartPoleEnv'''
+    state_dim = 4
+    gravity = 9.8
+    masscart = 1.0
+    masspole = 0.1
+    total_mass = masspole + masscart
+    length = 0.5  # actually half the pole's length
+    polemass_length = masspole * length
+    force_mag = 10.0
+    tau = 0.02  # seconds between state updates
+    theta_threshold_radians = 12 * 2 * np.pi / 360
+    x_threshold = 2.4
+
+    def __init__(self, name, num_envs, seed=0):
+        high = np.array([self.x_threshold * 2, np.finfo(np.float32).max, self.theta_threshold_radians * 2, np.finfo(np.float32).max])
+        super().__init__(name, num_envs, seed, spaces.Box(-high, high, dtype=np.float32), spaces.Discrete(2))
+
+    def reset_state(self, np_random):
+        return np_random.uniform(low=-0.05, high=0.05, size=(4,))
+
+    def step_state(self, state, actions):
+        x, x_dot, theta, theta_dot = state.T
+        force = np.where(actions == 1, self.force_mag, -self.force_mag)
+        costheta = np.cos(theta)
+        sintheta = np.sin(theta)
+        temp = (force + self.polemass_length * theta_dot * theta_dot * sintheta) / self.total_mass
+        thetaacc = (self.gravity * sintheta - costheta * temp) / (self.length * (4.0 / 3.0 - self.masspole * costheta * costheta / self.total_mass))
+        xacc = temp - self.polemass_length * thetaacc * costheta / self.total_mass
+        # euler integration
+        x = x + self.tau * x_dot
+        x_dot = x_dot + self.tau * xacc
+        theta = theta + self.tau * theta_dot
+        theta_dot = theta_dot + self.tau * thetaacc
+        dones = (x < -self.x_threshold) | (x > self.x_threshold) | (theta < -self.theta_threshold_radians) | (theta > self.theta_threshold_radians)
+        return np.stack([x, x_dot, theta, theta_dot], axis=1), np.ones(len(state)), dones
+
+    def get_obs(self, state):
+        return state
+
+
+class AcrobotVecEnv(NumpyVecEnv):
+    '''Vector Acrobot-v1, see gym AcrobotEnv, with the book dynamics integrated by RK4'''
+    state_dim = 4
+    dt = 0.2
+    LINK_LENGTH_1 = 1.0
+    LINK_MASS_1 = 1.0
+    LINK_MASS_2 = 1.0
+    LINK_COM_POS_1 = 0.5
+    LINK_COM_POS_2 = 0.5
+    LINK_MOI = 1.0
+    MAX_VEL_1 = 4 * np.pi
+    MAX_VEL_2 = 9 * np.pi
+    AVAIL_TORQUE = np.array([-1.0, 0.0, 1.0])
+
+    def __init__(self, name, num_envs, seed=0):
+        high = np.array([1.0, 1.0, 1.0, 1.0, self.MAX_VEL_1, self.MAX_VEL_2])
+        super().__init__(name, num_envs, seed, spaces.Box(low=-high, high=high, dtype=np.float32), spaces.Discrete(3))
+
+    def reset_state(self, np_random):
+        return np_random.uniform(low=-0.1, high=0.1, size=(4,))
+
+    def dsdt(self, s, a):
+        '''The time derivative of the states s with torques a'''
+        m1, m2 = self.LINK_MASS_1, self.LINK_MASS_2
+        l1 = self.LINK_LENGTH_1
+        lc1, lc2 = self.LINK_COM_POS_1, self.LINK_COM_POS_2
+        I1 = I2 = self.LINK_MOI
+        g = 9.8
+        theta1, theta2, dtheta1, dtheta2 = s.T
+        d1 = m1 * lc1 ** 2 + m2 * (l1 ** 2 + lc2 ** 2 + 2 * l1 * lc2 * np.cos(theta2)) + I1 + I2
+        d2 = m2 * (lc2 ** 2 + l1 * lc2 * np.cos(theta2)) + I2
+        phi2 = m2 * lc2 * g * np.cos(theta1 + theta2 - np.pi / 2.)
+        phi1 = - m2 * l1 * lc2 * dtheta2 ** 2 * np.sin(theta2) \
+            - 2 * m2 * l1 * lc2 * dtheta2 * dtheta1 * np.sin(theta2) \
+            + (m1 * lc1 + m2 * l1) * g * np.cos(theta1 - np.pi / 2) + phi2
+        ddtheta2 = (a + d2 / d1 * phi1 - m2 * l1 * lc2 * dtheta1 ** 2 * np.sin(theta2) - phi2) / (m2 * lc2 ** 2 + I2 - d2 ** 2 / d1)
+        ddtheta1 = -(d2 * ddtheta2 + phi1) / d1
+        return np.stack([dtheta1, dtheta2, ddtheta1, ddtheta2], axis=1)
+
+    def step_state(self, state, actions):
+        torque = self.AVAIL_TORQUE[actions.astype(int)]
+        # one RK4 step over dt
+        dt, dt2 = self.dt, self.dt / 2.0
+        k1 = self.dsdt(state, torque)
+        k2 = self.dsdt(state + dt2 * k1, torque)
+        k3 = self.dsdt(state + dt2 * k2, torque)
+        k4 = self.dsdt(state + dt * k3, torque)
+        ns = state + dt / 6.0 * (k1 + 2 * k2 + 2 * k3 + k4)
+        ns[:, 0] = wrap(ns[:, 0], -np.pi, np.pi)
+        ns[:, 1] = wrap(ns[:, 1], -np.pi, np.pi)
+        ns[:, 2] = np.clip(ns[:, 2], -self.MAX_VEL_1, self.MAX_VEL_1)
+        ns[:, 3] = np.clip(ns[:, 3], -self.MAX_VEL_2, self.MAX_VEL_2)
+        dones = -np.cos(ns[:, 0]) - np.cos(ns[:, 1] + ns[:, 0]) > 1.
+        rewards = np.where(dones, 0.0, -1.0)
+        return ns, rewards, dones
+
+    def get_obs(self, state):
+        return np.stack([np.cos(state[:, 0]), np.sin(state[:, 0]), np.cos(state[:, 1]), np.sin(state[:, 1]), state[:, 2], state[:, 3]], axis=1)
+
+
+def wrap(x, m, M):
+    '''Wrap x into [m, M] by whole turns of M - m as the gym acrobot wrap does'''
+    diff = M - m
+    while (x > M).any():
+        x = np.where(x > M, x - diff, x)
+    while (x < m).any():
+        x = np.where(x < m, x + diff, x)
+    return x
+
+
+class MountainCarVecEnv(NumpyVecEnv):
+    '''Vector MountainCar-v0, see gym MountainCarEnv'''
+    state_dim = 2
+    min_position = -1.2
+    max_position = 0.6
+    max_speed = 0.07
+    goal_position = 0.5
+    force = 0.001
+    gravity = 0.0025
+
+    def __init__(self, name, num_envs, seed=0):
+        low = np.array([self.min_position, -self.max_speed])
+        high = np.array([self.max_position, self.max_speed])
+        super().__init__(name, num_envs, seed, spaces.Box(low, high, dtype=np.float32), spaces.Discrete(3))
+
+    def reset_state(self, np_random):
+        return np.array([np_random.uniform(low=-0.6, high=-0.4), 0])
+
+    def step_state(self, state, actions):
+        position, velocity = state.T
+        velocity = velocity + ((actions - 1) * self.force + np.cos(3 * position) * (-self.gravity))
+        velocity = np.clip(velocity, -self.max_speed, self.max_speed)
+        position = np.clip(position + velocity, self.min_position, self.max_position)
+        velocity[(position == self.min_position) & (velocity < 0)] = 0
+        dones = position >= self.goal_position
+        return np.stack([position, velocity], axis=1), np.full(len(state), -1.0), dones
+
+    def get_obs(self, state):
+        return state
+
+
+class PendulumVecEnv(NumpyVecEnv):
+    '''Vector Pendulum-v0, see gym PendulumEnv'''
+    state_dim = 2
+    max_speed = 8
+    max_torque = 2.
+    dt = .05
+    g = 10.
+    m = 1.
+    l = 1.
+
+    def __init__(self, name, num_envs, seed=0):
+        high = np.array([1., 1., self.max_speed])
+        action_space = spaces.Box(low=-self.max_torque, high=self.max_torque, shape=(1,), dtype=np.float32)
+        super().__init__(name, num_envs, seed, spaces.Box(low=-high, high=high, dtype=np.float32), action_space)
+
+    def reset_state(self, np_random):
+        high = np.array([np.pi, 1])
+        return np_random.uniform(low=-high, high=high)
+
+    def step_state(self, state, actions):
+        th, thdot = state.T
+        g, m, l, dt = self.g, self.m, self.l, self.dt
+        u = np.clip(np.reshape(actions, (len(state), -1))[:, 0], -self.max_torque, self.max_torque)
+        costs = angle_normalize(th) ** 2 + .1 * thdot ** 2 + .001 * (u ** 2)
+        newthdot = thdot + (-3 * g / (2 * l) * np.sin(th + np.pi) + 3. / (m * l ** 2) * u) * dt
+        newth = th + newthdot * dt
+        newthdot = np.clip(newthdot, -self.max_speed, self.max_speed)
+        return np.stack([newth, newthdot], axis=1), -costs, np.zeros(len(state), dtype=bool)
+
+    def get_obs(self, state):
+        theta, thetadot = state.T
+        return np.stack([np.cos(theta), np.sin(theta), thetadot], axis=1)
+
+
+def angle_normalize(x):
+    return (((x + np.pi) % (2 * np.pi)) - np.pi)
+
+
+# the gym env names with a native numpy vector env, used by make_gym_venv with the env spec key numpy_vec: true
+NUMPY_VEC_ENVS = {
+    'CartPole-v0': CartPoleVecEnv,
+    'CartPole-v1': CartPoleVecEnv,
+    'Acrobot-v1': AcrobotVecEnv,
+    'MountainCar-v0': MountainCarVecEnv,
+    'Pendulum-v0': PendulumVecEnv,
+}
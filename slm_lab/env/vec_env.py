@@ -1,30 +1,48 @@
 # Wrappers for parallel vector environments.
 # Adapted from OpenAI Baselines (MIT) https://github.com/openai/baselines/tree/master/baselines/common/vec_env
 from abc import ABC, abstractmethod
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 from functools import partial
 from gym import spaces
-from slm_lab.env.wrapper import make_gym_env
+from slm_lab.env.wrapper import EpisodicLifeEnv, make_gym_env, try_scale_reward
 from slm_lab.lib import logger
+import atexit
 import contextlib
 import ctypes
 import gym
+import multiprocessing.connection
 import numpy as np
 import os
 import torch.multiprocessing as mp
 
 
 _NP_TO_CT = {
+    np.float64: ctypes.c_double,
     np.float32: ctypes.c_float,
+    np.int64: ctypes.c_int64,
     np.int32: ctypes.c_int32,
     np.int8: ctypes.c_int8,
     np.uint8: ctypes.c_char,
     np.bool: ctypes.c_bool,
 }
+# the subset of step info passed through shared memory by ShmemVecEnv, with their dtypes
+SHMEM_INFO_KEYS = {
+    'was_real_done': np.bool,  # from EpisodicLifeEnv
+}
+# ShmemVecEnv worker commands; a step runs entirely on shared memory, others are sent through the pipe
+_CMD_STEP = 0
+_CMD_PIPE = 1
 
 
 # helper methods
 
+def is_proc_dead(proc):
+    '''
+    Check if a started process exited, also from a process other than its parent, e.g. a forked session which inherited its venv: there exitcode stays None since only the parent can wait on it, but the sentinel, the read end of a pipe held open by the process, is inherited too and becomes ready at exit
+    '''
+    return bool(multiprocessing.connection.wait([proc.sentinel], timeout=0))
+
+
 @contextlib.contextmanager
 def clear_mpi_env_vars():
     '''
@@ -85,6 +103,11 @@ def obs_space_info(obs_space):
     return keys, shapes, dtypes
 
 
+def shm_to_np(shm_arr, shape, dtype):
+    '''Create a persistent numpy view of shape (N, *shape) on a contiguous shared memory array holding N elements of shape'''
+    return np.frombuffer(shm_arr.get_obj(), dtype=dtype).reshape((-1,) + tuple(shape))
+
+
 def tile_images(img_nhwc):
     '''
     Tile N images into a rectangular grid for rendering
@@ -105,31 +128,69 @@ def tile_images(img_nhwc):
 
 def subproc_worker(
         pipe, parent_pipe, env_fn_wrapper,
-        obs_bufs, obs_shapes, obs_dtypes, keys):
+        obs_bufs, obs_shapes, obs_dtypes, keys,
+        step_bufs, act_shape, act_dtype, step_sem, ready_sem, worker_idx, env_idxs):
     '''
-    Control a single environment instance using IPC and shared memory. Used by ShmemVecEnv.
+    Control a block of environment instances using IPC and shared memory. Used by ShmemVecEnv.
+    The envs are stepped sequentially like a DummyVecEnv, and each env writes into its own slice of the shared buffers, given by env_idxs.
+    The worker waits on step_sem, then reads its cmd from shared memory: a step reads the actions and writes the observations, rewards, dones and info subset of all its envs, then sets its ready flag and signals ready_sem, which is shared by all workers; any other command is received through the pipe.
     '''
-    def _write_obs(maybe_dict_obs):
+    obs_views = {k: shm_to_np(obs_bufs[k], obs_shapes[k], obs_dtypes[k]) for k in keys}
+    cmds = shm_to_np(step_bufs['cmds'], (), np.int8)
+    readys = shm_to_np(step_bufs['readys'], (), np.bool)
+    actions = shm_to_np(step_bufs['actions'], act_shape, act_dtype)
+    rewards = shm_to_np(step_bufs['rewards'], (), np.float64)
+    dones = shm_to_np(step_bufs['dones'], (), np.bool)
+    info_views = {k: shm_to_np(step_bufs[k], (), dtype) for k, dtype in SHMEM_INFO_KEYS.items()}
+    info_masks = {k: shm_to_np(step_bufs[f'has_{k}'], (), np.bool) for k in SHMEM_INFO_KEYS}
+
+    def _write_obs(env_idx, maybe_dict_obs):
         flatdict = obs_to_dict(maybe_dict_obs)
         for k in keys:
-            dst = obs_bufs[k].get_obj()
-            dst_np = np.frombuffer(dst, dtype=obs_dtypes[k]).reshape(obs_shapes[k])
-            np.copyto(dst_np, flatdict[k])
+            np.copyto(obs_views[k][env_idx], flatdict[k])
 
-    env = env_fn_wrapper.x()
+    def _write_info(env_idx, info):
+        for k in SHMEM_INFO_KEYS:
+            info_masks[k][env_idx] = k in info
+            if k in info:
+                info_views[k][env_idx] = info[k]
+
+    envs = [env_fn() for env_fn in env_fn_wrapper.x]
     parent_pipe.close()
     try:
         while True:
+            step_sem.acquire()
+            if cmds[worker_idx] == _CMD_STEP:
+                for env_idx, env in zip(env_idxs, envs):
+                    obs, reward, done, info = env.step(actions[env_idx].copy())
+                    if done:
+                        obs = env.reset()
+                    _write_obs(env_idx, obs)
+                    rewards[env_idx] = reward
+                    dones[env_idx] = done
+                    _write_info(env_idx, info)
+                readys[worker_idx] = True
+                ready_sem.release()
+                continue
             cmd, data = pipe.recv()
             if cmd == 'reset':
-                pipe.send(_write_obs(env.reset()))
-            elif cmd == 'step':
-                obs, reward, done, info = env.step(data)
-                if done:
-                    obs = env.reset()
-                pipe.send((_write_obs(obs), reward, done, info))
+                for env_idx, env in zip(env_idxs, envs):
+                    _write_obs(env_idx, env.reset())
+                pipe.send(None)
+            elif cmd == 'seed':  # reseed the envs for a new lease from EnvPool, which resets them next
+                seeds, episode_life = data
+                for env, seed in zip(envs, seeds):
+                    env.seed(seed)
+                    wrapped_env = env
+                    while isinstance(wrapped_env, gym.Wrapper):
+                        if isinstance(wrapped_env, EpisodicLifeEnv):
+                            wrapped_env.was_real_done = True  # force a real reset from a lost life state
+                            if episode_life is not None:
+                                wrapped_env.episode_life = episode_life
+                        wrapped_env = wrapped_env.env
+                pipe.send(None)
             elif cmd == 'render':
-                pipe.send(env.render(mode='rgb_array'))
+                pipe.send([env.render(mode='rgb_array') for env in envs])
             elif cmd == 'close':
                 pipe.send(None)
                 break
@@ -138,7 +199,8 @@ def subproc_worker(
     except KeyboardInterrupt:
         logger.exception('ShmemVecEnv worker: got KeyboardInterrupt')
     finally:
-        env.close()
+        for env in envs:
+            env.close()
 
 
 # vector environment wrappers
@@ -351,6 +413,12 @@ class VecEnvWrapper(VecEnv):
     def step_async(self, actions):
         self.venv.step_async(actions)
 
+    def step_send(self, actions, env_ids):
+        self.venv.step_send(actions, env_ids)
+
+    def step_recv(self):
+        return self.venv.step_recv()
+
     @abstractmethod
     def reset(self):
         pass
@@ -372,60 +440,174 @@ class VecEnvWrapper(VecEnv):
 class ShmemVecEnv(VecEnv):
     '''
     Optimized version of SubprocVecEnv that uses shared variables to communicate observations.
+    The observations of all envs are stored in one contiguous shared array of shape (num_envs, *obs_shape) per key, with persistent numpy views in the workers and here.
+    Steps do not pickle anything: the actions, rewards, dones and the info subset SHMEM_INFO_KEYS also go through shared arrays, and each worker is signaled with a pair of semaphores. Other info keys are dropped. reset, render and close still go through the pipes.
+    @param bool:copy_obs If True, step and reset return a copy of the observations; else return the shared views, which are only valid until the next step, for a consumer that copies them right away such as VecFrameStack
+    @param int:num_workers The number of worker processes, each stepping a contiguous block of the envs sequentially. Defaults to one per env; use fewer to avoid oversubscribing the CPU cores with many cheap envs
+    @param int:async_batch_size If set, enables asynchronous stepping with step_send and step_recv: step_recv returns as soon as the workers of at least async_batch_size envs are ready, together with their env_ids, so that slow envs (e.g. on reset) do not stall the others
+    @param tuple:env_spaces The (observation_space, action_space, spec) of the envs if known, e.g. cached by EnvPool; else they are read from a dummy env
     '''
 
-    def __init__(self, env_fns, context='spawn'):
+    def __init__(self, env_fns, context='spawn', copy_obs=True, num_workers=None, async_batch_size=None, env_spaces=None):
         ctx = mp.get_context(context)
-        dummy = env_fns[0]()
-        observation_space, action_space = dummy.observation_space, dummy.action_space
-        self.spec = dummy.spec
-        dummy.close()
-        del dummy
+        if env_spaces is None:
+            dummy = env_fns[0]()
+            env_spaces = (dummy.observation_space, dummy.action_space, dummy.spec)
+            dummy.close()
+            del dummy
+        observation_space, action_space, self.spec = env_spaces
+        self.pool = None  # the EnvPool which this is leased from, if any
+        self.owner_pid = os.getpid()  # only the parent of the workers can close them
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
+        self.copy_obs = copy_obs
+        num_workers = min(num_workers or self.num_envs, self.num_envs)
+        self.all_worker_env_idxs = np.array_split(np.arange(self.num_envs), num_workers)
+        self.async_batch_size = async_batch_size
         self.obs_keys, self.obs_shapes, self.obs_dtypes = obs_space_info(observation_space)
-        self.obs_bufs = [
-            {k: ctx.Array(_NP_TO_CT[self.obs_dtypes[k].type], int(np.prod(self.obs_shapes[k]))) for k in self.obs_keys}
-            for _ in env_fns]
-        self.parent_pipes = []
-        self.procs = []
+        self.obs_bufs = {k: ctx.Array(_NP_TO_CT[self.obs_dtypes[k].type], self.num_envs * int(np.prod(self.obs_shapes[k]))) for k in self.obs_keys}
+        act_shape, act_dtype = action_space.shape, action_space.dtype
+        self.step_bufs = {
+            'cmds': ctx.Array(ctypes.c_int8, num_workers),
+            'readys': ctx.Array(ctypes.c_bool, num_workers),
+            'actions': ctx.Array(_NP_TO_CT[act_dtype.type], self.num_envs * int(np.prod(act_shape))),
+            'rewards': ctx.Array(ctypes.c_double, self.num_envs),
+            'dones': ctx.Array(ctypes.c_bool, self.num_envs),
+        }
+        for k, dtype in SHMEM_INFO_KEYS.items():
+            self.step_bufs[k] = ctx.Array(_NP_TO_CT[dtype], self.num_envs)
+            self.step_bufs[f'has_{k}'] = ctx.Array(ctypes.c_bool, self.num_envs)
+        self.all_step_sems = [ctx.Semaphore(0) for _ in range(num_workers)]
+        self.ready_sem = ctx.Semaphore(0)
+        self.all_parent_pipes = []
+        self.all_procs = []
         with clear_mpi_env_vars():
-            for env_fn, obs_buf in zip(env_fns, self.obs_bufs):
-                wrapped_fn = CloudpickleWrapper(env_fn)
+            for worker_idx, env_idxs in enumerate(self.all_worker_env_idxs):
+                wrapped_fn = CloudpickleWrapper([env_fns[env_idx] for env_idx in env_idxs])
                 parent_pipe, child_pipe = ctx.Pipe()
                 proc = ctx.Process(
                     target=subproc_worker,
-                    args=(child_pipe, parent_pipe, wrapped_fn, obs_buf, self.obs_shapes, self.obs_dtypes, self.obs_keys))
+                    args=(child_pipe, parent_pipe, wrapped_fn, self.obs_bufs, self.obs_shapes, self.obs_dtypes, self.obs_keys,
+                          self.step_bufs, act_shape, act_dtype, self.all_step_sems[worker_idx], self.ready_sem, worker_idx, env_idxs))
                 proc.daemon = True
-                self.procs.append(proc)
-                self.parent_pipes.append(parent_pipe)
+                self.all_procs.append(proc)
+                self.all_parent_pipes.append(parent_pipe)
                 proc.start()
                 child_pipe.close()
+        self.activate(num_workers)
         self.waiting_step = False
         self.viewer = None
 
+    def activate(self, num_workers):
+        '''
+        Use only the first num_workers worker blocks and their envs, e.g. for a lease of fewer envs from EnvPool; the workers of the other blocks wait idle.
+        Sets the views of the shared buffers and the worker lists of the active ones. Must not be called while stepping.
+        '''
+        self.num_workers = num_workers
+        self.worker_env_idxs = self.all_worker_env_idxs[:num_workers]
+        self.num_envs = sum(len(env_idxs) for env_idxs in self.worker_env_idxs)
+        self.env_workers = np.repeat(np.arange(num_workers), [len(env_idxs) for env_idxs in self.worker_env_idxs])
+        self.obs_views = {k: shm_to_np(self.obs_bufs[k], self.obs_shapes[k], self.obs_dtypes[k])[:self.num_envs] for k in self.obs_keys}
+        self.cmds = shm_to_np(self.step_bufs['cmds'], (), np.int8)[:num_workers]
+        self.readys = shm_to_np(self.step_bufs['readys'], (), np.bool)[:num_workers]
+        self.is_stepping = np.zeros(num_workers, dtype=bool)  # workers sent a step and not yet received
+        self.actions = shm_to_np(self.step_bufs['actions'], self.action_space.shape, self.action_space.dtype)[:self.num_envs]
+        self.rewards = shm_to_np(self.step_bufs['rewards'], (), np.float64)[:self.num_envs]
+        self.dones = shm_to_np(self.step_bufs['dones'], (), np.bool)[:self.num_envs]
+        self.info_views = {k: shm_to_np(self.step_bufs[k], (), dtype)[:self.num_envs] for k, dtype in SHMEM_INFO_KEYS.items()}
+        self.info_masks = {k: shm_to_np(self.step_bufs[f'has_{k}'], (), np.bool)[:self.num_envs] for k in SHMEM_INFO_KEYS}
+        self.step_sems = self.all_step_sems[:num_workers]
+        self.parent_pipes = self.all_parent_pipes[:num_workers]
+        self.procs = self.all_procs[:num_workers]
+
     def reset(self):
-        if self.waiting_step:
+        if self.is_stepping.any():
             logger.warning('Called reset() while waiting for the step to complete')
-            self.step_wait()
+            self._wait_readys(self.is_stepping.sum())
+            self.waiting_step = False
+        self._send_pipe_cmds('reset')
+        for pipe in self.parent_pipes:
+            pipe.recv()
+        return self._decode_obses()
+
+    def seed(self, seeds, episode_life=None):
+        '''Reseed the envs with a seed each, without respawning them, and switch their EpisodicLifeEnv on or off if episode_life is given'''
+        self._send_pipe_cmds('seed', [([seeds[env_idx] for env_idx in env_idxs], episode_life) for env_idxs in self.worker_env_idxs])
         for pipe in self.parent_pipes:
-            pipe.send(('reset', None))
-        return self._decode_obses([pipe.recv() for pipe in self.parent_pipes])
+            pipe.recv()
 
     def step_async(self, actions):
-        assert len(actions) == len(self.parent_pipes)
-        for pipe, act in zip(self.parent_pipes, actions):
-            pipe.send(('step', act))
+        assert len(actions) == self.num_envs
+        self.step_send(actions, np.arange(self.num_envs))
+        self.waiting_step = True
 
     def step_wait(self):
-        outs = [pipe.recv() for pipe in self.parent_pipes]
-        obs, rews, dones, infos = zip(*outs)
-        return self._decode_obses(obs), np.array(rews), np.array(dones), infos
+        self._wait_readys(self.num_workers)
+        self.waiting_step = False
+        return self._recv_step(np.arange(self.num_envs))
+
+    def step_send(self, actions, env_ids):
+        '''Send actions to the envs env_ids to start their steps, which must cover whole worker blocks'''
+        workers = np.unique(self.env_workers[env_ids])
+        assert len(env_ids) == sum(len(self.worker_env_idxs[w]) for w in workers), 'env_ids must cover whole worker blocks'
+        assert not self.is_stepping[workers].any(), 'Cannot send to workers which are still stepping'
+        self.actions[env_ids] = actions
+        self.cmds[workers] = _CMD_STEP
+        self.is_stepping[workers] = True
+        for w in workers:
+            self.step_sems[w].release()
+
+    def step_recv(self):
+        '''
+        Wait for the first ready workers of at least async_batch_size envs, or all stepping ones if fewer.
+        @returns (obs, rews, dones, infos, env_ids) of only the ready envs
+        '''
+        num_stepping = sum(len(self.worker_env_idxs[w]) for w in np.flatnonzero(self.is_stepping))
+        batch_size = min(self.async_batch_size or self.num_envs, num_stepping)
+        workers = []
+        while sum(len(self.worker_env_idxs[w]) for w in workers) < batch_size:
+            ready_workers = self._wait_readys(1)
+            # more workers may have become ready in the meantime, collect their signals too
+            if len(ready_workers) > 1:
+                self._wait_readys(len(ready_workers) - 1, clear=False)
+            workers.extend(ready_workers)
+        env_ids = np.concatenate([self.worker_env_idxs[w] for w in sorted(workers)])
+        return self._recv_step(env_ids) + (env_ids,)
+
+    def _wait_readys(self, num_signals, clear=True):
+        '''Wait for num_signals ready signals from the workers, then return and clear the ready flags of the stepping workers'''
+        for _ in range(num_signals):
+            # guard against waiting forever on a worker that died mid-step
+            while not self.ready_sem.acquire(timeout=1):
+                for proc in self.procs:
+                    if is_proc_dead(proc):
+                        raise RuntimeError(f'ShmemVecEnv worker {proc.name} died')
+        if not clear:
+            return []
+        ready_workers = np.flatnonzero(self.readys & self.is_stepping)
+        self.readys[ready_workers] = False
+        self.is_stepping[ready_workers] = False
+        return list(ready_workers)
+
+    def _recv_step(self, env_ids):
+        '''Read the step results of the envs env_ids from shared memory'''
+        infos = tuple({k: self.info_views[k][e] for k in SHMEM_INFO_KEYS if self.info_masks[k][e]} for e in env_ids)
+        if len(env_ids) == self.num_envs:
+            obs = self._decode_obses()
+        else:
+            obs = dict_to_obs({k: v[env_ids] for k, v in self.obs_views.items()})
+        return obs, self.rewards[env_ids], self.dones[env_ids], infos
+
+    def close(self):
+        '''Return the envs to the EnvPool they are leased from, or close them'''
+        if self.pool is not None:
+            return self.pool.release(self)
+        super().close()
 
     def close_extras(self):
-        if self.waiting_step:
-            self.step_wait()
-        for pipe in self.parent_pipes:
-            pipe.send(('close', None))
+        if self.is_stepping.any():
+            self._wait_readys(self.is_stepping.sum())
+        self.activate(len(self.all_procs))  # close the idle workers too
+        self._send_pipe_cmds('close')
         for pipe in self.parent_pipes:
             pipe.recv()
             pipe.close()
@@ -433,21 +615,270 @@ class ShmemVecEnv(VecEnv):
             proc.join()
 
     def get_images(self, mode='human'):
-        for pipe in self.parent_pipes:
-            pipe.send(('render', None))
-        return [pipe.recv() for pipe in self.parent_pipes]
+        self._send_pipe_cmds('render')
+        return [img for pipe in self.parent_pipes for img in pipe.recv()]
+
+    def _send_pipe_cmds(self, cmd, worker_datas=None):
+        '''Wake up all workers to receive cmd, with their data from worker_datas if given, through the pipes'''
+        self.cmds[...] = _CMD_PIPE
+        worker_datas = worker_datas or [None] * self.num_workers
+        for step_sem, pipe, data in zip(self.step_sems, self.parent_pipes, worker_datas):
+            pipe.send((cmd, data))
+            step_sem.release()
+
+    def _decode_obses(self):
+        if self.copy_obs:
+            return dict_to_obs(copy_obs_dict(self.obs_views))
+        return dict_to_obs(self.obs_views)
 
-    def _decode_obses(self, obs):
-        result = {}
-        for k in self.obs_keys:
-            bufs = [b[k] for b in self.obs_bufs]
-            o = [np.frombuffer(b.get_obj(), dtype=self.obs_dtypes[k]).reshape(self.obs_shapes[k]) for b in bufs]
-            result[k] = np.array(o)
-        return dict_to_obs(result)
+
+class EnvPool:
+    '''
+    Pool of warm ShmemVecEnv workers which the sessions of the trials in a process and their eval envs lease from and return to, see get_env_pool.
+    The key passed to lease is the config of the envs built in the workers. A lease reuses the worker processes and envs of an idle venv with the same key instead of respawning them: they are reseeded with their EpisodicLifeEnv switched on or off for the lease, and reset. An idle venv with more envs serves a lease of fewer, e.g. an eval env, with a subset of its worker blocks. The env spaces are also cached per key so that a new ShmemVecEnv does not build a dummy env to read them.
+    Closing a leased venv returns it to the pool; close the pool to close them for good.
+    The pool is inherited by the forked session processes with its spaces cache and idle venvs; after forking a session which takes the idle venvs, lend_idle() them so the next sessions do not, and reclaim_lent() them once the sessions are done. Only the process which spawned the workers of a venv closes them.
+    A pool pickled for a spawned session process only carries its spaces cache, since the workers' fork-context semaphores cannot be shared with it.
+    Under a ray search each trial runs in its own actor process, so the workers are only reused within a trial; the trials of a job run in one process reuse those of the previous ones.
+    '''
+
+    def __init__(self):
+        self.env_spaces = {}
+        self.idle_venvs = defaultdict(list)
+        self.lent_venvs = []
+        self.owner_pid = os.getpid()
+
+    def __getstate__(self):
+        return {'env_spaces': self.env_spaces, 'idle_venvs': defaultdict(list), 'lent_venvs': [], 'owner_pid': self.owner_pid}
+
+    def lease(self, key, env_fns, seeds, copy_obs=True, num_workers=None, async_batch_size=None, episode_life=True):
+        '''Lease a ShmemVecEnv of env_fns for key, reseeded with seeds, from an idle one if any, else a new one'''
+        venv, lease_num_workers = self.find_idle(key, len(env_fns), num_workers)
+        if venv is not None:
+            self.idle_venvs[key].remove(venv)
+            venv.activate(lease_num_workers)
+            venv.copy_obs = copy_obs
+            venv.async_batch_size = async_batch_size
+            logger.debug(f'Leased warm env workers for {key}')
+        else:
+            venv = ShmemVecEnv(env_fns, context='fork', copy_obs=copy_obs, num_workers=num_workers, async_batch_size=async_batch_size, env_spaces=self.env_spaces.get(key))
+            self.env_spaces[key] = (venv.observation_space, venv.action_space, venv.spec)
+        venv.seed(seeds, episode_life)
+        venv.pool = self
+        venv.pool_key = key
+        venv.is_leased = True
+        return venv
+
+    def find_idle(self, key, num_envs, num_workers=None):
+        '''
+        Find the smallest idle venv of key whose first worker blocks hold num_envs envs, in num_workers blocks if given.
+        @returns (venv, num_workers) for ShmemVecEnv.activate, or (None, None)
+        '''
+        for venv in sorted(self.idle_venvs[key], key=lambda venv: len(venv.all_procs)):
+            block_ends = list(np.cumsum([len(env_idxs) for env_idxs in venv.all_worker_env_idxs]))
+            if num_envs in block_ends:
+                lease_num_workers = block_ends.index(num_envs) + 1
+                if num_workers is None or lease_num_workers == min(num_workers, num_envs):
+                    return venv, lease_num_workers
+        return None, None
+
+    def release(self, venv):
+        '''Return a leased venv to the pool once its workers are done stepping'''
+        if not venv.is_leased:  # guard for closing twice
+            return
+        venv.is_leased = False
+        if venv.is_stepping.any():
+            venv._wait_readys(venv.is_stepping.sum())
+        venv.waiting_step = False
+        self.idle_venvs[venv.pool_key].append(venv)
+
+    def lend_idle(self):
+        '''Set aside the idle venvs after a forked process inherited them, so that no other process leases them too'''
+        for venvs in self.idle_venvs.values():
+            self.lent_venvs.extend(venvs)
+        self.idle_venvs = defaultdict(list)
+
+    def reclaim_lent(self):
+        '''Return the lent venvs to idle after the forked processes which inherited them exited cleanly, having released them'''
+        for venv in self.lent_venvs:
+            if any(is_proc_dead(proc) for proc in venv.all_procs):
+                venv.pool = None
+                venv.close()
+            else:
+                self.idle_venvs[venv.pool_key].append(venv)
+        self.lent_venvs = []
+
+    def close(self):
+        '''Close the idle and lent venvs whose workers this process spawned'''
+        for venv in [venv for venvs in self.idle_venvs.values() for venv in venvs] + self.lent_venvs:
+            if venv.owner_pid == os.getpid():
+                venv.pool = None
+                venv.close()
+        self.idle_venvs = defaultdict(list)
+        self.lent_venvs = []
+
+
+_env_pool = None
+
+
+def get_env_pool():
+    '''Get the EnvPool of this process, which keeps the env workers warm across the trials it runs, and closes them at exit'''
+    global _env_pool
+    if _env_pool is None or _env_pool.owner_pid != os.getpid():  # a forked process starts its own
+        _env_pool = EnvPool()
+        atexit.register(_env_pool.close)
+    return _env_pool
+
+
+class VecTrackReward(VecEnvWrapper):
+    '''
+    Track the episodic returns and lengths of all the envs of a vector env, in place of a TrackReward in every env.
+    The running returns are preallocated arrays updated with the whole batch of rewards, and the episodes end only on real dones, i.e. game over instead of a lost life with EpisodicLifeEnv (info['was_real_done']).
+    total_reward holds the return of the last completed episode of each env (nan until it has one), and the returns and lengths of the last buffer_size completed episodes of all envs are kept in a ring, see get_epi_stats
+    '''
+
+    def __init__(self, venv, buffer_size=100):
+        VecEnvWrapper.__init__(self, venv)
+        self.spec = venv.spec
+        self.tracked_reward = np.zeros(self.num_envs)
+        self.tracked_len = np.zeros(self.num_envs, dtype=np.int64)
+        self.total_reward = np.full(self.num_envs, np.nan)
+        self.buffer_size = buffer_size
+        self.epi_returns = np.full(buffer_size, np.nan)
+        self.epi_lens = np.zeros(buffer_size, dtype=np.int64)
+        self.num_epis = 0  # total number of completed episodes
+
+    def track(self, rews, news, infos, env_ids):
+        '''Add the rewards of the envs env_ids into their running returns, and end the episodes of the real dones'''
+        self.tracked_reward[env_ids] += rews
+        self.tracked_len[env_ids] += 1
+        done_idxs = np.flatnonzero(news)
+        if not len(done_idxs):
+            return
+        # a done is real unless EpisodicLifeEnv says otherwise
+        done_ids = np.asarray(env_ids)[[i for i in done_idxs if infos[i].get('was_real_done', True)]]
+        if not len(done_ids):
+            return
+        self.total_reward[done_ids] = self.tracked_reward[done_ids]
+        buffer_idxs = (self.num_epis + np.arange(len(done_ids))) % self.buffer_size
+        self.epi_returns[buffer_idxs] = self.tracked_reward[done_ids]
+        self.epi_lens[buffer_idxs] = self.tracked_len[done_ids]
+        self.num_epis += len(done_ids)
+        self.tracked_reward[done_ids] = 0.0
+        self.tracked_len[done_ids] = 0
+
+    def get_epi_stats(self):
+        '''@returns (epi_returns, epi_lens) of the last completed episodes in order of completion, up to buffer_size of them'''
+        num_stats = min(self.num_epis, self.buffer_size)
+        idxs = (self.num_epis - num_stats + np.arange(num_stats)) % self.buffer_size
+        return self.epi_returns[idxs], self.epi_lens[idxs]
+
+    def step_wait(self):
+        obs, rews, news, infos = self.venv.step_wait()
+        self.track(rews, news, infos, np.arange(self.num_envs))
+        return obs, rews, news, infos
+
+    def step_recv(self):
+        obs, rews, news, infos, env_ids = self.venv.step_recv()
+        self.track(rews, news, infos, env_ids)
+        return obs, rews, news, infos, env_ids
+
+    def reset(self):
+        self.tracked_reward[:] = 0.0
+        self.tracked_len[:] = 0
+        return self.venv.reset()
+
+
+class VecScaleReward(VecEnvWrapper):
+    '''Rescale the rewards of a vector env, see ScaleRewardEnv. Applied after VecTrackReward so the tracked returns are unscaled'''
+
+    def __init__(self, venv, reward_scale):
+        VecEnvWrapper.__init__(self, venv)
+        self.spec = venv.spec
+        self.reward_scale = reward_scale
+        self.sign_reward = self.reward_scale == 'sign'
+
+    def step_wait(self):
+        obs, rews, news, infos = self.venv.step_wait()
+        return obs, try_scale_reward(self, rews), news, infos
+
+    def step_recv(self):
+        obs, rews, news, infos, env_ids = self.venv.step_recv()
+        return obs, try_scale_reward(self, rews), news, infos, env_ids
+
+    def reset(self):
+        return self.venv.reset()
+
+
+class VecNormalizeState(VecEnvWrapper):
+    '''
+    Normalize the observations of a vector env on-line with a per-feature running mean and variance shared by all its envs, and clip them to [-clip, clip].
+    The statistics are updated with each (num_envs, *obs_shape) batch of observations at once using the parallel variance algorithm (Chan et al. 1979), instead of a reduction per env.
+    When frozen, e.g. for eval, the statistics are used without updating them. They are saved and loaded with the agent ckpt, see OpenAIEnv.save
+    '''
+
+    def __init__(self, venv, clip=10.0, epsilon=1e-8):
+        shape = venv.observation_space.shape
+        self.clip = clip
+        self.epsilon = epsilon
+        self.is_frozen = False
+        # updated in place, so an eval env can share them, see share_stats
+        self.state_mean = np.zeros(shape)
+        self.state_var = np.ones(shape)
+        self.count = np.full((), epsilon)
+        self.spec = venv.spec
+        observation_space = spaces.Box(low=-clip, high=clip, shape=shape, dtype=np.float32)
+        VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
+
+    def update_stats(self, obs):
+        '''Merge the mean and variance of a batch of observations into the running statistics'''
+        batch_count = len(obs)
+        batch_mean = obs.mean(axis=0)
+        batch_var = obs.var(axis=0)
+        delta = batch_mean - self.state_mean
+        total_count = self.count + batch_count
+        m2 = self.state_var * self.count + batch_var * batch_count + np.square(delta) * self.count * batch_count / total_count
+        self.state_mean += delta * batch_count / total_count
+        self.state_var[...] = m2 / total_count
+        self.count[...] = total_count
+
+    def normalize(self, obs):
+        if not self.is_frozen:
+            self.update_stats(obs)
+        obs = (obs - self.state_mean) / np.sqrt(self.state_var + self.epsilon)
+        return np.clip(obs, -self.clip, self.clip).astype(np.float32)
+
+    def get_stats(self):
+        return {'state_mean': self.state_mean, 'state_var': self.state_var, 'count': self.count}
+
+    def load_stats(self, stats):
+        self.state_mean[...] = stats['state_mean']
+        self.state_var[...] = stats['state_var']
+        self.count[...] = stats['count']
+
+    def share_stats(self, normalizer):
+        '''Normalize with the statistics of another normalizer, e.g. for the eval env to use those of the train env'''
+        self.state_mean, self.state_var, self.count = normalizer.state_mean, normalizer.state_var, normalizer.count
+
+    def step_wait(self):
+        obs, rews, news, infos = self.venv.step_wait()
+        return self.normalize(obs), rews, news, infos
+
+    def step_recv(self):
+        obs, rews, news, infos, env_ids = self.venv.step_recv()
+        return self.normalize(obs), rews, news, infos, env_ids
+
+    def reset(self):
+        obs = self.venv.reset()
+        return self.normalize(obs)
 
 
 class VecFrameStack(VecEnvWrapper):
-    '''Frame stack wrapper for vector environment'''
+    '''
+    Frame stack wrapper for vector environment
+    The frames are kept in a ring buffer of shape (num_envs, frame_op_len, *frame_shape) with a write index per env, so a step only writes the new frames and zeroes the rings of the done envs, instead of shifting the whole stack.
+    The stacks are then gathered oldest first from the rings into a new array, which is returned without another copy.
+    '''
 
     def __init__(self, venv, frame_op, frame_op_len):
         self.venv = venv
@@ -457,48 +888,101 @@ class VecFrameStack(VecEnvWrapper):
         self.spec = venv.spec
         wos = venv.observation_space  # wrapped ob space
         if self.is_stack:
-            self.shape_dim0 = 1
             low = np.repeat(np.expand_dims(wos.low, axis=0), self.frame_op_len, axis=0)
             high = np.repeat(np.expand_dims(wos.high, axis=0), self.frame_op_len, axis=0)
         else:  # concat
-            self.shape_dim0 = wos.shape[0]
             low = np.repeat(wos.low, self.frame_op_len, axis=0)
             high = np.repeat(wos.high, self.frame_op_len, axis=0)
-        self.stackedobs = np.zeros((venv.num_envs,) + low.shape, low.dtype)
+        self.frames = np.zeros((venv.num_envs, self.frame_op_len) + wos.shape, low.dtype)
+        self.heads = np.full(venv.num_envs, -1)  # ring idx of the newest frame of each env
         observation_space = spaces.Box(low=low, high=high, dtype=venv.observation_space.dtype)
         VecEnvWrapper.__init__(self, venv, observation_space=observation_space)
 
+    def add_frames(self, obs, news, env_ids):
+        '''Write the new frames of env_ids into their rings, after zeroing the rings of the new episodes, and return their stacks'''
+        self.frames[env_ids[news]] = 0
+        self.heads[env_ids] = (self.heads[env_ids] + 1) % self.frame_op_len
+        self.frames[env_ids, self.heads[env_ids]] = obs
+        heads = self.heads[env_ids]
+        if len(env_ids) == self.num_envs and np.all(heads == heads[0]):  # the rings are aligned when stepping all envs in sync, so gather them with 2 slices
+            split = heads[0] + 1
+            stackedobs = np.concatenate([self.frames[:, split:], self.frames[:, :split]], axis=1)
+        else:
+            ring_idxs = (heads[:, None] + 1 + np.arange(self.frame_op_len)) % self.frame_op_len  # oldest first
+            stackedobs = self.frames[env_ids[:, None], ring_idxs]
+        return stackedobs.reshape((len(env_ids),) + self.observation_space.shape)
+
     def step_wait(self):
         obs, rews, news, infos = self.venv.step_wait()
-        self.stackedobs[:, :-self.shape_dim0] = self.stackedobs[:, self.shape_dim0:]
-        for (i, new) in enumerate(news):
-            if new:
-                self.stackedobs[i] = 0
-        if self.is_stack:
-            obs = np.expand_dims(obs, axis=1)
-        self.stackedobs[:, -self.shape_dim0:] = obs
-        return self.stackedobs.copy(), rews, news, infos
+        stackedobs = self.add_frames(obs, np.asarray(news, dtype=bool), np.arange(self.num_envs))
+        return stackedobs, rews, news, infos
+
+    def step_recv(self):
+        '''Async version of step_wait which only updates the stacks of the ready envs'''
+        obs, rews, news, infos, env_ids = self.venv.step_recv()
+        stackedobs = self.add_frames(obs, np.asarray(news, dtype=bool), np.asarray(env_ids))
+        return stackedobs, rews, news, infos, env_ids
 
     def reset(self):
         obs = self.venv.reset()
-        self.stackedobs[...] = 0
-        if self.is_stack:
-            obs = np.expand_dims(obs, axis=1)
-        self.stackedobs[:, -self.shape_dim0:] = obs
-        return self.stackedobs.copy()
+        self.frames[...] = 0
+        self.heads[...] = -1  # realign the rings after async stepping
+        return self.add_frames(obs, np.zeros(self.num_envs, dtype=bool), np.arange(self.num_envs))
 
 
-def make_gym_venv(name, num_envs=4, seed=0, frame_op=None, frame_op_len=None, image_downsize=None, reward_scale=None, normalize_state=False, episode_life=True):
-    '''General method to create any parallel vectorized Gym env; auto wraps Atari'''
+def make_gym_venv(name, num_envs=4, seed=0, frame_op=None, frame_op_len=None, image_downsize=None, reward_scale=None, normalize_state=False, episode_life=True, num_workers=None, async_batch_size=None, env_pool=None, numpy_vec=False):
+    '''
+    General method to create any parallel vectorized Gym env; auto wraps Atari
+    num_workers is the number of subprocesses to step the envs in, default one per env
+    async_batch_size enables asynchronous stepping with step_send/step_recv on at least async_batch_size envs at a time
+    normalize_state normalizes the states at vector level with statistics shared by the envs, see VecNormalizeState
+    The episodic returns are tracked at vector level by VecTrackReward
+    numpy_vec steps the classic control envs in NUMPY_VEC_ENVS natively as numpy arrays in this process instead of in gym env workers, see vec_classic_control; their trajectories match gym up to float rounding
+    env_pool is an EnvPool to lease the env workers from instead of spawning new ones
+    '''
+    from slm_lab.env.vec_classic_control import NUMPY_VEC_ENVS
+    if numpy_vec:
+        if name not in NUMPY_VEC_ENVS:
+            raise ValueError(f'No numpy vector env for {name}. Choose from {list(NUMPY_VEC_ENVS)}, or set numpy_vec to false.')
+        venv = NUMPY_VEC_ENVS[name](name, num_envs, seed)
+        return wrap_venv(venv, reward_scale, normalize_state, frame_op, frame_op_len)
     venv = [
-        # don't concat frame or clip reward on individual env; do that at vector level
-        partial(make_gym_env, name, seed + i, frame_op=None, frame_op_len=None, image_downsize=image_downsize, reward_scale=reward_scale, normalize_state=normalize_state, episode_life=episode_life)
+        # don't concat frame, normalize state, track or clip reward on individual env; do that at vector level
+        partial(make_gym_env, name, seed + i, frame_op=None, frame_op_len=None, image_downsize=image_downsize, normalize_state=False, episode_life=episode_life, track_reward=False)
         for i in range(num_envs)
     ]
     if len(venv) > 1:
-        venv = ShmemVecEnv(venv, context='fork')
+        # VecFrameStack copies the observations into its stack right away, so it can read the shared memory directly
+        copy_obs = frame_op is None
+        if env_pool is not None:
+            # the config of the envs in the workers; the rest is applied in this process, and EpisodicLifeEnv is switched per lease
+            key = (name, image_downsize)
+            venv = [partial(make_gym_env, name, seed + i, image_downsize=image_downsize, normalize_state=False, track_reward=False) for i in range(num_envs)]
+            venv = env_pool.lease(key, venv, [seed + i for i in range(num_envs)], copy_obs=copy_obs, num_workers=num_workers, async_batch_size=async_batch_size, episode_life=episode_life)
+        else:
+            venv = ShmemVecEnv(venv, context='fork', copy_obs=copy_obs, num_workers=num_workers, async_batch_size=async_batch_size)
     else:
+        assert async_batch_size is None, 'Async stepping requires more than 1 env'
         venv = DummyVecEnv(venv)
+    return wrap_venv(venv, reward_scale, normalize_state, frame_op, frame_op_len)
+
+
+def wrap_venv(venv, reward_scale=None, normalize_state=False, frame_op=None, frame_op_len=None):
+    '''Apply the vector level wrappers of make_gym_venv'''
+    venv = VecTrackReward(venv)
+    if reward_scale is not None:
+        venv = VecScaleReward(venv, reward_scale)
+    if normalize_state:
+        venv = VecNormalizeState(venv)
     if frame_op is not None:
         venv = VecFrameStack(venv, frame_op, frame_op_len)
     return venv
+
+
+def get_vec_wrapper(venv, WrapperClass):
+    '''Find the wrapper of class WrapperClass in a stack of vec env wrappers, or None'''
+    while isinstance(venv, VecEnvWrapper):
+        if isinstance(venv, WrapperClass):
+            return venv
+        venv = venv.venv
+    return None
@@ -87,10 +87,12 @@ class EpisodicLifeEnv(gym.Wrapper):
         '''
         Make end-of-life == end-of-episode, but only reset on true game over.
         Done by DeepMind for the DQN and co. since it helps value estimation.
+        Set episode_life to False to pass the dones through, e.g. for the workers of an EnvPool leased for eval.
         '''
         gym.Wrapper.__init__(self, env)
         self.lives = 0
         self.was_real_done = True
+        self.episode_life = True
 
     def step(self, action):
         obs, reward, done, info = self.env.step(action)
@@ -98,7 +100,7 @@ class EpisodicLifeEnv(gym.Wrapper):
         # check current lives, make loss of life terminal,
         # then update lives to handle bonus lives
         lives = self.env.unwrapped.ale.lives()
-        if lives < self.lives and lives > 0:
+        if self.episode_life and lives < self.lives and lives > 0:
             # for Qbert sometimes we stay in lives == 0 condtion for a few frames
             # so its important to keep lives > 0, so that we only reset once
             # the environment advertises done.
@@ -196,7 +198,7 @@ class LazyFrames(object):
         return self._force()[i]
 
     def astype(self, dtype):
-        '''To prevent state.astype(np.float16) breaking on LazyFrames'''
+        '''To prevent state.astype(dtype) in the memories breaking on LazyFrames'''
         return self
 
 
@@ -226,14 +228,18 @@ class FrameStack(gym.Wrapper):
     def reset(self):
         ob = self.env.reset()
         for _ in range(self.frame_op_len):
-            self.frames.append(ob.astype(np.float16))
+            self.frames.append(self._cast(ob))
         return self._get_ob()
 
     def step(self, action):
         ob, reward, done, info = self.env.step(action)
-        self.frames.append(ob.astype(np.float16))
+        self.frames.append(self._cast(ob))
         return self._get_ob(), reward, done, info
 
+    def _cast(self, ob):
+        '''Keep uint8 image frames as is for the nets to convert, and store other frames as float16'''
+        return ob if ob.dtype == np.uint8 else ob.astype(np.float16)
+
     def _get_ob(self):
         assert len(self.frames) == self.frame_op_len
         return LazyFrames(list(self.frames), self.frame_op)
@@ -379,8 +385,8 @@ def wrap_deepmind(env, episode_life=True, stack_len=None, image_downsize=None):
     return env
 
 
-def make_gym_env(name, seed=None, frame_op=None, frame_op_len=None, image_downsize=None, reward_scale=None, normalize_state=False, episode_life=True):
-    '''General method to create any Gym env; auto wraps Atari'''
+def make_gym_env(name, seed=None, frame_op=None, frame_op_len=None, image_downsize=None, reward_scale=None, normalize_state=False, episode_life=True, track_reward=True):
+    '''General method to create any Gym env; auto wraps Atari. track_reward=False leaves the reward tracking to a vector env, see VecTrackReward'''
     env = gym.make(name)
     if seed is not None:
         env.seed(seed)
@@ -400,7 +406,8 @@ def make_gym_env(name, seed=None, frame_op=None, frame_op_len=None, image_downsi
         if frame_op is not None:
             Stacker = UnityVecFrameStack if name.startswith('Unity') else FrameStack
             env = Stacker(env, frame_op, frame_op_len)
-    env = TrackReward(env)  # auto-track total reward
+    if track_reward:
+        env = TrackReward(env)  # auto-track total reward
     if reward_scale is not None:
         env = ScaleRewardEnv(env, reward_scale)
     return env
@@ -0,0 +1,72 @@
+# The Ape-X learner module
+# Trains a single learner on the shared replay filled by the acting sessions of a trial
+from slm_lab.agent.net import net_util
+from slm_lab.lib import logger
+import numpy as np
+import threading
+import time
+
+logger = logger.get_logger(__name__)
+
+
+class ApexLearner:
+    '''
+    Learner of the Ape-X distributed mode (Horgan et al. 2018 https://arxiv.org/abs/1803.00933) for the off-policy algorithms (DQN, SAC).
+    The sessions of the trial are actors: they act with the published copies of the learner's nets and add their experiences into its SharedReplay or SharedPrioritizedReplay, without training.
+    The learner runs in a thread of the trial process with the agent of the trial's isolated Session. It trains from the shared memory as fast as it can once training_start_step experiences are seen, and publishes its weights into the global nets every publish_frequency training steps.
+    The learner clock ticks training_frequency frames per training step, so the frame-based schedules of the algorithm, e.g. the target net update_frequency and lr decay, have the same meaning as in a single session.
+
+    e.g. meta spec
+    "meta": {
+      "distributed": "apex",
+      "publish_frequency": 1,
+      ...
+    }
+    '''
+
+    def __init__(self, agent, global_nets, publish_frequency=1):
+        self.agent = agent
+        self.algorithm = agent.algorithm
+        self.global_nets = global_nets
+        self.publish_frequency = publish_frequency
+        self.is_running = False
+        self.thread = None
+        self.num_train_steps = 0
+
+    def publish(self):
+        '''Copy the learner's weights into the global nets which the actors act with'''
+        for net_name, g_net in self.global_nets.items():
+            net_util.copy(getattr(self.algorithm, net_name), g_net)
+
+    def learn(self):
+        '''Train from the shared memory until stopped'''
+        algorithm, memory = self.algorithm, self.agent.body.memory
+        clock = self.agent.body.env.clock
+        num_ticks = max(algorithm.training_frequency // clock.clock_speed, 1)
+        while self.is_running:
+            if memory.seen_size <= algorithm.training_start_step or memory.size < memory.batch_size:
+                time.sleep(0.01)  # wait for the actors to fill the memory
+                continue
+            for _ in range(num_ticks):
+                clock.tick('t')
+            algorithm.to_train = 1
+            loss = algorithm.train()
+            if not np.isnan(loss):
+                self.agent.body.loss = loss
+            algorithm.update()
+            self.num_train_steps += 1
+            if self.num_train_steps % self.publish_frequency == 0:
+                self.publish()
+
+    def start(self):
+        '''Start learning in a thread; call after the session processes are started'''
+        self.is_running = True
+        self.thread = threading.Thread(target=self.learn, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''Stop learning after the current training step, then save the learner's agent'''
+        self.is_running = False
+        self.thread.join()
+        self.agent.save()
+        logger.info(f'Ape-X learner trained {self.num_train_steps} steps ({self.agent.body.env.clock.opt_step} opt steps) on {self.agent.body.memory.seen_size} experiences, loss: {self.agent.body.loss:g}')
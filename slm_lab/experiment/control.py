@@ -3,8 +3,11 @@
 from copy import deepcopy
 from slm_lab.agent import Agent, Body
 from slm_lab.agent.net import net_util
+from slm_lab.agent.net.inference_server import InferenceServer
 from slm_lab.env import make_env
+from slm_lab.env.vec_env import get_env_pool
 from slm_lab.experiment import analysis, search
+from slm_lab.experiment.apex import ApexLearner
 from slm_lab.lib import logger, util
 from slm_lab.spec import spec_util
 import pydash as ps
@@ -12,19 +15,21 @@ import torch
 import torch.multiprocessing as mp
 
 
-def make_agent_env(spec, global_nets=None):
+def make_agent_env(spec, global_nets=None, env_pool=None):
     '''Helper to create agent and env given spec'''
-    env = make_env(spec)
+    env = make_env(spec, env_pool)
     body = Body(env, spec)
     agent = Agent(spec, body=body, global_nets=global_nets)
     return agent, env
 
 
-def mp_run_session(spec, global_nets, mp_dict):
+def mp_run_session(spec, global_nets, mp_dict, env_pool=None):
     '''Wrap for multiprocessing with shared variable'''
-    session = Session(spec, global_nets)
+    session = Session(spec, global_nets, env_pool)
     metrics = session.run()
     mp_dict[session.index] = metrics
+    if env_pool is not None:  # close the env workers leased in this process
+        env_pool.close()
 
 
 class Session:
@@ -34,7 +39,7 @@ class Session:
     then gather data and analyze it to produce session data.
     '''
 
-    def __init__(self, spec, global_nets=None):
+    def __init__(self, spec, global_nets=None, env_pool=None):
         self.spec = spec
         self.index = self.spec['meta']['session']
         util.set_random_seed(self.spec)
@@ -42,10 +47,11 @@ class Session:
         util.set_logger(self.spec, logger, 'session')
         spec_util.save(spec, unit='session')
 
-        self.agent, self.env = make_agent_env(self.spec, global_nets)
+        self.agent, self.env = make_agent_env(self.spec, global_nets, env_pool)
         if ps.get(self.spec, 'meta.rigorous_eval'):
             with util.ctx_lab_mode('eval'):
-                self.eval_env = make_env(self.spec)
+                self.eval_env = make_env(self.spec, env_pool)
+            self.eval_env.share_state_stats(self.env)
         else:
             self.eval_env = self.env
         logger.info(util.self_desc(self))
@@ -86,6 +92,8 @@ class Session:
     def run_rl(self):
         '''Run the main RL loop until clock.max_frame'''
         logger.info(f'Running RL loop for trial {self.spec["meta"]["trial"]} session {self.index}')
+        if self.env.is_async:
+            return self.run_rl_async()
         clock = self.env.clock
         state = self.env.reset()
         done = False
@@ -106,6 +114,29 @@ class Session:
             self.agent.update(state, action, reward, next_state, done)
             state = next_state
 
+    def run_rl_async(self):
+        '''
+        Run the RL loop with async vector env stepping until clock.max_frame.
+        The agent acts on whichever envs are ready first, while the env emits rounds of transitions across all envs, which tick the clock and update the agent just like a synchronous step.
+        On-policy algorithms must train on actions from their latest policy, so their envs are not let ahead of the slowest by more than a round.
+        '''
+        if util.get_class_name(self.agent.body.memory).startswith('OnPolicy') and self.env.async_max_lag > 1:
+            logger.warning(f'Capping the async env lag from {self.env.async_max_lag} to 1 for on-policy memory {util.get_class_name(self.agent.body.memory)}')
+            self.env.async_max_lag = 1
+        clock = self.env.clock
+        state, env_ids = self.env.reset_async()
+        while True:
+            with torch.no_grad():
+                action = self.agent.act(state)
+            self.env.step_send(action, env_ids)
+            state, env_ids, rounds = self.env.step_recv()
+            for (round_state, round_action, reward, next_state, done) in rounds:
+                self.try_ckpt(self.agent, self.env)
+                if clock.get() >= clock.max_frame:  # finish
+                    return
+                clock.tick('t')
+                self.agent.update(round_state, round_action, reward, next_state, done)
+
     def close(self):
         '''Close session and clean up. Save agent, close env.'''
         self.agent.close()
@@ -132,6 +163,9 @@ class Trial:
     def __init__(self, spec):
         self.spec = spec
         self.index = self.spec['meta']['trial']
+        self.inference_server = None  # set in init_global_nets if spec.meta.inference_server
+        self.apex_learner = None  # set in init_global_nets if spec.meta.distributed is 'apex'
+        self.env_pool = get_env_pool()  # warm env workers leased by the sessions, kept for the next trials in this process
         util.set_logger(self.spec, logger, 'trial')
         spec_util.save(spec, unit='trial')
 
@@ -141,11 +175,25 @@ class Trial:
         spec = deepcopy(self.spec)
         for _s in range(spec['meta']['max_session']):
             spec_util.tick(spec, 'session')
-            w = mp.Process(target=mp_run_session, args=(spec, global_nets, mp_dict))
+            session_global_nets = global_nets
+            if self.inference_server is not None:  # set as algorithm.inference_client along with the global nets
+                session_global_nets = {**global_nets, 'inference_client': self.inference_server.get_client(_s)}
+            w = mp.Process(target=mp_run_session, args=(spec, session_global_nets, mp_dict, self.env_pool))
             w.start()
             workers.append(w)
+            self.env_pool.lend_idle()  # any warm env workers are taken by the first session
+        if self.inference_server is not None:
+            self.inference_server.start()
+        if self.apex_learner is not None:
+            self.apex_learner.start()
         for w in workers:
             w.join()
+        if all(w.exitcode == 0 for w in workers):  # the sessions released the env workers they took
+            self.env_pool.reclaim_lent()
+        if self.inference_server is not None:
+            self.inference_server.stop()
+        if self.apex_learner is not None:
+            self.apex_learner.stop()
         session_metrics_list = [mp_dict[idx] for idx in sorted(mp_dict.keys())]
         return session_metrics_list
 
@@ -154,15 +202,21 @@ class Trial:
         if self.spec['meta']['max_session'] == 1:
             spec = deepcopy(self.spec)
             spec_util.tick(spec, 'session')
-            session_metrics_list = [Session(spec).run()]
+            session_metrics_list = [Session(spec, env_pool=self.env_pool).run()]
         else:
             session_metrics_list = self.parallelize_sessions()
         return session_metrics_list
 
     def init_global_nets(self):
-        session = Session(deepcopy(self.spec))
+        session = Session(deepcopy(self.spec), env_pool=self.env_pool)
         session.env.close()  # safety
+        session.eval_env.close()
         global_nets = net_util.init_global_nets(session.agent.algorithm)
+        if self.spec['meta'].get('inference_server'):
+            self.inference_server = InferenceServer(session.agent.algorithm, self.spec['meta']['max_session'])
+        if self.spec['meta']['distributed'] == 'apex':  # the sessions act into the shared memory of the learner
+            self.apex_learner = ApexLearner(session.agent, global_nets, self.spec['meta'].get('publish_frequency', 1))
+            global_nets = {**global_nets, 'global_memory': session.agent.body.memory}
         return global_nets
 
     def run_distributed_sessions(self):
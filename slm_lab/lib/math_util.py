@@ -1,4 +1,5 @@
 # Various math calculations used by algorithms
+from typing import List
 import numpy as np
 import torch
 
@@ -59,16 +60,29 @@ def venv_unpack(batch_tensor):
 # Policy Gradient calc
 # advantage functions
 
+@torch.jit.script
+def discounted_cumsum(xs: torch.Tensor, discounts: torch.Tensor, future: torch.Tensor) -> torch.Tensor:
+    '''
+    Reverse discounted cumulative sum ys[t] = xs[t] + discounts[t] * ys[t+1], with ys[T] = future
+    Episode boundaries are reset by zeros in discounts, i.e. discounts = gamma * (1 - dones)
+    This runs the same recurrence as a python loop, hence is bit-compatible with it, but as a TorchScript kernel to avoid the per-step python overhead
+    '''
+    x_list = xs.unbind(0)
+    discount_list = discounts.unbind(0)
+    ys = torch.jit.annotate(List[torch.Tensor], [])
+    for t in range(len(x_list) - 1, -1, -1):
+        future = x_list[t] + discount_list[t] * future
+        ys.append(future)
+    return torch.stack(ys).flip([0]).view_as(xs)
+
+
 def calc_returns(rewards, dones, gamma):
     '''
     Calculate the simple returns (full rollout) i.e. sum discounted rewards up till termination
     '''
-    T = len(rewards)
-    rets = torch.zeros_like(rewards)
-    future_ret = torch.tensor(0.0, dtype=rewards.dtype)
+    future_ret = torch.tensor(0.0, dtype=rewards.dtype, device=rewards.device)
     not_dones = 1 - dones
-    for t in reversed(range(T)):
-        rets[t] = future_ret = rewards[t] + gamma * future_ret * not_dones[t]
+    rets = discounted_cumsum(rewards, gamma * not_dones, future_ret)
     return rets
 
 
@@ -79,10 +93,8 @@ def calc_nstep_returns(rewards, dones, next_v_pred, gamma, n):
     R^(n)_t = r_{t} + gamma r_{t+1} + ... + gamma^(n-1) r_{t+n-1} + gamma^(n) V(s_{t+n})
     '''
     rets = torch.zeros_like(rewards)
-    future_ret = next_v_pred
     not_dones = 1 - dones
-    for t in reversed(range(n)):
-        rets[t] = future_ret = rewards[t] + gamma * future_ret * not_dones[t]
+    rets[:n] = discounted_cumsum(rewards[:n], gamma * not_dones[:n], next_v_pred)
     return rets
 
 
@@ -97,13 +109,11 @@ def calc_gaes(rewards, dones, v_preds, gamma, lam):
     '''
     T = len(rewards)
     assert T + 1 == len(v_preds), f'T+1: {T+1} v.s. v_preds.shape: {v_preds.shape}'  # v_preds runs into t+1
-    gaes = torch.zeros_like(rewards)
-    future_gae = torch.tensor(0.0, dtype=rewards.dtype)
+    future_gae = torch.tensor(0.0, dtype=rewards.dtype, device=rewards.device)
     not_dones = 1 - dones  # to reset at episode boundary by multiplying 0
     deltas = rewards + gamma * v_preds[1:] * not_dones - v_preds[:-1]
     coef = gamma * lam
-    for t in reversed(range(T)):
-        gaes[t] = future_gae = deltas[t] + coef * not_dones[t] * future_gae
+    gaes = discounted_cumsum(deltas, coef * not_dones, future_gae)
     return gaes
 
 
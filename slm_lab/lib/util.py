@@ -46,6 +46,15 @@ def batch_get(arr, idxs):
         return arr[idxs]
 
 
+def batch_set(arr, idxs, vals):
+    '''Set multi-idxs of an array depending if it's a python list or np.array'''
+    if isinstance(arr, (list, deque)):
+        for idx, val in zip(idxs, vals):
+            arr[idx] = val
+    else:
+        arr[idxs] = vals
+
+
 def calc_srs_mean_std(sr_list):
     '''Given a list of series, calculate their mean and std'''
     cat_df = pd.DataFrame(dict(enumerate(sr_list)))
@@ -549,7 +558,9 @@ def to_torch_batch(batch, device, is_episodic):
             batch[k] = np.concatenate(batch[k])
         elif ps.is_list(batch[k]):
             batch[k] = np.array(batch[k])
-        batch[k] = torch.from_numpy(batch[k].astype(np.float32)).to(device)
+        if batch[k].dtype != np.uint8:  # uint8 image states are converted to float by the net on its device
+            batch[k] = batch[k].astype(np.float32, copy=False)  # no copy if already float32, e.g. the on-policy buffers
+        batch[k] = torch.from_numpy(batch[k]).to(device)
     return batch
 
 
@@ -76,6 +76,12 @@ def check_compatibility(spec):
     # TODO expand to be more comprehensive
     if spec['meta'].get('distributed') == 'synced':
         assert ps.get(spec, 'agent.0.net.gpu') == False, f'Distributed mode "synced" works with CPU only. Set gpu: false.'
+    if spec['meta'].get('distributed') == 'apex':
+        assert ps.get(spec, 'agent.0.memory.name').startswith('Shared'), f'Distributed mode "apex" works with a shared memory only. Use SharedReplay or SharedPrioritizedReplay.'
+        assert ps.get(spec, 'agent.0.net.gpu') == False, f'Distributed mode "apex" works with CPU only. Set gpu: false.'
+    if spec['meta'].get('inference_server'):
+        assert spec['meta'].get('distributed') in ('shared', 'synced'), f'Inference server works with distributed mode "shared" or "synced" only.'
+        assert ps.get(spec, 'agent.0.net.gpu') == False, f'Inference server works with CPU only. Set gpu: false.'
 
 
 def check(spec):
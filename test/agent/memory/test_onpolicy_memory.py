@@ -1,7 +1,9 @@
 from collections import Counter
 from flaky import flaky
+from slm_lab.lib import util
 import numpy as np
 import pytest
+import torch
 
 
 def memory_init_util(memory):
@@ -71,6 +73,22 @@ class TestOnPolicyBatchMemory:
         assert len(batch['dones']) == size
         assert len(memory.states) == 0
 
+    def test_sample_buffers(self, test_on_policy_batch_memory):
+        '''Tests that the batch is written into the preallocated buffers and converted to torch tensors without copying'''
+        memory = test_on_policy_batch_memory[0]
+        memory.reset()
+        experiences = test_on_policy_batch_memory[2]
+        for e in experiences:
+            memory.add_experience(*e)
+        assert memory.buffers['states'].dtype == np.float32
+        assert len(memory.buffers['states']) >= len(experiences)
+        batch = memory.sample()
+        batch = util.to_torch_batch(batch, torch.device('cpu'), memory.is_episodic)
+        for k, v in batch.items():
+            assert np.shares_memory(v.numpy(), memory.buffers[k])
+        assert np.array_equal(batch['states'].numpy(), [e[0] for e in experiences])
+        assert np.array_equal(batch['dones'].numpy(), [e[4] for e in experiences])
+
     def test_batch_size(self, test_on_policy_batch_memory):
         '''Tests that memory sets agent training flag correctly'''
         memory = test_on_policy_batch_memory[0]
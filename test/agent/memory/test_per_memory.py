@@ -1,7 +1,10 @@
 from collections import Counter
 from flaky import flaky
+from slm_lab.agent.memory.prioritized import PrioritizedReplay, SumTree
 import numpy as np
+import os
 import pytest
+import time
 
 
 @flaky
@@ -147,3 +150,103 @@ class TestPERMemory:
         assert memory.priorities[1] == 0
         assert memory.priorities[2] == 30
         assert memory.priorities[3] == 0
+
+
+@pytest.mark.parametrize('num_exps', [3, 12])
+def test_add_batch(test_prioritized_replay_memory, num_exps):
+    '''Tests that add_batch results in the same priorities and SumTree as add_experience in a loop'''
+    memory = test_prioritized_replay_memory[0]
+    rng = np.random.RandomState(0)
+    states = rng.rand(num_exps, memory.body.state_dim)
+    errors = rng.rand(num_exps) * 10
+    trees = []
+    for add_mode in ['loop', 'batch']:
+        memory.reset()
+        memory.add_experience(states[0], 0, 0, states[0], 0)
+        if add_mode == 'loop':
+            for state, error in zip(states, errors):
+                memory.add_experience(state, 1, 1, state, 0, error)
+        else:
+            memory.add_batch(states, np.ones(num_exps), np.ones(num_exps), states, np.zeros(num_exps), errors)
+        trees.append((np.array(memory.priorities[:memory.size]), memory.tree.tree.copy(), memory.tree.indices.copy(), memory.tree.write))
+    loop_tree, batch_tree = trees
+    assert np.allclose(loop_tree[0], batch_tree[0])
+    assert np.allclose(loop_tree[1], batch_tree[1])
+    assert np.array_equal(loop_tree[2], batch_tree[2])
+    assert loop_tree[3] == batch_tree[3]
+
+
+def test_save_load(test_prioritized_replay_memory):
+    '''Tests that the saved memory is restored with the SumTree and the priorities updated after their experiences were saved'''
+    memory = test_prioritized_replay_memory[0]
+    memory.reset()
+    for e in test_prioritized_replay_memory[2]:
+        memory.add_experience(*e)
+    memory.save()
+    memory.sample()
+    memory.update_priorities(np.arange(memory.batch_size, dtype=np.float32))
+    memory.save()
+    new_memory = PrioritizedReplay(memory.memory_spec, memory.body)
+    new_memory.batch_size = memory.batch_size
+    new_memory.load()
+    assert np.array_equal(new_memory.priorities, memory.priorities)
+    assert np.array_equal(new_memory.tree.tree, memory.tree.tree)
+    assert np.array_equal(new_memory.tree.indices, memory.tree.indices)
+    assert new_memory.tree.write == memory.tree.write
+    np.random.seed(0)
+    batch = memory.sample()
+    np.random.seed(0)
+    new_batch = new_memory.sample()
+    assert np.array_equal(memory.batch_idxs, new_memory.batch_idxs)
+    for k, v in batch.items():
+        assert np.array_equal(v, new_batch[k])
+
+
+@pytest.mark.parametrize('capacity', [4, 13, 10000])
+def test_sum_tree_batch(capacity):
+    '''Tests that the batched SumTree get and update match the scalar ones'''
+    np.random.seed(0)
+    tree, batch_tree = SumTree(capacity), SumTree(capacity)
+    for i, p in enumerate(np.random.rand(capacity + capacity // 2)):  # wrap around
+        tree.add(p, i % capacity)
+        batch_tree.add(p, i % capacity)
+    batch_size = 256
+    s = np.random.uniform(0, tree.total(), size=batch_size)
+    res = [tree.get(x) for x in s]
+    batch_res = batch_tree.get_batch(s)
+    for r, batch_r in zip(zip(*res), batch_res):
+        assert np.array_equal(r, batch_r)
+
+    tree_idxs = batch_res[0]
+    ps = np.random.rand(batch_size)
+    for i, p in zip(tree_idxs, ps):
+        tree.update(i, p)
+    batch_tree.update_batch(tree_idxs, ps)
+    assert np.allclose(tree.tree, batch_tree.tree)
+
+
+@pytest.mark.skipif(not os.environ.get('BENCHMARK'), reason='benchmark, run with BENCHMARK=1 pytest -s')
+@pytest.mark.parametrize('capacity', [10000, 100000])
+def test_sum_tree_benchmark(capacity):
+    '''Compare the speed of the batched SumTree get and update against the scalar ones'''
+    np.random.seed(0)
+    tree = SumTree(capacity)
+    for i, p in enumerate(np.random.rand(capacity)):
+        tree.add(p, i)
+    batch_size = 256
+    s = np.random.uniform(0, tree.total(), size=batch_size)
+    start = time.time()
+    [tree.get(x) for x in s]
+    get_time = time.time() - start
+    start = time.time()
+    tree_idxs = tree.get_batch(s)[0]
+    get_batch_time = time.time() - start
+    ps = np.random.rand(batch_size)
+    start = time.time()
+    for i, p in zip(tree_idxs, ps):
+        tree.update(i, p)
+    update_time = time.time() - start
+    start = time.time()
+    tree.update_batch(tree_idxs, ps)
+    update_batch_time = time.time() - start
+    print(f'capacity: {capacity}, batch_size: {batch_size}, get speedup: {get_time / get_batch_time:.1f}x, update speedup: {update_time / update_batch_time:.1f}x')
@@ -0,0 +1,61 @@
+from slm_lab.agent.memory.prefetcher import BatchPrefetcher
+from slm_lab.lib import util
+import numpy as np
+import torch
+
+
+def test_prefetcher(test_memory):
+    '''Tests that the prefetched batches are the same as the synchronously sampled ones'''
+    memory = test_memory[0]
+    memory.reset()
+    memory.batch_size = test_memory[1]
+    for e in test_memory[2]:
+        memory.add_experience(*e)
+    num_batches = 4
+    np.random.seed(0)
+    expected_batches = [util.to_torch_batch(memory.sample(), 'cpu', memory.is_episodic) for _ in range(num_batches)]
+    prefetcher = BatchPrefetcher(memory, 'cpu', prefetch_size=2)
+    np.random.seed(0)
+    prefetcher.prefetch(num_batches)
+    for expected_batch in expected_batches:
+        batch = prefetcher.sample()
+        for k, v in expected_batch.items():
+            assert batch[k].dtype == torch.float32
+            assert torch.equal(v, batch[k])
+    prefetcher.close()
+    assert not prefetcher.thread.is_alive()
+
+
+def test_prefetcher_close(test_memory):
+    '''Tests that close() stops a worker blocked on a full batch queue'''
+    memory = test_memory[0]
+    memory.reset()
+    memory.batch_size = test_memory[1]
+    for e in test_memory[2]:
+        memory.add_experience(*e)
+    prefetcher = BatchPrefetcher(memory, 'cpu', prefetch_size=1)
+    prefetcher.prefetch(4)
+    while not prefetcher.batch_queue.full():
+        pass
+    prefetcher.close()
+    assert not prefetcher.thread.is_alive()
+
+
+def test_prefetcher_per(test_prioritized_replay_memory):
+    '''Tests that update_priorities applies to the batch returned by the prefetcher, not the one sampled ahead'''
+    memory = test_prioritized_replay_memory[0]
+    memory.reset()
+    memory.batch_size = test_prioritized_replay_memory[1]
+    for e in test_prioritized_replay_memory[2]:
+        memory.add_experience(*e)
+    prefetcher = BatchPrefetcher(memory, 'cpu', prefetch_size=2)
+    prefetcher.prefetch(2)
+    prefetcher.sample()
+    batch_idxs = prefetcher.batch_idxs['batch_idxs'].copy()
+    while prefetcher.batch_queue.qsize() < 1:  # wait for the next batch to be sampled ahead
+        pass
+    errors = np.full(memory.batch_size, 7.0)
+    prefetcher.update_priorities(errors)
+    assert np.array_equal(memory.batch_idxs, batch_idxs)
+    assert np.allclose(np.array(memory.priorities)[batch_idxs], memory.get_priority(errors))
+    prefetcher.sample()
@@ -1,9 +1,16 @@
 from collections import deque
 from copy import deepcopy
 from flaky import flaky
-from slm_lab.agent.memory.replay import sample_next_states
+from gym import spaces
+from slm_lab.agent.memory.replay import FrameReplay, NStepReplay, Replay, sample_next_states
+from slm_lab.experiment.control import make_agent_env
+from slm_lab.lib import util
+from slm_lab.spec import spec_util
+from types import SimpleNamespace
 import numpy as np
+import os
 import pytest
+import time
 
 
 def test_sample_next_states():
@@ -24,8 +31,8 @@ class TestMemory:
     '''
     Base class for unit testing replay memory
     Note: each test examples from test_memory consists of
-          a tuple containing three elements:
-          (memory, batch_size, experiences)
+          a tuple containing four elements:
+          (memory, batch_size, experiences, storage)
     '''
 
     def test_memory_init(self, test_memory):
@@ -120,14 +127,293 @@ class TestMemory:
         memory.reset()
         assert memory.head == -1
         assert memory.size == 0
-        assert memory.states[0] is None
-        assert memory.actions[0] is None
-        assert memory.rewards[0] is None
-        assert memory.dones[0] is None
+        if memory.storage == 'list':
+            assert memory.states[0] is None
+            assert memory.actions[0] is None
+            assert memory.rewards[0] is None
+            assert memory.dones[0] is None
+        else:
+            assert not memory.states[0].any()
+            assert memory.actions[0] == 0
+            assert memory.rewards[0] == 0
+            assert memory.dones[0] == 0
         assert len(memory.ns_buffer) == 0
 
+    def test_storage(self, test_memory):
+        '''Tests that the storage is preallocated with the shape and dtype inferred from the spaces'''
+        memory = test_memory[0]
+        memory.reset()
+        if memory.storage == 'list':
+            assert isinstance(memory.states, list)
+        else:
+            assert isinstance(memory.states, np.ndarray)
+            assert memory.states.shape == (memory.max_size, memory.body.state_dim)
+            assert memory.states.dtype == np.float16
+            assert memory.actions.shape == (memory.max_size,)
+            assert memory.rewards.dtype == np.float32
+        if memory.storage == 'memmap':  # only the memmap_keys are on disk
+            assert isinstance(memory.states, np.memmap)
+            assert memory.states.filename.endswith(f'_memory{memory.memory_idx}_states.npy')
+            assert not isinstance(memory.actions, np.memmap)
+
     @pytest.mark.skip(reason="Not implemented yet")
     def test_sample_dist(self, test_memory):
         '''Samples 100 times from memory. Accumulates the indices sampled and checks for significant deviation from a uniform distribution'''
         # TODO test_sample_dist
         assert None is None
+
+
+STORAGE_SPECS = {
+    'list': {'storage': 'list'},
+    'array': {'storage': 'array'},
+    'compress': {'storage': 'array', 'compress': True, 'compress_codec': 'zlib'},
+}
+
+
+def make_storage_memory(body, storage_spec):
+    '''Make a Replay with storage_spec filled with Atari-sized states'''
+    memory = Replay({'name': 'Replay', 'batch_size': 32, 'max_size': 1000, 'use_cer': False, **storage_spec}, body)
+    rng = np.random.RandomState(0)
+    for i in range(memory.max_size):
+        state = np.full(body.observation_space.shape, i % 256, dtype=np.uint8)
+        state[:, rng.randint(84, size=10), rng.randint(84, size=10)] = 0  # some detail to compress
+        memory.add_experience(state, 1, i, state, 0)
+    return memory
+
+
+def test_storage_backends(test_memory):
+    '''Tests that the list, array and compressed storage sample the same batches of Atari-sized states, and compare their bytes per transition'''
+    body = test_memory[0].body
+    observation_space = body.observation_space
+    body.observation_space = spaces.Box(low=0, high=255, shape=(4, 84, 84), dtype=np.uint8)
+    batches, nbytes = {}, {}
+    for name, storage_spec in STORAGE_SPECS.items():
+        memory = make_storage_memory(body, storage_spec)
+        np.random.seed(0)
+        batches[name] = memory.sample()
+        nbytes[name] = memory.get_nbytes_per_transition()
+        memory.close()
+    assert memory.states.pool is None  # the decompression threads of the compressed storage are shut down
+    body.observation_space = observation_space
+    for name in ['array', 'compress']:
+        for k, v in batches['list'].items():
+            assert np.array_equal(v, batches[name][k])
+    for k, v in batches['array'].items():
+        assert v.dtype == batches['compress'][k].dtype
+    assert batches['array']['states'].dtype == np.uint8  # image states stay uint8 until the net
+    assert nbytes['compress'] < nbytes['array'] / 10
+
+
+@pytest.mark.skipif(not os.environ.get('BENCHMARK'), reason='benchmark, run with BENCHMARK=1 pytest -s')
+def test_storage_benchmark(test_memory):
+    '''Compare the bytes per transition and samples per second of the list, array and compressed storage on Atari-sized states'''
+    body = test_memory[0].body
+    observation_space = body.observation_space
+    body.observation_space = spaces.Box(low=0, high=255, shape=(4, 84, 84), dtype=np.uint8)
+    for name, storage_spec in STORAGE_SPECS.items():
+        memory = make_storage_memory(body, storage_spec)
+        num_samples = 100
+        start = time.time()
+        for _ in range(num_samples):
+            memory.sample()
+        sps = num_samples / (time.time() - start)
+        print(f'storage: {name}, bytes/transition: {memory.get_nbytes_per_transition():.0f}, samples/s: {sps:.1f}')
+        memory.close()
+    body.observation_space = observation_space
+
+
+def test_memmap_storage(test_memory):
+    '''Tests that the memmap storage samples the same batches as the array storage, and that its files can be loaded'''
+    body = test_memory[0].body
+    memory_spec = {'name': 'Replay', 'batch_size': 32, 'max_size': 100, 'use_cer': False}
+    batches = {}
+    for storage in ['array', 'memmap']:
+        memory = Replay({**memory_spec, 'storage': storage, 'memmap_keys': ['states', 'rewards']}, body)
+        for i in range(150):  # wrap around
+            state = np.full(body.observation_space.shape, i)
+            memory.add_experience(state, 1, i, state + 1, i % 10 == 0)
+        np.random.seed(0)
+        batches[storage] = memory.sample()
+    for k, v in batches['array'].items():
+        assert np.array_equal(v, batches['memmap'][k])
+    memory.states.flush()
+    assert np.array_equal(np.load(memory.states.filename), memory.states)
+    assert isinstance(memory.rewards, np.memmap)
+    assert not isinstance(memory.dones, np.memmap)
+    # another memory of the session, e.g. SIL's extra replay memory, has its own files
+    other_memory = Replay({**memory_spec, 'storage': 'memmap'}, body)
+    assert other_memory.states.filename != memory.states.filename
+    filenames = [memory.states.filename, memory.rewards.filename, other_memory.states.filename]
+    memory.close()
+    other_memory.close()
+    assert not any(os.path.exists(filename) for filename in filenames)
+
+
+@pytest.mark.parametrize('num_exps', [3, 12])
+def test_add_batch(test_memory, num_exps):
+    '''Tests that add_batch results in the same memory and to_train as add_experience in a loop, including when the batch wraps the ring'''
+    memory = test_memory[0]
+    algorithm = memory.body.agent.algorithm
+    rng = np.random.RandomState(0)
+    states = rng.rand(num_exps, memory.body.state_dim)
+    next_states = states + 1
+    actions, rewards, dones = rng.randint(2, size=num_exps), rng.rand(num_exps), rng.rand(num_exps) < 0.3
+    results = []
+    for add_mode in ['loop', 'batch']:
+        memory.reset()
+        memory.seen_size = 0  # not reset with the memory
+        memory.add_experience(states[0], actions[0], rewards[0], next_states[0], dones[0])
+        algorithm.to_train = 0
+        if add_mode == 'loop':
+            for sarsd in zip(states, actions, rewards, next_states, dones):
+                memory.add_experience(*sarsd)
+        else:
+            memory.add_batch(states, actions, rewards, next_states, dones)
+        data = {k: np.array(getattr(memory, k)[:memory.size]) for k in ['states', 'actions', 'rewards', 'dones']}
+        results.append((data, memory.head, memory.size, memory.seen_size, list(memory.ns_buffer), algorithm.to_train))
+    loop_res, batch_res = results
+    for k, v in loop_res[0].items():
+        assert np.array_equal(v, batch_res[0][k])
+    assert loop_res[1:4] == batch_res[1:4]
+    assert np.array_equal(loop_res[4], batch_res[4])
+    assert loop_res[5] == batch_res[5]
+
+
+def test_save_load(test_memory):
+    '''Tests that the memory saved in chunks over several ckpts is restored by a new memory, and that overwritten chunks are deleted'''
+    memory = test_memory[0]
+    memory.reset()
+    experiences = test_memory[2]
+    for e in experiences[:3]:
+        memory.add_experience(*e)
+    memory.save()
+    memory.save()  # nothing new to save
+    assert memory.chunk_ranges == [(memory.seen_size - 3, memory.seen_size)]
+    for e in experiences * 2:  # wrap around so the first chunk is overwritten
+        memory.add_experience(*e)
+    memory.save()
+    assert len(memory.chunk_ranges) == 1
+    new_memory = Replay(memory.memory_spec, memory.body)
+    new_memory.batch_size = memory.batch_size
+    new_memory.load()
+    for k in ['head', 'size', 'seen_size', 'chunk_ranges']:
+        assert getattr(new_memory, k) == getattr(memory, k)
+    assert np.array_equal(new_memory.ns_buffer, memory.ns_buffer)
+    np.random.seed(0)
+    batch = memory.sample()
+    np.random.seed(0)
+    new_batch = new_memory.sample()
+    for k, v in batch.items():
+        assert np.array_equal(v, new_batch[k])
+
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('num_envs', [1, 3])
+@pytest.mark.parametrize('frame_op', ['concat', 'stack'])
+def test_frame_replay(test_memory, num_envs, frame_op, compress):
+    '''Tests that FrameReplay rebuilds the same stacked states and next_states as Replay stores, across episode boundaries and wrapping'''
+    frame_op_len = 4
+    frame_shape = (1, 2, 2) if frame_op == 'concat' else (2, 2)
+    is_venv = num_envs > 1
+    stack_shape = (frame_op_len * frame_shape[0],) + frame_shape[1:] if frame_op == 'concat' else (frame_op_len,) + frame_shape
+    env = SimpleNamespace(frame_op=frame_op, frame_op_len=frame_op_len, is_venv=is_venv, num_envs=num_envs)
+    body = SimpleNamespace(
+        env=env, agent=test_memory[0].body.agent,
+        observation_space=spaces.Box(low=0, high=255, shape=stack_shape, dtype=np.uint8),
+        action_space=spaces.Discrete(2))
+    memory_spec = {'batch_size': 64, 'max_size': 30 * num_envs, 'use_cer': True}
+    replay = Replay({**memory_spec, 'storage': 'array'}, body)
+    frame_replay = FrameReplay({**memory_spec, 'compress': compress, 'compress_codec': 'zlib'}, body)
+
+    def get_stacks(frames):
+        frames = list(frames)
+        return np.concatenate(frames, axis=0) if frame_op == 'concat' else np.stack(frames, axis=0)
+
+    rng = np.random.RandomState(0)
+    if is_venv:  # mimic VecFrameStack, which zero-pads a new episode
+        stacks = [deque([np.zeros(frame_shape)] * (frame_op_len - 1) + [rng.randint(256, size=frame_shape)], maxlen=frame_op_len) for _ in range(num_envs)]
+    else:  # mimic FrameStack, which repeats the first frame of a new episode
+        frame = rng.randint(256, size=frame_shape)
+        stacks = [deque([frame] * frame_op_len, maxlen=frame_op_len)]
+    for t in range(100):
+        dones = rng.rand(num_envs) < 0.1
+        states, next_states = [], []
+        for e in range(num_envs):
+            states.append(get_stacks(stacks[e]))
+            stacks[e].append(rng.randint(256, size=frame_shape))
+            if dones[e] and is_venv:
+                stacks[e] = deque([np.zeros(frame_shape)] * (frame_op_len - 1) + [stacks[e][-1]], maxlen=frame_op_len)
+            next_states.append(get_stacks(stacks[e]))
+            if dones[e] and not is_venv:
+                stacks[e] = deque([rng.randint(256, size=frame_shape)] * frame_op_len, maxlen=frame_op_len)
+        for memory in [replay, frame_replay]:
+            for sarsd in zip(states, np.zeros(num_envs), np.ones(num_envs), next_states, dones):
+                memory.add_experience(*sarsd)
+        if t % 10 == 0 or t == 99:
+            batch = frame_replay.sample()
+            replay.sample_idxs = lambda batch_size: frame_replay.batch_idxs
+            expected_batch = replay.sample()
+            for k, v in expected_batch.items():
+                assert np.array_equal(v, batch[k])
+    if not compress:  # the compression overhead outweighs these tiny frames
+        assert frame_replay.get_nbytes_per_transition() < replay.get_nbytes_per_transition()
+
+
+def test_sequence_replay():
+    '''Tests that FrameReplay rebuilds the seq_len state sequences of a recurrent spec from steps stored once'''
+    spec = spec_util.get('experimental/dqn/dqn_cartpole.json', 'drqn_boltzmann_cartpole')
+    spec_util.tick(spec, 'trial')
+    util.set_random_seed(spec)
+    agent, env = make_agent_env(spec)
+    frame_replay = agent.body.memory
+    assert isinstance(frame_replay, FrameReplay)
+    seq_len = spec['agent'][0]['net']['seq_len']
+    replay = Replay({**frame_replay.memory_spec, 'storage': 'array'}, agent.body)
+    state = env.reset()
+    for _ in range(200):
+        action = agent.body.action_space.sample()
+        next_state, reward, done, info = env.step(action)
+        for memory in [replay, frame_replay]:
+            memory.update(state, action, reward, next_state, done)
+        state = env.reset() if done else next_state
+    batch = frame_replay.sample()
+    assert batch['states'].shape == (frame_replay.batch_size,) + agent.body.observation_space.shape
+    assert agent.body.observation_space.shape[0] == seq_len
+    replay.sample_idxs = lambda batch_size: frame_replay.batch_idxs
+    expected_batch = replay.sample()
+    for k, v in expected_batch.items():
+        assert np.array_equal(v, batch[k])
+    assert frame_replay.states.nbytes * seq_len == replay.states.nbytes
+    env.close()
+
+
+@pytest.mark.parametrize('num_envs', [1, 3])
+def test_nstep_replay(num_envs):
+    '''Tests that NStepReplay samples the n-step returns, dones, discounts and bootstrap next_states of the env trajectories, across episode ends and wrapping'''
+    n_step, gamma, max_size, num_t = 3, 0.9, 20 * num_envs, 60
+    env = SimpleNamespace(is_venv=num_envs > 1, num_envs=num_envs)
+    algorithm = SimpleNamespace(to_train=0, training_start_step=0, training_frequency=1)
+    agent = SimpleNamespace(agent_spec={'algorithm': {'gamma': gamma}}, algorithm=algorithm)
+    body = SimpleNamespace(env=env, agent=agent, observation_space=spaces.Box(low=0, high=1000, shape=(1,)), action_space=spaces.Discrete(2))
+    memory = NStepReplay({'n_step': n_step, 'batch_size': 256, 'max_size': max_size, 'use_cer': False}, body)
+    rng = np.random.RandomState(0)
+    rewards, dones = rng.rand(num_t, num_envs), rng.rand(num_t, num_envs) < 0.15
+    states = 100 * np.arange(num_envs) + np.arange(num_t)[:, None]  # unique and exact in float16
+    for t in range(num_t):
+        sarsd = (states[t][:, None], np.zeros(num_envs), rewards[t], states[t][:, None] + 1, dones[t])
+        if env.is_venv:
+            memory.add_batch(*sarsd)
+        else:
+            memory.add_experience(*[x[0] for x in sarsd])
+    batch = memory.sample()
+    for i, idx in enumerate(memory.batch_idxs):
+        position = idx + max_size * ((memory.seen_size - 1 - idx) // max_size)  # the latest experience stored at idx
+        t, e = divmod(position, num_envs)
+        num_steps = min(n_step, num_t - t)
+        if dones[t:t + num_steps, e].any():
+            num_steps = np.argmax(dones[t:t + num_steps, e]) + 1
+        assert np.isclose(batch['rewards'][i], np.sum(gamma ** np.arange(num_steps) * rewards[t:t + num_steps, e]))
+        assert batch['dones'][i] == dones[t + num_steps - 1, e]
+        assert np.isclose(batch['discounts'][i], gamma ** num_steps)
+        assert batch['next_states'][i] == states[t + num_steps - 1, e] + 1
+
@@ -0,0 +1,50 @@
+from gym import spaces
+from slm_lab.agent.memory.shared import SharedPrioritizedReplay, SharedReplay
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import torch.multiprocessing as mp
+
+
+def add_experiences(memory, body, actor_idx, num_t, num_envs):
+    '''Actor process target: add experiences whose next_state is state + 1, with states unique per actor'''
+    memory.body = body  # the memory is pickled without its body, as for an Agent
+    for t in range(num_t):
+        states = (1000 * actor_idx + 10 * t + np.arange(num_envs))[:, None]
+        sarsd = (states, np.zeros(num_envs, dtype=int), np.ones(num_envs), states + 1, np.zeros(num_envs))
+        if num_envs > 1:
+            memory.add_batch(*sarsd)
+        else:
+            memory.add_experience(*[x[0] for x in sarsd])
+
+
+@pytest.mark.parametrize('MemoryClass', [SharedReplay, SharedPrioritizedReplay])
+@pytest.mark.parametrize('num_envs', [1, 3])
+@pytest.mark.parametrize('context', ['fork', 'spawn'])  # run_lab uses spawn
+def test_shared_memory(MemoryClass, num_envs, context):
+    '''Tests that the experiences added by the actor processes are seen and sampled by the parent, with their own next_states'''
+    num_actors, num_t = 2, 30
+    env = SimpleNamespace(is_venv=num_envs > 1, num_envs=num_envs)
+    algorithm = SimpleNamespace(to_train=0, training_start_step=0, training_frequency=1)
+    agent = SimpleNamespace(algorithm=algorithm)
+    body = SimpleNamespace(env=env, agent=agent, observation_space=spaces.Box(low=0, high=10000, shape=(1,)), action_space=spaces.Discrete(2))
+    memory_spec = {'batch_size': 64, 'max_size': 1000, 'use_cer': False, 'alpha': 0.6, 'epsilon': 0.0001}
+    memory = MemoryClass(memory_spec, body)
+    ctx = mp.get_context(context)
+    workers = [ctx.Process(target=add_experiences, args=(memory, body, idx, num_t, num_envs)) for idx in range(num_actors)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+        assert w.exitcode == 0
+    num_exps = num_actors * num_t * num_envs
+    assert memory.size == memory.seen_size == num_exps
+    assert memory.head == num_exps - 1
+    assert sorted(memory.states[:num_exps, 0]) == sorted(1000 * a + 10 * t + e for a in range(num_actors) for t in range(num_t) for e in range(num_envs))
+    batch = memory.sample()
+    assert np.all(batch['next_states'] == batch['states'] + 1)
+    if MemoryClass is SharedPrioritizedReplay:
+        assert memory.tree.write == num_exps
+        assert np.isclose(memory.tree.total(), num_exps * memory.get_priority(100000))
+        memory.update_priorities(np.zeros(memory.batch_size))
+        assert memory.tree.total() < num_exps * memory.get_priority(100000)
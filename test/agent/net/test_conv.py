@@ -56,6 +56,16 @@ def test_forward():
     assert y.shape == (batch_size, out_dim)
 
 
+def test_forward_uint8():
+    normalize_net_spec = deepcopy(net_spec)
+    normalize_net_spec['normalize'] = True
+    net = ConvNet(normalize_net_spec, in_dim, out_dim)
+    x_uint8 = torch.randint(256, (batch_size,) + in_dim, dtype=torch.uint8)
+    y = net.forward(x_uint8)
+    assert y.dtype == torch.float32
+    assert torch.allclose(y, net.forward(x_uint8.float()))
+
+
 def test_train_step():
     y = torch.rand((batch_size, out_dim))
     clock = Clock(100, 1)
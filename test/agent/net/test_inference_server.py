@@ -0,0 +1,54 @@
+from slm_lab.agent.net.inference_server import InferenceServer
+from slm_lab.experiment.control import make_agent_env
+from slm_lab.lib import util
+from slm_lab.spec import spec_util
+import pytest
+import threading
+import torch
+
+
+@pytest.mark.parametrize('spec_file,spec_name', [
+    ('demo.json', 'dqn_cartpole'),
+    ('experimental/a3c/a3c_cartpole.json', 'a3c_gae_shared_cartpole'),
+    ('experimental/a2c/a2c_pendulum.json', 'a2c_shared_pendulum'),
+])
+def test_inference_server(spec_file, spec_name):
+    '''Tests that the batched pdparams served to concurrent clients are the same as their own forward passes'''
+    spec = spec_util.get(spec_file, spec_name)
+    spec = spec_util.override_spec(spec, 'test')
+    spec['env'][0]['num_envs'] = 4
+    spec_util.tick(spec, 'trial')
+    spec_util.tick(spec, 'session')
+    util.set_random_seed(spec)
+    agent, env = make_agent_env(spec)
+    algorithm = agent.algorithm
+    num_clients = 3
+    inference_server = InferenceServer(algorithm, num_clients)
+    inference_server.start()
+    torch.manual_seed(0)
+    states = [torch.rand((idx + 2,) + agent.body.observation_space.shape) for idx in range(num_clients)]  # different batch sizes per client
+    pdparams = [[] for _ in range(num_clients)]
+
+    def run_client(idx):
+        inference_client = inference_server.get_client(idx)
+        for _ in range(20):
+            pdparams[idx].append(inference_client.calc_pdparam(states[idx]))
+
+    threads = [threading.Thread(target=run_client, args=(idx,)) for idx in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    inference_server.stop()
+    env.close()
+    assert inference_server.num_requests == num_clients * 20
+    assert inference_server.num_batches <= inference_server.num_requests
+    for idx in range(num_clients):
+        with torch.no_grad():
+            expected_pdparam = algorithm.calc_pdparam(states[idx])
+        for pdparam in pdparams[idx]:
+            if isinstance(expected_pdparam, list):
+                for out, expected_out in zip(pdparam, expected_pdparam):
+                    assert torch.allclose(out, expected_out, atol=1e-6)
+            else:
+                assert torch.allclose(pdparam, expected_pdparam, atol=1e-6)
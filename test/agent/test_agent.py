@@ -0,0 +1,34 @@
+from slm_lab.agent import MetricsLog
+from slm_lab.lib import viz
+import numpy as np
+import pandas as pd
+
+
+def test_metrics_log():
+    '''Tests that MetricsLog matches the DataFrame appends with rolling total_reward_ma and frame deduplication'''
+    columns = ['frame', 'total_reward', 'total_reward_ma', 'loss']
+    metrics_log = MetricsLog(columns, capacity=4)  # small capacity to test growth
+    df = pd.DataFrame(columns=columns)
+    rng = np.random.RandomState(0)
+    frame = 0
+    for i in range(3 * viz.PLOT_MA_WINDOW):
+        if rng.rand() > 0.1:  # else duplicate the last frame
+            frame += 100
+        total_reward = np.nan if rng.rand() < 0.2 else rng.randn()
+        row = {'frame': frame, 'total_reward': total_reward, 'total_reward_ma': np.nan, 'loss': rng.rand()}
+        total_reward_ma = metrics_log.append(row)
+
+        df.loc[len(df)] = pd.Series(row, dtype=np.float32)
+        expected_total_reward_ma = df[-viz.PLOT_MA_WINDOW:]['total_reward'].astype(np.float64).mean()
+        df.iloc[-1, df.columns.get_loc('total_reward_ma')] = expected_total_reward_ma
+        df.drop_duplicates('frame', inplace=True)
+        df.reset_index(drop=True, inplace=True)
+        np.testing.assert_allclose(total_reward_ma, expected_total_reward_ma, rtol=1e-5)
+    assert len(metrics_log) == len(df)
+    np.testing.assert_allclose(metrics_log.to_df().values, df.values.astype(np.float32), rtol=1e-5)
+
+    # resume from the saved df
+    loaded_log = MetricsLog(columns)
+    loaded_log.load_df(metrics_log.to_df())
+    row = {'frame': frame + 100, 'total_reward': 1.0, 'total_reward_ma': np.nan, 'loss': 0.0}
+    np.testing.assert_allclose(loaded_log.append(row), metrics_log.copy().append(row), rtol=1e-5)
@@ -68,11 +68,13 @@ def test_str():
             [np.asarray([6, 6, 6, 6]), 1, 6, np.asarray([7, 7, 7, 7]), 6],
             [np.asarray([7, 7, 7, 7]), 1, 7, np.asarray([8, 8, 8, 8]), 7],
             [np.asarray([8, 8, 8, 8]), 1, 8, np.asarray([9, 9, 9, 9]), 8],
-        ]
-    ),
+        ],
+        storage,
+    ) for storage in ['list', 'array', 'memmap']
 ])
 def test_memory(request):
     spec = spec_util.get('experimental/misc/base.json', 'base_memory')
+    spec['agent'][0]['memory']['storage'] = request.param[2]
     spec_util.tick(spec, 'trial')
     agent, env = make_agent_env(spec)
     res = (agent.body.memory, ) + request.param
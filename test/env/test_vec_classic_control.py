@@ -0,0 +1,51 @@
+from functools import partial
+from slm_lab.env.vec_classic_control import NUMPY_VEC_ENVS
+from slm_lab.env.vec_env import DummyVecEnv, ShmemVecEnv, make_gym_venv
+from slm_lab.env.wrapper import make_gym_env
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('name', list(NUMPY_VEC_ENVS))
+def test_numpy_vec_env(name):
+    '''Tests that a numpy vector env steps, terminates and auto-resets the same as the gym envs with the same seeds'''
+    num_envs, num_steps = 4, 600
+    venv = NUMPY_VEC_ENVS[name](name, num_envs, seed=0)
+    gym_venv = DummyVecEnv([partial(make_gym_env, name, i, track_reward=False) for i in range(num_envs)])
+    assert venv.observation_space == gym_venv.observation_space
+    assert venv.action_space == gym_venv.action_space
+    assert np.allclose(venv.reset(), gym_venv.reset())
+    rng = np.random.RandomState(0)
+    num_dones = 0
+    for t in range(num_steps):
+        if name.startswith('Pendulum'):
+            actions = rng.uniform(-2, 2, size=(num_envs, 1))
+        elif name.startswith('MountainCar'):  # push along the velocity to reach the goal
+            actions = np.where(venv.state[:, 1] < 0, 0, 2)
+        else:
+            actions = rng.randint(venv.action_space.n, size=num_envs)
+        state, reward, done, _info = venv.step(actions)
+        gym_state, gym_reward, gym_done, _gym_info = gym_venv.step(actions)
+        assert np.allclose(state, gym_state, atol=1e-5)
+        assert np.allclose(reward, gym_reward)
+        assert np.array_equal(done, gym_done)
+        num_dones += done.sum()
+    assert num_dones > 0
+    venv.close()
+    gym_venv.close()
+
+
+def test_make_gym_venv_numpy():
+    venv = make_gym_venv('CartPole-v0', 4, 0)
+    assert isinstance(venv.unwrapped, ShmemVecEnv)  # gym by default
+    venv.close()
+    with pytest.raises(ValueError):
+        make_gym_venv('LunarLander-v2', 4, 0, numpy_vec=True)
+    venv = make_gym_venv('CartPole-v0', 4, 0, frame_op='concat', frame_op_len=4, reward_scale=2.0, numpy_vec=True)
+    assert isinstance(venv.unwrapped, NUMPY_VEC_ENVS['CartPole-v0'])
+    state = venv.reset()
+    assert state.shape == (4, 16)
+    state, reward, done, info = venv.step([0] * 4)
+    assert state.shape == (4, 16)
+    assert np.all(reward == 2.0)
+    venv.close()
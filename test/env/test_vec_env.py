@@ -1,6 +1,10 @@
-from slm_lab.env.vec_env import make_gym_venv
+from functools import partial
+from slm_lab.env.vec_env import SHMEM_INFO_KEYS, DummyVecEnv, EnvPool, ShmemVecEnv, VecFrameStack, VecNormalizeState, VecTrackReward, get_vec_wrapper, make_gym_venv
+from slm_lab.env.wrapper import make_gym_env
 import numpy as np
+import pickle
 import pytest
+import torch.multiprocessing as mp
 
 
 @pytest.mark.parametrize('name,state_shape,reward_scale', [
@@ -102,3 +106,256 @@ def test_make_gym_venv_downsize(name, num_envs, state_shape, image_downsize):
     assert done.shape == (num_envs,)
     assert len(info) == num_envs
     venv.close()
+
+
+@pytest.mark.parametrize('num_workers', (None, 2, 3))
+@pytest.mark.parametrize('copy_obs', (True, False))
+def test_shmem_vec_env(copy_obs, num_workers):
+    '''Tests that ShmemVecEnv steps the same as DummyVecEnv, and returns either copies or the shared views'''
+    num_envs = 4
+    env_fns = [partial(make_gym_env, 'CartPole-v0', i) for i in range(num_envs)]
+    venv = ShmemVecEnv(env_fns, context='fork', copy_obs=copy_obs, num_workers=num_workers)
+    assert len(venv.procs) == (num_workers or num_envs)
+    dummy_venv = DummyVecEnv(env_fns)
+    state = venv.reset()
+    assert np.array_equal(state, dummy_venv.reset())
+    for i in range(20):
+        actions = [i % 2] * num_envs
+        state, reward, done, info = venv.step(actions)
+        dummy_state, dummy_reward, dummy_done, dummy_info = dummy_venv.step(actions)
+        assert np.array_equal(state, dummy_state)
+        assert np.array_equal(reward, dummy_reward)
+        assert np.array_equal(done, dummy_done)
+        for e in range(num_envs):
+            assert info[e] == {k: v for k, v in dummy_info[e].items() if k in SHMEM_INFO_KEYS}
+    assert np.shares_memory(state, venv.obs_views[None]) != copy_obs
+    venv.close()
+    dummy_venv.close()
+
+
+@pytest.mark.parametrize('num_workers', (None, 2))
+def test_shmem_vec_env_async(num_workers):
+    '''Tests that async stepping gives each env the same trajectory as sync stepping'''
+    num_envs = 4
+    num_steps = 20
+    env_fns = [partial(make_gym_env, 'CartPole-v0', i) for i in range(num_envs)]
+    venv = ShmemVecEnv(env_fns, context='fork', num_workers=num_workers, async_batch_size=1)
+    dummy_venv = DummyVecEnv(env_fns)
+    dummy_states = [dummy_venv.reset()]
+    for t in range(num_steps):
+        dummy_states.append(dummy_venv.step([t % 2] * num_envs)[0])
+
+    state = venv.reset()
+    env_ts = np.zeros(num_envs, dtype=int)
+    venv.step_send([0] * num_envs, np.arange(num_envs))
+    while True:
+        state, reward, done, info, env_ids = venv.step_recv()
+        assert len(env_ids) >= 1
+        env_ts[env_ids] += 1
+        for i, e in enumerate(env_ids):
+            assert np.array_equal(state[i], dummy_states[env_ts[e]][e])
+        send_ids = np.array([e for e in env_ids if env_ts[e] < num_steps])
+        if len(send_ids):
+            venv.step_send(env_ts[send_ids] % 2, send_ids)
+        elif not venv.is_stepping.any():
+            break
+    assert np.all(env_ts == num_steps)
+    venv.close()
+    dummy_venv.close()
+
+
+@pytest.mark.parametrize('frame_op', ('concat', 'stack'))
+def test_vec_frame_stack(frame_op):
+    '''Tests that the ring-indexed VecFrameStack returns the same stacks as shifting the frames, zero-padded at episode starts'''
+    num_envs, frame_op_len = 3, 4
+    env_fns = [partial(make_gym_env, 'CartPole-v0', i) for i in range(num_envs)]
+    venv = VecFrameStack(DummyVecEnv(env_fns), frame_op, frame_op_len)
+    dummy_venv = DummyVecEnv(env_fns)
+    frames = np.zeros((num_envs, frame_op_len) + dummy_venv.observation_space.shape, dtype=np.float32)
+    frames[:, -1] = dummy_venv.reset()
+    state = venv.reset()
+    num_dones = 0
+    for t in range(100):
+        assert state.shape == (num_envs,) + venv.observation_space.shape
+        assert np.array_equal(state, frames.reshape(state.shape))
+        actions = [t % 2] * num_envs
+        state, _reward, done, _info = venv.step(actions)
+        dummy_state, _reward, dummy_done, _info = dummy_venv.step(actions)
+        frames = np.roll(frames, -1, axis=1)
+        frames[dummy_done] = 0
+        frames[:, -1] = dummy_state
+        num_dones += dummy_done.sum()
+    assert num_dones > 0
+    venv.close()
+    dummy_venv.close()
+
+
+def test_vec_normalize_state():
+    num_envs = 4
+    venv = make_gym_venv('CartPole-v0', num_envs, 0, frame_op='concat', frame_op_len=4, normalize_state=True)
+    normalizer = get_vec_wrapper(venv, VecNormalizeState)
+    assert normalizer is not None
+    # the stats match those of all the raw states seen, updated a batch at a time; copy the raw states since the shmem buffers are reused
+    raw_states = [normalizer.venv.reset().copy()]
+    normalizer.update_stats(raw_states[0])
+    for _ in range(20):
+        raw_state = normalizer.venv.step([venv.action_space.sample()] * num_envs)[0].copy()
+        normalizer.update_stats(raw_state)
+        raw_states.append(raw_state)
+    raw_states = np.concatenate(raw_states)
+    assert np.allclose(normalizer.state_mean, raw_states.mean(axis=0))
+    assert np.allclose(normalizer.state_var, raw_states.var(axis=0), rtol=1e-4)
+    state = venv.reset()
+    assert state.shape == (num_envs, 16)
+    assert state.dtype == np.float32
+    assert np.all(np.abs(state) <= normalizer.clip)
+    # frozen stats are shared and not updated
+    eval_venv = make_gym_venv('CartPole-v0', num_envs, 1, normalize_state=True)
+    eval_normalizer = get_vec_wrapper(eval_venv, VecNormalizeState)
+    eval_normalizer.is_frozen = True
+    eval_normalizer.share_stats(normalizer)
+    stats = {k: v.copy() for k, v in normalizer.get_stats().items()}
+    eval_venv.reset()
+    eval_venv.step([venv.action_space.sample()] * num_envs)
+    assert all(np.array_equal(v, stats[k]) for k, v in normalizer.get_stats().items())
+    venv.step([venv.action_space.sample()] * num_envs)
+    assert eval_normalizer.count == normalizer.count == stats['count'] + num_envs
+    # the stats can be restored in place
+    eval_normalizer.load_stats(stats)
+    assert normalizer.count == stats['count']
+    venv.close()
+    eval_venv.close()
+
+
+def test_vec_track_reward():
+    '''Tests that VecTrackReward tracks the same unscaled returns as a TrackReward in every env, and keeps the completed episodes in order'''
+    num_envs = 4
+    venv = make_gym_venv('CartPole-v0', num_envs, 0, reward_scale=2.0)
+    tracker = get_vec_wrapper(venv, VecTrackReward)
+    dummy_venv = DummyVecEnv([partial(make_gym_env, 'CartPole-v0', i) for i in range(num_envs)])
+    venv.reset()
+    dummy_venv.reset()
+    num_dones = 0
+    for t in range(100):
+        actions = [t % 2] * num_envs
+        _state, reward, done, _info = venv.step(actions)
+        _dummy_state, dummy_reward, dummy_done, dummy_info = dummy_venv.step(actions)
+        assert np.array_equal(reward, 2.0 * dummy_reward)
+        assert np.array_equal(tracker.total_reward, [info['total_reward'] for info in dummy_info], equal_nan=True)
+        num_dones += done.sum()
+    assert num_dones > 0
+    assert tracker.num_epis == num_dones
+    epi_returns, epi_lens = tracker.get_epi_stats()
+    assert len(epi_returns) == len(epi_lens) == num_dones
+    assert np.array_equal(epi_returns, epi_lens)  # CartPole rewards 1 per step
+    # the ring keeps only the last buffer_size episodes
+    tracker = VecTrackReward(dummy_venv, buffer_size=2)
+    tracker.track(np.ones(num_envs), np.zeros(num_envs, dtype=bool), [{}] * num_envs, np.arange(num_envs))
+    tracker.track(np.ones(2), np.ones(2, dtype=bool), [{}] * 2, np.array([1, 2]))
+    tracker.track(np.ones(num_envs), np.array([True, True, False, True]), [{}, {'was_real_done': False}, {}, {}], np.arange(num_envs))
+    epi_returns, epi_lens = tracker.get_epi_stats()
+    assert np.array_equal(epi_lens, [2, 2])  # envs 0, 3; the lost life of env 1 is not an episode end
+    assert np.array_equal(tracker.total_reward, [2, 2, 2, 2])
+    assert np.array_equal(tracker.tracked_len, [0, 1, 1, 0])
+    venv.close()
+    dummy_venv.close()
+
+
+def step_dead_venv(venv, killed):
+    '''Forked process target: step the inherited venv once its worker was killed'''
+    killed.wait()
+    assert venv.procs[0].exitcode is None  # only the parent can wait on the worker
+    with pytest.raises(RuntimeError, match='died'):
+        venv.step([0] * venv.num_envs)
+
+
+def test_shmem_vec_env_dead_worker():
+    '''Tests that stepping a venv whose worker died raises instead of hanging, also in a forked process which inherited the venv'''
+    num_envs = 2
+    env_fns = [partial(make_gym_env, 'CartPole-v0', i) for i in range(num_envs)]
+    venv = ShmemVecEnv(env_fns, context='fork')
+    venv.reset()
+    ctx = mp.get_context('fork')
+    killed = ctx.Event()
+    w = ctx.Process(target=step_dead_venv, args=(venv, killed))
+    w.start()
+    venv.procs[0].kill()
+    venv.procs[0].join()
+    killed.set()
+    w.join()
+    assert w.exitcode == 0
+    with pytest.raises(RuntimeError, match='died'):
+        venv.step([0] * num_envs)
+    venv.procs[1].kill()
+    venv.procs[1].join()
+    venv.closed = True  # the workers are gone, nothing left to close
+
+
+def step_leased_venv(pool, env_fns, seeds, pids):
+    '''Forked session process target: lease the warm venv from the inherited pool and step it'''
+    venv = pool.lease('CartPole', env_fns, seeds)
+    assert [proc.pid for proc in venv.procs] == pids
+    assert np.array_equal(venv.reset(), DummyVecEnv([partial(make_gym_env, 'CartPole-v0', seed) for seed in seeds]).reset())
+    venv.step([0] * len(seeds))
+    venv.close()
+    pool.close()
+
+
+def test_env_pool():
+    '''Tests that EnvPool reuses the reseeded workers of a released venv, also in a forked process, and closes them'''
+    num_envs = 4
+    env_fns = [partial(make_gym_env, 'CartPole-v0', i) for i in range(num_envs)]
+    pool = EnvPool()
+    venv = pool.lease('CartPole', env_fns, list(range(num_envs)), num_workers=2)
+    pids = [proc.pid for proc in venv.procs]
+    venv.reset()
+    venv.step([0] * num_envs)
+    venv.close()
+    venv.close()  # closing twice releases once
+    assert len(pool.idle_venvs['CartPole']) == 1
+    # a pool pickled for a spawned process only carries the spaces cache
+    spawned_pool = pickle.loads(pickle.dumps(pool))
+    assert list(spawned_pool.env_spaces) == ['CartPole'] and not spawned_pool.idle_venvs
+    seeds = [10 + i for i in range(num_envs)]
+    venv = pool.lease('CartPole', env_fns, seeds)
+    assert [proc.pid for proc in venv.procs] == pids
+    assert np.array_equal(venv.reset(), DummyVecEnv([partial(make_gym_env, 'CartPole-v0', seed) for seed in seeds]).reset())
+    venv.close()
+    # a forked process takes the idle venv, then the next lease spawns new workers with the cached spaces
+    w = mp.Process(target=step_leased_venv, args=(pool, env_fns, [20 + i for i in range(num_envs)], pids))
+    w.start()
+    pool.lend_idle()
+    new_venv = pool.lease('CartPole', env_fns, list(range(num_envs)))
+    assert new_venv is not venv
+    w.join()
+    assert w.exitcode == 0
+    new_venv.close()
+    pool.close()
+    assert venv.closed and new_venv.closed
+    assert not any(proc.is_alive() for proc in venv.procs + new_venv.procs)
+
+
+def test_env_pool_train_eval_lease():
+    '''Tests that an eval env of fewer envs and without episode_life leases a subset of the warm workers of a released train env'''
+    name = 'MountainCarContinuous-v0'
+    pool = EnvPool()
+    venv = make_gym_venv(name, num_envs=4, episode_life=True, env_pool=pool)
+    train_venv = venv.unwrapped
+    pids = [proc.pid for proc in train_venv.procs]
+    venv.reset()
+    venv.step([venv.action_space.sample() for _ in range(4)])
+    venv.close()
+    eval_venv = make_gym_venv(name, num_envs=2, seed=10, episode_life=False, env_pool=pool)
+    assert eval_venv.unwrapped is train_venv
+    assert eval_venv.num_envs == 2 and [proc.pid for proc in train_venv.procs] == pids[:2]
+    state = eval_venv.reset()
+    assert np.array_equal(state, DummyVecEnv([partial(make_gym_env, name, 10 + i) for i in range(2)]).reset())
+    state, reward, done, info = eval_venv.step([eval_venv.action_space.sample() for _ in range(2)])
+    assert state.shape == (2, 2) and reward.shape == (2,)
+    eval_venv.close()
+    # the full train env is leased again
+    venv = make_gym_venv(name, num_envs=4, env_pool=pool)
+    assert venv.unwrapped is train_venv and venv.num_envs == 4
+    venv.close()
+    pool.close()
+    assert not any(proc.is_alive() for proc in train_venv.all_procs)
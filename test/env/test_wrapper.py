@@ -47,6 +47,8 @@ def test_make_gym_env_concat(name, state_shape, reward_scale):
     stack_shape = (frame_op_len * state_shape[0],) + state_shape[1:]
     assert state.shape == stack_shape
     assert state.shape == env.observation_space.shape
+    if env.observation_space.dtype == np.uint8:  # image frames stay uint8
+        assert state.dtype == np.uint8
     assert isinstance(reward, float)
     assert isinstance(done, bool)
     assert isinstance(info, dict)
@@ -16,6 +16,37 @@ def test_session(test_spec):
     assert isinstance(session_metrics, dict)
 
 
+@pytest.mark.parametrize('num_workers', (2, 4))
+def test_session_async(num_workers):
+    spec = spec_util.get('demo.json', 'dqn_cartpole')
+    spec_util.save(spec, unit='experiment')
+    spec = spec_util.override_spec(spec, 'test')
+    spec['env'][0].update({'num_envs': 4, 'num_workers': num_workers, 'async_batch_size': 2, 'max_frame': 400})
+    spec['agent'][0]['memory']['max_size'] = 1000
+    spec_util.tick(spec, 'trial')
+    spec_util.tick(spec, 'session')
+    session = Session(spec)
+    assert session.env.is_async
+    session.run_rl()
+    assert session.env.clock.frame == 400
+    assert session.agent.body.memory.seen_size == 400
+    session.close()
+
+
+def test_session_async_on_policy():
+    spec = spec_util.get('experimental/a2c/a2c_cartpole.json', 'a2c_shared_cartpole')
+    spec_util.save(spec, unit='experiment')
+    spec = spec_util.override_spec(spec, 'test')
+    spec['env'][0].update({'num_envs': 4, 'num_workers': 2, 'async_batch_size': 2, 'max_frame': 400})
+    spec_util.tick(spec, 'trial')
+    spec_util.tick(spec, 'session')
+    session = Session(spec)
+    session.run_rl()
+    assert session.env.async_max_lag == 1  # on-policy actions are not stale
+    assert session.env.clock.frame == 400
+    session.close()
+
+
 def test_trial(test_spec):
     spec_util.tick(test_spec, 'trial')
     spec_util.save(test_spec, unit='trial')
@@ -24,6 +55,31 @@ def test_trial(test_spec):
     assert isinstance(trial_metrics, dict)
 
 
+def test_trial_inference_server():
+    spec = spec_util.get('experimental/a3c/a3c_cartpole.json', 'a3c_nstep_shared_cartpole')
+    spec_util.save(spec, unit='experiment')
+    spec = spec_util.override_spec(spec, 'test')
+    spec['meta'].update({'distributed': 'shared', 'inference_server': True, 'max_session': 2})
+    spec_util.tick(spec, 'trial')
+    trial = Trial(spec)
+    trial_metrics = trial.run()
+    assert isinstance(trial_metrics, dict)
+    assert trial.inference_server.num_requests > 0
+
+
+def test_trial_apex():
+    spec = spec_util.get('experimental/dqn/apex_dqn_cartpole.json', 'apex_dqn_per_cartpole')
+    spec_util.save(spec, unit='experiment')
+    spec = spec_util.override_spec(spec, 'test')
+    spec['meta']['max_session'] = 2
+    spec_util.tick(spec, 'trial')
+    trial = Trial(spec)
+    trial_metrics = trial.run()
+    assert isinstance(trial_metrics, dict)
+    assert trial.apex_learner.agent.body.memory.seen_size == 40  # max_frame of all the actors
+    assert trial.apex_learner.num_train_steps > 0
+
+
 def test_trial_demo():
     spec = spec_util.get('demo.json', 'dqn_cartpole')
     spec_util.save(spec, unit='experiment')
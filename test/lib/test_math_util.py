@@ -1,6 +1,8 @@
 from slm_lab.lib import math_util
 import numpy as np
+import os
 import pytest
+import time
 import torch
 
 
@@ -44,6 +46,84 @@ def test_calc_gaes():
     assert torch.allclose(gaes, res)
 
 
+def loop_calc_returns(rewards, dones, gamma):
+    '''Reference python loop implementation of calc_returns'''
+    rets = torch.zeros_like(rewards)
+    future_ret = torch.tensor(0.0, dtype=rewards.dtype)
+    not_dones = 1 - dones
+    for t in reversed(range(len(rewards))):
+        rets[t] = future_ret = rewards[t] + gamma * future_ret * not_dones[t]
+    return rets
+
+
+def loop_calc_nstep_returns(rewards, dones, next_v_pred, gamma, n):
+    '''Reference python loop implementation of calc_nstep_returns'''
+    rets = torch.zeros_like(rewards)
+    future_ret = next_v_pred
+    not_dones = 1 - dones
+    for t in reversed(range(n)):
+        rets[t] = future_ret = rewards[t] + gamma * future_ret * not_dones[t]
+    return rets
+
+
+def loop_calc_gaes(rewards, dones, v_preds, gamma, lam):
+    '''Reference python loop implementation of calc_gaes'''
+    gaes = torch.zeros_like(rewards)
+    future_gae = torch.tensor(0.0, dtype=rewards.dtype)
+    not_dones = 1 - dones
+    deltas = rewards + gamma * v_preds[1:] * not_dones - v_preds[:-1]
+    coef = gamma * lam
+    for t in reversed(range(len(rewards))):
+        gaes[t] = future_gae = deltas[t] + coef * not_dones[t] * future_gae
+    return gaes
+
+
+def get_discounted_cumsum_calcs(T, num_envs):
+    '''Get the kernel-based advantage functions, their python loops and their args on random data of T steps of num_envs envs'''
+    shape = [T] if num_envs is None else [T, num_envs]
+    torch.manual_seed(0)
+    rewards = torch.randn(shape)
+    dones = (torch.rand(shape) < 0.05).float()
+    v_preds = torch.randn([T + 1] + shape[1:])
+    next_v_pred = torch.randn([1] if num_envs is None else [num_envs])
+    gamma = 0.99
+    lam = 0.95
+    n = T
+    return {
+        'returns': (math_util.calc_returns, loop_calc_returns, (rewards, dones, gamma)),
+        'nstep_returns': (math_util.calc_nstep_returns, loop_calc_nstep_returns, (rewards, dones, next_v_pred, gamma, n)),
+        'gaes': (math_util.calc_gaes, loop_calc_gaes, (rewards, dones, v_preds, gamma, lam)),
+    }
+
+
+@pytest.mark.parametrize('T, num_envs', [
+    (2048, None),  # e.g. ppo single env
+    (128, 16),  # e.g. a2c/ppo atari venv
+])
+def test_discounted_cumsum(T, num_envs):
+    '''Check that the kernel-based advantage functions are bit-compatible with the python loops'''
+    for name, (calc_fn, loop_calc_fn, args) in get_discounted_cumsum_calcs(T, num_envs).items():
+        assert torch.equal(calc_fn(*args), loop_calc_fn(*args)), name
+
+
+@pytest.mark.skipif(not os.environ.get('BENCHMARK'), reason='benchmark, run with BENCHMARK=1 pytest -s')
+@pytest.mark.parametrize('T, num_envs', [
+    (2048, None),
+    (128, 16),
+])
+def test_discounted_cumsum_benchmark(T, num_envs):
+    '''Compare the speed of the kernel-based advantage functions and the python loops'''
+    num_reps = 10
+    for name, (calc_fn, loop_calc_fn, args) in get_discounted_cumsum_calcs(T, num_envs).items():
+        times = []
+        for fn in (calc_fn, loop_calc_fn):
+            start = time.time()
+            for _ in range(num_reps):
+                fn(*args)
+            times.append((time.time() - start) / num_reps)
+        print(f'{name} T: {T}, num_envs: {num_envs}, kernel: {times[0] * 1e3:.2f}ms, loop: {times[1] * 1e3:.2f}ms')
+
+
 @pytest.mark.parametrize('start_val, end_val, start_step, end_step, step, correct', [
     (0.1, 0.0, 0, 100, 0, 0.1),
     (0.1, 0.0, 0, 100, 50, 0.05),
@@ -5,6 +5,7 @@ import os
 import pandas as pd
 import pydash as ps
 import pytest
+import torch
 
 
 def test_calc_ts_diff():
@@ -113,6 +114,18 @@ def test_smart_path():
     assert util.smart_path(abs_path, as_dir=True) == os.path.dirname(abs_path)
 
 
+def test_to_torch_batch():
+    batch = {
+        'states': np.zeros((4, 1, 84, 84), dtype=np.uint8),
+        'rewards': np.ones(4, dtype=np.float16),
+        'dones': [0, 0, 1, 0],
+    }
+    batch = util.to_torch_batch(batch, torch.device('cpu'), is_episodic=False)
+    assert batch['states'].dtype == torch.uint8  # image states are converted by the net
+    assert batch['rewards'].dtype == torch.float32
+    assert batch['dones'].dtype == torch.float32
+
+
 @pytest.mark.parametrize('filename,dtype', [
     ('test_df.csv', pd.DataFrame),
 ])